@@ -14,7 +14,22 @@
 import inspect
 
 import numpy as np
-import scipy.stats
+
+from scripts import ks_binned, ks_null, ks_workers
+from scripts.quadrants import quadrant_counts
+from scripts.lattice import WeightedSample, as_weighted
+
+# scipy is only imported by FuncQuads, which needs its numerical integration,
+# so the sample-based tests load quickly in fresh worker processes.
+
+
+def PearsonR(x, y):
+    """Pearson correlation coefficient of x and y.
+
+    :param array x, y: 1D arrays of the same length.
+    :returns: a float. The correlation coefficient.
+    """
+    return np.corrcoef(x, y)[0, 1]
 
 
 def CountQuads(Arr2D, point):
@@ -50,16 +65,19 @@ def CountQuads(Arr2D, point):
         raise TypeError("Input Arr2D is not 2D")
     # The pp of Qpp refer to p for 'positive' and n for 'negative' quadrants.
     # In order. first subscript is x, second is y.
-    Qpp = Arr2D[(Arr2D[:, 0] > point[0]) & (Arr2D[:, 1] > point[1]), :]
-    Qnp = Arr2D[(Arr2D[:, 0] < point[0]) & (Arr2D[:, 1] > point[1]), :]
-    Qpn = Arr2D[(Arr2D[:, 0] > point[0]) & (Arr2D[:, 1] < point[1]), :]
-    Qnn = Arr2D[(Arr2D[:, 0] < point[0]) & (Arr2D[:, 1] < point[1]), :]
+    # Only the counts are needed, so the masks are never used to copy points.
+    xp, xn = Arr2D[:, 0] > point[0], Arr2D[:, 0] < point[0]
+    yp, yn = Arr2D[:, 1] > point[1], Arr2D[:, 1] < point[1]
+    Qpp = np.count_nonzero(xp & yp)
+    Qnp = np.count_nonzero(xn & yp)
+    Qpn = np.count_nonzero(xp & yn)
+    Qnn = np.count_nonzero(xn & yn)
     # Normalized fractions:
     ff = 1.0 / len(Arr2D)
-    fpp = len(Qpp) * ff
-    fnp = len(Qnp) * ff
-    fpn = len(Qpn) * ff
-    fnn = len(Qnn) * ff
+    fpp = Qpp * ff
+    fnp = Qnp * ff
+    fpn = Qpn * ff
+    fnn = Qnn * ff
     # NOTE:  all the f's are supposed to sum to 1.0. Float representation
     # cause SOMETIMES sum to 1.000000002 or something. I don't know how to
     # test for that reliably, OR what to do about it yet. Keep in mind.
@@ -116,6 +134,8 @@ def FuncQuads(func2D, point, xlim, ylim, rounddig=4):
         raise TypeError("Input ylim has not exactly 2 elements")
     if ylim[0] == ylim[1]:
         raise TypeError("Input ylim[0] should be different to ylim[1]")
+    import scipy.integrate
+
     # Numerical integration to find the quadrant probabilities.
     totInt = scipy.integrate.dblquad(
         func2D, *xlim, lambda x: np.amin(ylim), lambda x: np.amax(ylim)
@@ -139,6 +159,28 @@ def FuncQuads(func2D, point, xlim, ylim, rounddig=4):
     return (fpp, fnp, fpn, fnn)
 
 
+def CDFQuads(cdf2D, points):
+    """Computes the probabilities of finding points in each 4 quadrant
+    around every point of points, from a vectorised distribution function.
+
+    Needs three evaluations of cdf2D per point instead of the five numerical
+    double integrals of FuncQuads, e.g. with
+    cdf2D = lambda p: msn_native.pmsn(p, xi, omega, alpha).
+
+    :param cdf2D: Distribution function taking an (n, 2) array of points and
+    returning the n values of P(X <= x, Y <= y). Must accept +inf coordinates.
+    :param array points: (n, 2) array of quadrant centres.
+    :returns: a (n, 4) array. The probabilities (fpp, fnp, fpn, fnn) of
+    each point, in the order returned by FuncQuads.
+    """
+    points = np.asarray(points, dtype=float)
+    inf = np.full(len(points), np.inf)
+    fnn = cdf2D(points)
+    fnx = cdf2D(np.column_stack([points[:, 0], inf]))
+    fxn = cdf2D(np.column_stack([inf, points[:, 1]]))
+    return np.column_stack([1 - fnx - fxn + fnn, fnx - fnn, fxn - fnn, fnn])
+
+
 def Qks(alam, iter=100, prec=1e-17):
     """Computes the value of the KS probability function, as a function of
     alam, the D statistic. From *Numerical recipes in C* page 623: '[...]
@@ -175,19 +217,61 @@ def Qks(alam, iter=100, prec=1e-17):
         return qks
 
 
-def ks2d2s(Arr2D1, Arr2D2):
+def ks2d2s(
+    Arr2D1,
+    Arr2D2,
+    method="exact",
+    bins=ks_binned.DEFAULT_BINS,
+    approx_threshold=ks_binned.APPROX_THRESHOLD,
+    dtype=None,
+    null_table=None,
+    workers=None,
+    return_bound=False,
+):
     """ks stands for Kolmogorov-Smirnov, 2d for 2 dimensional,
     2s for 2 samples.
     KS test for goodness-of-fit on two 2D samples. Tests the hypothesis that
     the two samples are from the same distribution.
 
-    :param array Arr2D1: 2D array of points/samples.
-    :param array Arr2D2: 2D array of points/samples.
+    :param array Arr2D1: 2D array of points/samples, or a WeightedSample of
+    unique points and multiplicities (see `lattice`), which gives the same d
+    while counting quadrants once per unique point.
+    :param array Arr2D2: 2D array of points/samples, or a WeightedSample.
+    :param str method: "exact" (default) counts quadrants around every point,
+    "binned" uses the histogram approximation from `ks_binned` (error bound
+    documented there), and "auto" switches to "binned" when the combined
+    sample size exceeds approx_threshold.
+    :param int bins: Number of bins along each axis for the binned method.
+    :param int approx_threshold: Combined sample size above which "auto"
+    uses the binned method.
+    :param dtype: Floating point type to hold the points in, e.g. np.float32
+    to halve memory traffic. None keeps the input type.
+    :param null_table: Simulated null distribution of d to take prob from,
+    see `ks_null`. None (default) uses the Press et al. approximation, "auto"
+    uses the installed "ks2d" table when one has been built (and the
+    approximation otherwise), and a path or NullTable uses that table.
+    :param int workers: Threads to split the quadrant origins of the exact
+    method over (-1 for all cores), see `ks_workers`. d does not depend on
+    it. None counts on the calling thread.
+    :param bool return_bound: If True, also return the upper bound on
+    |d - d_exact| from `ks_binned.strip_bound`, 0.0 when d is exact.
     :returns: a tuple of two floats. First, the two-sample K-S statistic.
     If this value is higher than the significance level of the hypothesis,
     it is rejected. Second, the significance level of *d*. Small values of
-    prob show that the two samples are significantly different.
+    prob show that the two samples are significantly different. With
+    return_bound, the error bound of d follows as a third float.
     """
+    if isinstance(Arr2D1, WeightedSample) or isinstance(Arr2D2, WeightedSample):
+        return _weighted_ks2d2s(
+            as_weighted(Arr2D1, dtype),
+            as_weighted(Arr2D2, dtype),
+            method,
+            bins,
+            approx_threshold,
+            null_table,
+            workers,
+            return_bound,
+        )
     if type(Arr2D1).__module__ + type(Arr2D1).__name__ == "numpyndarray":
         pass
     else:
@@ -204,6 +288,78 @@ def ks2d2s(Arr2D1, Arr2D2):
         raise TypeError("Input Arr2D1 is not 2D")
     if Arr2D2.shape[1] != 2:
         raise TypeError("Input Arr2D2 is not 2D")
+    if dtype is not None:
+        Arr2D1 = Arr2D1.astype(dtype, copy=False)
+        Arr2D2 = Arr2D2.astype(dtype, copy=False)
+    bound = 0.0
+    if ks_binned.use_binned(method, len(Arr2D1), len(Arr2D2), approx_threshold):
+        d, bound = BinnedKS(Arr2D1, Arr2D2, bins, return_bound=True)
+    else:
+        d = ExactKS(Arr2D1, Arr2D2, workers)
+    R1 = PearsonR(Arr2D1[:, 0], Arr2D1[:, 1])
+    R2 = PearsonR(Arr2D2[:, 0], Arr2D2[:, 1])
+    prob = _ks2d2s_prob(d, len(Arr2D1), len(Arr2D2), R1, R2, null_table)
+    if return_bound:
+        return (d, prob, bound)
+    return (d, prob)
+
+
+def _ks2d2s_prob(d, n1, n2, R1, R2, null_table):
+    # Significance level of d, from the null table or the Press et al. formula
+    sqen = np.sqrt(n1 * n2 / (n1 + n2))
+    RR = np.sqrt(1.0 - (R1 * R1 + R2 * R2) / 2.0)
+    table = ks_null.resolve_table(null_table, "ks2d")
+    if table is not None:
+        prob = table.pvalue(d, n1, n2, ks_null.pooled_r(R1, R2))
+    else:
+        prob = Qks(d * sqen / (1.0 + RR * (0.25 - 0.75 / sqen)))
+    # Small values of prob show that the two samples are significantly
+    # different. Prob is the significance level of an observed value of d.
+    # NOT the same as the significance level that ou set and compare to D.
+    return prob
+
+
+def _weighted_ks2d2s(
+    Sample1,
+    Sample2,
+    method,
+    bins,
+    approx_threshold,
+    null_table,
+    workers,
+    return_bound,
+):
+    # ks2d2s on deduplicated samples, see `lattice`
+    n1, n2 = len(Sample1), len(Sample2)
+    bound = 0.0
+    if ks_binned.use_binned(method, n1, n2, approx_threshold):
+        d, bound = BinnedKS(Sample1, Sample2, bins, return_bound=True)
+    else:
+        d = WeightedKS(Sample1, Sample2, workers)
+    prob = _ks2d2s_prob(d, n1, n2, Sample1.corr(), Sample2.corr(), null_table)
+    if return_bound:
+        return (d, prob, bound)
+    return (d, prob)
+
+
+def ExactKS(Arr2D1, Arr2D2, workers=None):
+    """Computes the two-sample 2D KS statistic by counting the quadrants
+    around every point of both samples.
+
+    :param array Arr2D1: (n1, 2) array of points/samples.
+    :param array Arr2D2: (n2, 2) array of points/samples.
+    :param int workers: If given, count the quadrants of chunks of points
+    with vectorised kernels over this many threads (-1 for all cores). The
+    counts and products are the same as below, so d is identical.
+    :returns: a float. The KS statistic d.
+    """
+    if workers is not None:
+        ff1, ff2 = 1.0 / len(Arr2D1), 1.0 / len(Arr2D2)
+        d1, d2 = (
+            _max_quadrant_diff(Origins, Arr2D1, None, ff1, Arr2D2, None, ff2, workers)
+            for Origins in (Arr2D1, Arr2D2)
+        )
+        return (d1 + d2) / 2.0
     d1, d2 = 0.0, 0.0
     for point1 in Arr2D1:
         fpp1, fmp1, fpm1, fmm1 = CountQuads(Arr2D1, point1)
@@ -219,16 +375,67 @@ def ks2d2s(Arr2D1, Arr2D2):
         d2 = max(d2, abs(fpm1 - fpm2))
         d2 = max(d2, abs(fmp1 - fmp2))
         d2 = max(d2, abs(fmm1 - fmm2))
-    d = (d1 + d2) / 2.0
-    sqen = np.sqrt(len(Arr2D1) * len(Arr2D2) / (len(Arr2D1) + len(Arr2D2)))
-    R1 = scipy.stats.pearsonr(Arr2D1[:, 0], Arr2D1[:, 1])[0]
-    R2 = scipy.stats.pearsonr(Arr2D2[:, 0], Arr2D2[:, 1])[0]
-    RR = np.sqrt(1.0 - (R1 * R1 + R2 * R2) / 2.0)
-    prob = Qks(d * sqen / (1.0 + RR * (0.25 - 0.75 / sqen)))
-    # Small values of prob show that the two samples are significantly
-    # different. Prob is the significance level of an observed value of d.
-    # NOT the same as the significance level that ou set and compare to D.
-    return (d, prob)
+    return (d1 + d2) / 2.0
+
+
+def WeightedKS(Sample1, Sample2, workers=None):
+    """Computes the two-sample 2D KS statistic of two deduplicated samples,
+    counting the quadrants once around every unique point with the
+    multiplicities as weights. The counts, hence d, are identical to ExactKS
+    on the expanded samples.
+
+    :param WeightedSample Sample1: Unique points and multiplicities of sample 1.
+    :param WeightedSample Sample2: Unique points and multiplicities of sample 2.
+    :param int workers: Threads to split the unique points over, see
+    `ks_workers`. None counts on the calling thread.
+    :returns: a float. The KS statistic d.
+    """
+    ff1, ff2 = 1.0 / len(Sample1), 1.0 / len(Sample2)
+    P1, w1, P2, w2 = Sample1.points, Sample1.weights, Sample2.points, Sample2.weights
+    d1, d2 = (
+        _max_quadrant_diff(Origins, P1, w1, ff1, P2, w2, ff2, workers)
+        for Origins in (P1, P2)
+    )
+    return (d1 + d2) / 2.0
+
+
+def _max_quadrant_diff(Origins, Arr2D1, w1, ff1, Arr2D2, w2, ff2, workers):
+    # Largest quadrant fraction difference around the origins, with the same
+    # products as CountQuads (count * (1.0 / n)), over chunks of origins
+    def chunk_max(s):
+        f1 = quadrant_counts(Origins[s], Arr2D1, w1) * ff1
+        f2 = quadrant_counts(Origins[s], Arr2D2, w2) * ff2
+        return np.abs(f1 - f2).max()
+
+    return float(max(ks_workers.map_chunks(chunk_max, len(Origins), workers)))
+
+
+def BinnedKS(Arr2D1, Arr2D2, bins=ks_binned.DEFAULT_BINS, return_bound=False):
+    """Approximates the two-sample 2D KS statistic by binning both samples
+    on a shared grid and reading the quadrant fractions from 2D prefix sums
+    at every occupied cell, in O(bins**2). See `ks_binned` for the error
+    bound versus bin size.
+
+    :param array Arr2D1: (n1, 2) array of points/samples, or a WeightedSample.
+    :param array Arr2D2: (n2, 2) array of points/samples, or a WeightedSample.
+    :param int bins: Number of bins along each axis.
+    :param bool return_bound: If True, also return the upper bound on
+    |d - d_exact| from `ks_binned.strip_bound`.
+    :returns: a float. The approximate KS statistic d, or a tuple of d and
+    its error bound with return_bound.
+    """
+    w1 = w2 = None
+    if isinstance(Arr2D1, WeightedSample):
+        Arr2D1, w1 = Arr2D1.points, Arr2D1.weights
+    if isinstance(Arr2D2, WeightedSample):
+        Arr2D2, w2 = Arr2D2.points, Arr2D2.weights
+    D1, D2, bound = ks_binned.binned_differences(
+        Arr2D1[:, 0], Arr2D1[:, 1], Arr2D2[:, 0], Arr2D2[:, 1], bins=bins, w1=w1, w2=w2
+    )
+    d = (np.abs(D1).max() + np.abs(D2).max()) / 2.0
+    if return_bound:
+        return d, bound
+    return d
 
 
 def ks2d1s(Arr2D, func2D, xlim=[], ylim=[]):
@@ -287,7 +494,35 @@ def ks2d1s(Arr2D, func2D, xlim=[], ylim=[]):
         d = max(d, abs(fmp1 - fmp2))
         d = max(d, abs(fmm1 - fmm2))
     sqen = np.sqrt(len(Arr2D))
-    R1 = scipy.stats.pearsonr(Arr2D[:, 0], Arr2D[:, 1])[0]
+    R1 = PearsonR(Arr2D[:, 0], Arr2D[:, 1])
+    RR = np.sqrt(1.0 - R1**2)
+    prob = Qks(d * sqen / (1.0 + RR * (0.25 - 0.75 / sqen)))
+    return d, prob
+
+
+def ks2d1s_cdf(Arr2D, cdf2D):
+    """ks stands for Kolmogorov-Smirnov, 2d for 2 dimensional,
+    1s for 1 sample.
+    Vectorised KS test for goodness-of-fit on one 2D sample and a 2D
+    distribution given by its distribution function, e.g. a fitted
+    skew-normal through msn_native.pmsn. The quadrant probabilities of all
+    points come from CDFQuads and the sample fractions from one vectorised
+    count, so no numerical integration is needed.
+
+    :param array Arr2D: (n, 2) array of points/samples.
+    :param cdf2D: Distribution function, see CDFQuads.
+    :returns: tuple of two floats. First, the one-sample K-S statistic.
+    Second, the significance level of *d*, as in ks2d1s.
+    """
+    Arr2D = np.asarray(Arr2D, dtype=float)
+    if Arr2D.ndim != 2 or Arr2D.shape[1] != 2:
+        raise TypeError("Input Arr2D is not an (n, 2) array")
+    expected = CDFQuads(cdf2D, Arr2D)
+    # quadrant_counts orders the quadrants (pp, np, pn, nn) like FuncQuads
+    observed = quadrant_counts(Arr2D, Arr2D) / len(Arr2D)
+    d = np.max(np.abs(expected - observed))
+    sqen = np.sqrt(len(Arr2D))
+    R1 = PearsonR(Arr2D[:, 0], Arr2D[:, 1])
     RR = np.sqrt(1.0 - R1**2)
     prob = Qks(d * sqen / (1.0 + RR * (0.25 - 0.75 / sqen)))
     return d, prob
@@ -1,9 +1,25 @@
 # %%
+import hashlib
+import os
+import struct
+import tempfile
+from copy import deepcopy
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
-import scripts.rpyskewnorm as rsn
-import soundscapy as sspy
-from scripts import KS2D
+from scripts import KS2D, backends, lattice, msn_native
+
+# Fitted parameters cached by `fit_many`, keyed by a hash of each group's data
+FIT_CACHE_DIR = Path.home() / ".cache" / "single-index" / "fits"
+
+# Layout of `MultiSkewNorm.to_bytes`: a header of magic, flags, sample dtype
+# code, dimension, number of seed words and sample size, followed by the
+# uint32 seed words, the float64 dp and cp, and the sample, as flagged
+_BYTES_HEADER = struct.Struct("<4sBBBBQ")
+_BYTES_MAGIC = b"MSN\x01"
+_HAS_DP, _HAS_CP, _HAS_SEED, _HAS_SAMPLE, _QMC = 1, 2, 4, 8, 16
+_SAMPLE_DTYPES = (np.dtype(np.float64), np.dtype(np.float32))
 
 
 class DirectParams:
@@ -70,6 +86,110 @@ class DirectParams:
         assert self._omega_is_pos_def(), "Omega must be positive definite"
         assert self._omega_is_symmetric(), "Omega must be symmetric"
 
+    @classmethod
+    def _trusted(cls, xi: np.ndarray, omega: np.ndarray, alpha: np.ndarray):
+        # Wrap already validated arrays (e.g. rows of a DirectParamsBatch)
+        # without copying them or validating again
+        dp = cls.__new__(cls)
+        dp.xi, dp.omega, dp.alpha = xi, omega, alpha
+        return dp
+
+
+class DirectParamsBatch:
+    """
+    A batch of N sets of direct parameters held in contiguous arrays.
+
+    Grid searches and population-based optimisers handle many candidate
+    parameter sets at once. Rather than one validated DirectParams object per
+    candidate, the batch stores them as a structure of arrays and computes
+    their validity as a boolean mask, so invalid candidates can be dropped
+    without raising and catching errors.
+
+    Attributes:
+        xi (np.ndarray): (N, d) locations.
+        omega (np.ndarray): (N, d, d) scale matrices.
+        alpha (np.ndarray): (N, d) shapes.
+    """
+
+    __slots__ = ("xi", "omega", "alpha", "_valid")
+
+    def __init__(self, xi: np.ndarray, omega: np.ndarray, alpha: np.ndarray):
+        self.xi = np.ascontiguousarray(xi, dtype=float)
+        self.omega = np.ascontiguousarray(omega, dtype=float)
+        self.alpha = np.ascontiguousarray(alpha, dtype=float)
+        assert self.xi.ndim == 2 and self.xi.shape == self.alpha.shape
+        assert self.omega.shape == self.xi.shape + self.xi.shape[-1:]
+        self._valid = None
+
+    @classmethod
+    def from_params(cls, params) -> "DirectParamsBatch":
+        """
+        Builds a batch from parameter dicts, e.g. the rows of a ParameterGrid.
+
+        Args:
+            params: Iterable of dicts with keys "xi_x", "xi_y", "omega",
+                "alpha_x" and "alpha_y".
+        """
+        params = list(params)
+        return cls(
+            xi=[[p["xi_x"], p["xi_y"]] for p in params],
+            omega=[p["omega"] for p in params],
+            alpha=[[p["alpha_x"], p["alpha_y"]] for p in params],
+        )
+
+    def __len__(self) -> int:
+        return len(self.xi)
+
+    def __repr__(self) -> str:
+        return f"DirectParamsBatch(n={len(self)}, valid={int(self.valid.sum())})"
+
+    @property
+    def valid(self) -> np.ndarray:
+        """
+        Boolean mask of the parameter sets with a symmetric positive definite Omega.
+
+        Uses the same tolerance as `np.allclose` for symmetry. For 2x2 matrices,
+        positive definiteness is checked in closed form (a Cholesky factor
+        exists iff omega_11 > 0 and det > 0); larger matrices use batched
+        eigenvalues.
+        """
+        if self._valid is None:
+            o = self.omega
+            ot = np.swapaxes(o, -1, -2)
+            symmetric = np.all(np.abs(o - ot) <= 1e-8 + 1e-5 * np.abs(ot), axis=(1, 2))
+            if o.shape[-1] == 2:
+                det = o[:, 0, 0] * o[:, 1, 1] - o[:, 0, 1] * o[:, 1, 0]
+                pos_def = (o[:, 0, 0] > 0) & (det > 0)
+            else:
+                pos_def = np.linalg.eigvalsh(o).min(axis=-1) > 0
+            finite = np.isfinite(self.xi).all(1) & np.isfinite(self.alpha).all(1)
+            self._valid = symmetric & pos_def & finite
+        return self._valid
+
+    def row(self, i: int) -> DirectParams:
+        """
+        View of one parameter set as DirectParams, without copying.
+
+        Raises:
+            ValueError: If the parameter set is not valid.
+        """
+        if not self.valid[i]:
+            raise ValueError(f"Parameter set {i} is not valid")
+        return DirectParams._trusted(self.xi[i], self.omega[i], self.alpha[i])
+
+    def compress(self, mask: np.ndarray = None) -> "DirectParamsBatch":
+        """
+        A new batch with only the selected parameter sets (default: the valid ones).
+        """
+        mask = self.valid if mask is None else mask
+        return DirectParamsBatch(self.xi[mask], self.omega[mask], self.alpha[mask])
+
+    def to_cp(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Centred parameters of every set in the batch, see `msn_native.dp2cp`.
+        """
+        return msn_native.dp2cp(self.xi, self.omega, self.alpha)
+
 
 class CentredParams:
     """
@@ -84,7 +204,7 @@ class CentredParams:
         __init__(mean, sigma, skew): Initializes a new instance of the CentredParams class.
         __repr__(): Returns a string representation of the CentredParams object.
         __str__(): Returns a formatted string representation of the CentredParams object.
-        from_dp(dp): Converts DirectParams object to CentredParams object.
+        from_dp(dp): Creates a CentredParams object from a DirectParams object.
 
     """
 
@@ -104,7 +224,8 @@ class CentredParams:
             f"\nskew:  {self.skew.round(3)}"
         )
 
-    def from_dp(self, dp: DirectParams):
+    @classmethod
+    def from_dp(cls, dp: DirectParams):
         """
         Converts a DirectParams object to a CentredParams object.
 
@@ -114,12 +235,34 @@ class CentredParams:
         Returns:
             CentredParams: A new CentredParams object with the converted parameters.
 
-        Note:
-            This method is not yet implemented.
-
         """
-        # TODO: Implement this method with dp2cp function
-        pass
+        return cls(*msn_native.dp2cp(dp.xi, dp.omega, dp.alpha))
+
+
+def _seed_words(rng: np.random.Generator) -> np.ndarray | None:
+    """
+    uint32 entropy words from which `np.random.default_rng` recreates rng's
+    stream, or None if rng cannot be recreated (not a fresh, unspawned PCG64
+    generator seeded by a SeedSequence).
+    """
+    bitgen = rng.bit_generator
+    seq = getattr(bitgen, "seed_seq", None)
+    if type(bitgen) is not np.random.PCG64 or not isinstance(
+        seq, np.random.SeedSequence
+    ):
+        return None
+    words = []
+    for value in np.atleast_1d(np.asarray(seq.entropy, dtype=object)):
+        value = int(value)
+        words.append(value & 0xFFFFFFFF)
+        while value >> 32:
+            value >>= 32
+            words.append(value & 0xFFFFFFFF)
+    words = np.array(words, dtype=np.uint32)
+    if len(words) > 255:
+        return None
+    fresh = np.random.PCG64(np.random.SeedSequence(words))
+    return words if fresh.state == bitgen.state else None
 
 
 class MultiSkewNorm:
@@ -133,6 +276,13 @@ class MultiSkewNorm:
         sample_data: The generated sample data from the fitted model.
         data: The input data used for fitting the model.
 
+    Targets pickle through `to_bytes`, which keeps only the parameters and the
+    sample or its seed, so sending them to pathos workers costs a few hundred
+    bytes. Fitted targets also keep their data, but never the R selm model:
+    it is refitted from the data on first access of `selm_model`, so workers
+    that only sample and score never touch R. `copy.deepcopy` keeps
+    everything, sharing the selm model.
+
     Methods:
         __init__: Initializes an instance of the MultiSkewNorm class.
         __repr__: Returns a string representation of the MultiSkewNorm instance.
@@ -140,9 +290,11 @@ class MultiSkewNorm:
         fit: Fits the model to the provided data.
         define_dp: Defines the direct parameters of the model.
         sample: Generates a sample from the fitted model.
-        sspy_plot: Plots the joint distribution of the generated sample.
+        sspy_plot: Plots the joint distribution of the target.
+        density_grid: Evaluates the density on the circumplex grid.
         ks2ds: Computes the two-sample Kolmogorov-Smirnov statistic.
         spi: Computes the similarity percentage index.
+        overlap_index: Computes the density-overlap similarity index.
 
     """
 
@@ -153,6 +305,65 @@ class MultiSkewNorm:
         self.sample_data = None
         self.data = None
 
+    @property
+    def sample_data(self) -> np.ndarray | None:
+        # A target unpickled without its sample redraws it from its seed on first use
+        if self._sample_data is None and self._sample_spec is not None:
+            n, seed, qmc, dtype = self._sample_spec
+            rng = np.random.default_rng(np.random.SeedSequence(seed))
+            self.sample(n, dtype=dtype, backend="native", rng=rng, qmc=qmc)
+        return self._sample_data
+
+    @sample_data.setter
+    def sample_data(self, value: np.ndarray | None):
+        # An assigned sample has no seed to redraw it from
+        self._sample_data = value
+        self._sample_spec = None
+
+    @property
+    def selm_model(self):
+        # An unpickled fitted target refits its model from the data on first use
+        if self._selm_model is None and self._selm_pending:
+            self.selm_model = backends.get_backend("r").selm("x", "y", self.data)
+        return self._selm_model
+
+    @selm_model.setter
+    def selm_model(self, value):
+        self._selm_model = value
+        self._selm_pending = False
+
+    def __getstate__(self) -> bytes | dict:
+        # The parameters and sample (or seed) travel as `to_bytes`, fitted data
+        # alongside. The selm model is dropped if it can be refitted from the data.
+        target = self.to_bytes()
+        has_model = self._selm_model is not None or self._selm_pending
+        if self.data is None and not has_model:
+            return target
+        state = {"target": target, "data": self.data, "refit": False}
+        if has_model and self.data is not None:
+            state["refit"] = True
+        elif has_model:
+            state["selm_model"] = self._selm_model
+        return state
+
+    def __setstate__(self, state: bytes | dict):
+        if isinstance(state, bytes):
+            self.__dict__.update(MultiSkewNorm.from_bytes(state).__dict__)
+            return
+        self.__dict__.update(MultiSkewNorm.from_bytes(state["target"]).__dict__)
+        self.data = state["data"]
+        self.selm_model = state.get("selm_model")
+        self._selm_pending = state["refit"]
+
+    def __deepcopy__(self, memo):
+        # A full copy, sharing the R model, which is never modified
+        msn = MultiSkewNorm.__new__(MultiSkewNorm)
+        memo[id(self)] = msn
+        for name, value in self.__dict__.items():
+            shared = name == "_selm_model"
+            msn.__dict__[name] = value if shared else deepcopy(value, memo)
+        return msn
+
     def __repr__(self):
         if self.cp is None and self.dp is None and self.selm_model is None:
             return "MultiSkewNorm() (unfitted)"
@@ -216,6 +427,8 @@ class MultiSkewNorm:
 
         # Fit the model
         # TODO: Move the util to this class method rather than having it separate
+        # Fitting needs sn::selm, so the R backend is loaded here on first use
+        rsn = backends.get_backend("r")
         m = rsn.selm("x", "y", df)
 
         # Extract the parameters
@@ -241,51 +454,174 @@ class MultiSkewNorm:
         """
 
         self.dp = DirectParams(xi, omega, alpha)
+        self.cp = CentredParams.from_dp(self.dp)
         return None
 
-    def sample(self, n: int = 1000, return_sample: bool = False) -> None | np.ndarray:
+    @classmethod
+    def from_dp(cls, dp: DirectParams) -> "MultiSkewNorm":
+        """
+        Initiate a distribution from an existing DirectParams object.
+
+        The parameter arrays are shared rather than copied, so this can wrap a
+        row of a DirectParamsBatch (see `DirectParamsBatch.row`).
+
+        Args:
+            dp: The direct parameters.
+
+        """
+        msn = cls()
+        msn.dp = dp
+        msn.cp = CentredParams.from_dp(dp)
+        return msn
+
+    def sample(
+        self,
+        n: int = 1000,
+        return_sample: bool = False,
+        dtype=np.float64,
+        backend: str = None,
+        rng: np.random.Generator | int = None,
+        qmc: bool = False,
+    ) -> None | np.ndarray:
         """
         Generates a sample from the fitted model.
 
         Args:
             n: The number of samples to generate.
             return_sample: Whether to return the generated sample as an np.ndarray.
+            dtype: Floating point type to store the sample in. np.float32 halves
+                the memory of targets held in bulk, e.g. during a grid search.
+            backend: Name of the sampling backend, see `scripts.backends`.
+                Defaults to the native NumPy sampler. The R backend samples
+                fitted models through their selm model.
+            rng: Random generator or seed, for reproducible samples from
+                backends that take one (the native sampler).
+            qmc: Draw a scrambled Sobol (quasi-Monte Carlo) sample, which covers
+                the distribution more evenly, so the SPI against the target
+                fluctuates less for a given n. Native backend only.
 
         Returns:
             None or numpy array: The generated sample if return_sample is True.
 
         Raises:
-            ValueError: If either selm_model or xi, omega, and alpha are not provided.
+            ValueError: If either selm_model or xi, omega, and alpha are not
+                provided, or if rng or qmc is given with the R backend.
 
         """
 
-        if self.selm_model is not None:
-            sample = rsn.sample_msn(selm_model=self.selm_model, n=n)
+        seed = None
+        if backends.resolve(backend) == "native":
+            # Keep the seed of native samples, so that `to_bytes` can ship the
+            # seed instead of the sample
+            if not isinstance(rng, np.random.Generator):
+                rng = np.random.default_rng(rng)
+            seed = _seed_words(rng)
+
+        sample = self._draw(n, backend, rng, qmc)
+        self.sample_data = np.asarray(sample, dtype=dtype)
+        # Only samples in a dtype `to_bytes` can redraw them in keep their seed
+        if seed is not None and self._sample_data.dtype in _SAMPLE_DTYPES:
+            self._sample_spec = (n, seed, qmc, self._sample_data.dtype)
+
+        if return_sample:
+            return self.sample_data
+
+    def _draw(self, n, backend=None, rng=None, qmc=False) -> np.ndarray:
+        # Draw n points from the selected backend without storing them
+        backend = backends.resolve(backend)
+        if backend == "r" and (rng is not None or qmc):
+            # R draws from its own generator, which rng and qmc cannot drive
+            raise ValueError(
+                "The R backend does not take rng or qmc; use the native backend "
+                "for seeded or quasi-Monte Carlo samples"
+            )
+        sampler = backends.get_backend(backend)
+        # Check the backend first, so native sampling never refits a model
+        if backend == "r" and self.selm_model is not None:
+            return sampler.sample_msn(selm_model=self.selm_model, n=n)
         elif self.dp is not None:
-            sample = rsn.sample_msn(
-                xi=self.dp.xi, omega=self.dp.omega, alpha=self.dp.alpha, n=n
+            options = {} if rng is None else {"rng": rng}
+            if qmc:
+                options["qmc"] = True
+            return sampler.sample_msn(
+                xi=self.dp.xi, omega=self.dp.omega, alpha=self.dp.alpha, n=n, **options
             )
         else:
             raise ValueError(
                 "Either selm_model or xi, omega, and alpha must be provided."
             )
 
-        self.sample_data = sample
+    def sspy_plot(
+        self,
+        color: str = "blue",
+        title: str = None,
+        ax=None,
+        method: str = "sample",
+    ):
+        """
+        Plots the joint distribution of the target.
 
-        if return_sample:
-            return sample
+        Args:
+            color: Colour of the density.
+            title: Title of the plot.
+            ax: Matplotlib axes to draw on.
+            method: "sample" (default) hands the sample to
+                `sspy.density_plot`. "analytic" draws the MSN density on the
+                circumplex grid without sampling, and "kde" the FFT-binned KDE
+                of the sample (see `density_grid`), both much faster.
 
-    def sspy_plot(self, color: str = "blue", title: str = None):
         """
-        Plots the joint distribution of the generated sample.
+        if method == "sample":
+            import soundscapy as sspy
+
+            if self.sample_data is None:
+                self.sample()
+
+            df = pd.DataFrame(self.sample_data, columns=["ISOPleasant", "ISOEventful"])
+            return sspy.density_plot(df, color=color, title=title, ax=ax)
 
+        return self.density_grid(method=method).plot(ax=ax, color=color, title=title)
+
+    def density_grid(
+        self,
+        bins: int = None,
+        extent: tuple = None,
+        method: str = "analytic",
+    ) -> "density_grid.DensityGrid":
         """
+        The target's density on the circumplex grid, cached per target.
 
-        if self.sample_data is None:
-            self.sample()
+        Args:
+            bins: Number of cells along each axis. Defaults to
+                `density_grid.GRID_BINS`.
+            extent: (lo, hi) of both axes. Defaults to `density_grid.GRID_EXTENT`.
+            method: "analytic" evaluates the MSN density from the direct
+                parameters; "kde" smooths the sample (drawn if needed).
+
+        Returns:
+            density_grid.DensityGrid: The density at the grid cell centres.
+
+        Raises:
+            ValueError: If method is not recognised, or "analytic" is asked of
+                a target without direct parameters.
 
-        df = pd.DataFrame(self.sample_data, columns=["ISOPleasant", "ISOEventful"])
-        sspy.density_plot(df, color=color, title=title)
+        """
+        # Imported on use, like the R backend, to keep this module cheap to import
+        from scripts import density_grid as grids
+
+        bins = grids.GRID_BINS if bins is None else bins
+        extent = grids.GRID_EXTENT if extent is None else extent
+        if method == "analytic":
+            if self.dp is None:
+                raise ValueError("The analytic density needs the direct parameters")
+            return grids.msn_grid(
+                self.dp.xi, self.dp.omega, self.dp.alpha, bins, extent
+            )
+        if method == "kde":
+            if self.sample_data is None:
+                self.sample()
+            return grids.kde_grid(self.sample_data, bins, extent)
+        raise ValueError(f"method must be 'analytic' or 'kde', got {method!r}")
 
     def ks2ds(
         self, test: pd.DataFrame | np.ndarray, nboot: int = None, extra: bool = True
@@ -294,7 +630,8 @@ class MultiSkewNorm:
         Computes the two-sample, two-dimensional Kolmogorov-Smirnov statistic.
 
         Args:
-            test: The test data as a pandas DataFrame or numpy array.
+            test: The test data as a pandas DataFrame, numpy array or
+                lattice.WeightedSample.
             nboot: The number of bootstrap samples to use for computing the p-value.
             extra: Whether to compute the extra statistics.
 
@@ -306,10 +643,13 @@ class MultiSkewNorm:
         if self.sample_data is None:
             self.sample()
 
-        if isinstance(test, pd.DataFrame):
-            test = test[["ISOPleasant", "ISOEventful"]].values
+        # Survey responses lie on a lattice of repeated coordinates, so the
+        # test side is scored once per unique point (same D)
+        if not isinstance(test, lattice.WeightedSample):
+            test = lattice.WeightedSample.from_points(test)
 
-        return KS2D.ks2d2s(self.sample_data, test)
+        # Compare in the precision the target sample is stored in
+        return KS2D.ks2d2s(self.sample_data, test, dtype=self.sample_data.dtype)
 
     def spi(self, test: pd.DataFrame | np.ndarray):
         """
@@ -325,30 +665,346 @@ class MultiSkewNorm:
 
         return int((1 - self.ks2ds(test)[0]) * 100)
 
+    def overlap_index(
+        self, test: pd.DataFrame | np.ndarray, method: str = "analytic"
+    ) -> int:
+        """
+        Density-overlap similarity index of the test data against the target.
+
+        100 times the overlapping coefficient of the target density (see
+        `density_grid`) and the KDE of the test data on the circumplex grid: 100
+        for identical and 0 for disjoint distributions. A smooth counterpart to
+        the SPI, computed without sampling the target.
+
+        Args:
+            test: The test data as a pandas DataFrame or numpy array.
+            method: How the target density is computed, see `density_grid`.
+
+        Returns:
+            int: The density-overlap index.
+
+        """
+        from scripts import density_grid as grids
+
+        return grids.overlap_index(
+            self.density_grid(method=method), grids.kde_grid(test)
+        )
+
+    def spi_distribution(
+        self,
+        test: pd.DataFrame | np.ndarray,
+        n_rep: int = 100,
+        n: int = None,
+        quantiles: tuple = (0.025, 0.5, 0.975),
+        rng: np.random.Generator | int = None,
+        backend: str = None,
+        block_size: int = 16,
+        parallel: bool = False,
+    ) -> dict:
+        """
+        Distribution of the SPI over repeated target samples.
+
+        The SPI depends on the random target sample, so this resamples the
+        target n_rep times and scores every replicate against the test data.
+        All replicates are drawn in one call and scored with `spi_matrix`: the
+        test sample is deduplicated and its quadrant counts computed once, the
+        self quadrant counts of all replicates are computed together (see
+        `quadrants.self_quadrant_counts`), and the replicates are scored in
+        vectorised blocks. `sample_data` is left unchanged.
+
+        Args:
+            test: The test data as a pandas DataFrame or numpy array.
+            n_rep: Number of replicate target samples.
+            n: Size of each replicate. Defaults to the size of `sample_data`,
+                or 1000 if the target has not been sampled.
+            quantiles: Quantiles of the SPI to report, e.g. the bounds of a
+                95% interval.
+            rng: Random generator or seed of the replicates. Not supported by
+                the R backend.
+            backend: Name of the sampling backend, see `scripts.backends`.
+            block_size: Replicates scored together per task.
+            parallel: Whether to score blocks over a process pool.
+
+        Returns:
+            dict: `mean` and `std` of the SPI, `quantiles` as a dict of
+                quantile to SPI, and `spi`, the (n_rep,) SPIs of the replicates.
+
+        Raises:
+            ValueError: If rng is given with the R backend.
+
+        """
+        from scripts.spi_matrix import spi_matrix
+
+        if n is None:
+            n = 1000 if self.sample_data is None else len(self.sample_data)
+        dtype = np.float64 if self.sample_data is None else self.sample_data.dtype
+        stacked = np.asarray(self._draw(n * n_rep, backend, rng), dtype=dtype)
+        replicates = stacked.reshape(n_rep, n, -1)
+
+        if isinstance(test, pd.DataFrame):
+            test = test[["ISOPleasant", "ISOEventful"]].values
+        data = pd.DataFrame(test, columns=["ISOPleasant", "ISOEventful"])
+        data["LocationID"] = 0
+        spi, _ = spi_matrix(
+            replicates, data, block_size=block_size, parallel=parallel, dtype=dtype
+        )
+        spi = spi[0].to_numpy()
+        return {
+            "mean": float(spi.mean()),
+            "std": float(spi.std(ddof=1)) if n_rep > 1 else 0.0,
+            "quantiles": {q: float(np.quantile(spi, q)) for q in quantiles},
+            "spi": spi,
+        }
+
+    def to_bytes(self, sample: bool = None) -> bytes:
+        """
+        Serialise the target to a compact binary string.
+
+        Only the direct and centred parameters and the sample (or the seed it
+        was drawn with) are kept. The selm model and the fitted data are not,
+        as sampling and scoring need only the direct parameters; pickle a
+        fitted target to keep its data and refit the model on demand. A target
+        with a seeded sample costs about 150 bytes.
+
+        Args:
+            sample: Whether to include the sample. None includes it only if it
+                cannot be redrawn from its seed: samples from the native
+                backend with a fresh generator or seed can be, samples assigned
+                directly or drawn through R cannot. Samples are stored as
+                float32 or float64; other real types are stored as float64.
+
+        Returns:
+            bytes: The serialised target, see `from_bytes`.
+
+        Raises:
+            ValueError: If the sample is asked for but missing, or is not a
+                real numeric array.
+        """
+        flags, d, dtype, n, parts = 0, 0, 0, 0, []
+        if self._sample_spec is not None:
+            n, seed, qmc, sample_dtype = self._sample_spec
+            flags |= _HAS_SEED | (_QMC if qmc else 0)
+            dtype = _SAMPLE_DTYPES.index(sample_dtype)
+            parts.append(seed.tobytes())
+        if self.dp is not None:
+            flags |= _HAS_DP
+            parts.append(_pack_params(self.dp.xi, self.dp.omega, self.dp.alpha))
+            d = len(np.ravel(self.dp.xi))
+        if self.cp is not None:
+            flags |= _HAS_CP
+            parts.append(_pack_params(self.cp.mean, self.cp.sigma, self.cp.skew))
+            d = len(np.ravel(self.cp.mean))
+
+        data = self._sample_data
+        if sample is None:
+            sample = data is not None and not flags & _HAS_SEED
+        if sample:
+            if data is None:
+                raise ValueError("The target has not been sampled")
+            if data.dtype not in _SAMPLE_DTYPES:
+                # Other real types (e.g. ints, float16) are stored as float64
+                if not np.issubdtype(data.dtype, np.integer) and not np.issubdtype(
+                    data.dtype, np.floating
+                ):
+                    raise ValueError(
+                        f"Cannot serialise sample_data of dtype {data.dtype}, "
+                        "expected a real numeric array"
+                    )
+                data = data.astype(np.float64)
+            flags |= _HAS_SAMPLE
+            n, d = data.shape
+            dtype = _SAMPLE_DTYPES.index(data.dtype)
+            parts.append(np.ascontiguousarray(data).tobytes())
+
+        n_seed = len(self._sample_spec[1]) if flags & _HAS_SEED else 0
+        header = _BYTES_HEADER.pack(_BYTES_MAGIC, flags, dtype, d, n_seed, n)
+        return header + b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, buffer: bytes) -> "MultiSkewNorm":
+        """
+        Rebuild a target serialised by `to_bytes`.
+
+        A sample that was shipped as its seed is redrawn on first access of
+        `sample_data`, identically to the original.
+
+        Raises:
+            ValueError: If the buffer is not a serialised MultiSkewNorm.
+        """
+        magic, flags, dtype, d, n_seed, n = _BYTES_HEADER.unpack_from(buffer)
+        if magic != _BYTES_MAGIC:
+            raise ValueError("Not a serialised MultiSkewNorm")
+        offset = _BYTES_HEADER.size
+        dtype = _SAMPLE_DTYPES[dtype]
+
+        def _take(count, item_dtype=np.float64):
+            nonlocal offset
+            array = np.frombuffer(buffer, item_dtype, count, offset).copy()
+            offset += array.nbytes
+            return array
+
+        msn = cls()
+        seed = _take(n_seed, np.uint32) if flags & _HAS_SEED else None
+        if flags & _HAS_DP:
+            xi, omega, alpha = np.split(_take(d * (d + 2)), [d, d + d * d])
+            msn.dp = DirectParams._trusted(xi, omega.reshape(d, d), alpha)
+        if flags & _HAS_CP:
+            mean, sigma, skew = np.split(_take(d * (d + 2)), [d, d + d * d])
+            msn.cp = CentredParams(mean, sigma.reshape(d, d), skew)
+        if flags & _HAS_SAMPLE:
+            msn.sample_data = _take(n * d, dtype).reshape(n, d)
+        if seed is not None:
+            msn._sample_spec = (n, seed, bool(flags & _QMC), dtype)
+        return msn
+
+
+def _pack_params(*arrays) -> bytes:
+    return np.concatenate([np.ravel(a).astype(np.float64) for a in arrays]).tobytes()
+
+
+def _fit_key(points: np.ndarray) -> str:
+    h = hashlib.sha256(b"selm-SN-v1")
+    h.update(np.ascontiguousarray(points, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def _load_cached_fit(path: Path) -> tuple[tuple, tuple]:
+    with np.load(path) as f:
+        return (f["xi"], f["omega"], f["alpha"]), (f["mean"], f["sigma"], f["skew"])
+
+
+def _save_cached_fit(path: Path, dp: tuple, cp: tuple):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # A unique temporary file, so concurrent runs writing the same fit don't race
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=path.stem, suffix=".tmp.npz", delete=False
+    ) as f:
+        tmp = Path(f.name)
+        try:
+            np.savez(
+                f,
+                xi=dp[0],
+                omega=dp[1],
+                alpha=dp[2],
+                mean=cp[0],
+                sigma=cp[1],
+                skew=cp[2],
+            )
+        except BaseException:
+            f.close()
+            tmp.unlink()
+            raise
+    tmp.replace(path)
+
+
+def _params_row(dp: DirectParams, cp: CentredParams, n: int) -> dict:
+    xi, omega, alpha = np.ravel(dp.xi), dp.omega, np.ravel(dp.alpha)
+    mean, sigma, skew = np.ravel(cp.mean), cp.sigma, np.ravel(cp.skew)
+    return {
+        "n": n,
+        "xi_x": xi[0],
+        "xi_y": xi[1],
+        "omega_xx": omega[0, 0],
+        "omega_xy": omega[0, 1],
+        "omega_yy": omega[1, 1],
+        "alpha_x": alpha[0],
+        "alpha_y": alpha[1],
+        "mean_x": mean[0],
+        "mean_y": mean[1],
+        "sigma_xx": sigma[0, 0],
+        "sigma_xy": sigma[0, 1],
+        "sigma_yy": sigma[1, 1],
+        "skew_x": skew[0],
+        "skew_y": skew[1],
+    }
+
+
+def fit_many(
+    data: pd.DataFrame,
+    by: str = "LocationID",
+    cols: tuple[str, str] = ("ISOPleasant", "ISOEventful"),
+    parallel: bool = True,
+    processes: int = None,
+    sample_n: int = None,
+    cache: bool = True,
+    cache_dir: str | Path = FIT_CACHE_DIR,
+) -> tuple[pd.DataFrame, dict[str, MultiSkewNorm]]:
+    """
+    Fits a MultiSkewNorm to every group of a dataset at once.
+
+    The data is split once, cached fits are reused, and the remaining groups
+    are fitted with batched sn::selm calls, either spread over a pre-warmed
+    `RWorkerPool` or as a single in-process R call.
+
+    Args:
+        data: The input data with a grouping column and two coordinate columns.
+        by: The column to group the data by.
+        cols: The coordinate columns to fit.
+        parallel: Whether to fit the groups concurrently over a process pool.
+        processes: Number of worker processes. Defaults to one per CPU.
+        sample_n: If given, also sample each fit with this many points.
+        cache: Whether to reuse and store fits keyed by a hash of the group data.
+        cache_dir: Directory of the fit cache.
+
+    Returns:
+        tuple: A table of the direct and centred parameters per group, and a
+            dict of the fitted MultiSkewNorm objects keyed by group.
+
+    """
+    groups = {
+        name: df[list(cols)].set_axis(["x", "y"], axis=1)
+        for name, df in data.groupby(by, sort=True, observed=True)
+    }
+    keys = {name: _fit_key(df.values) for name, df in groups.items()}
+
+    params = {}
+    if cache:
+        for name, key in keys.items():
+            path = Path(cache_dir) / f"{key}.npz"
+            if path.exists():
+                params[name] = _load_cached_fit(path)
+
+    todo = [name for name in groups if name not in params]
+    if todo:
+        datasets = [groups[name].values for name in todo]
+        if parallel:
+            from scripts.r_pool import RWorkerPool
+
+            processes = min(processes or os.cpu_count() or 1, len(todo))
+            with RWorkerPool(processes=processes) as pool:
+                fitted = pool.fit_selm(datasets, batch_size=-(-len(todo) // processes))
+        else:
+            fitted = backends.get_backend("r").selm_batch(datasets)
+        for name, (dp, cp) in zip(todo, fitted):
+            params[name] = (dp, cp)
+            if cache:
+                _save_cached_fit(Path(cache_dir) / f"{keys[name]}.npz", dp, cp)
+
+    fits, rows = {}, {}
+    for name, df in groups.items():
+        dp, cp = params[name]
+        msn = MultiSkewNorm()
+        msn.dp = DirectParams(*dp)
+        msn.cp = CentredParams(*cp)
+        msn.data = df
+        if sample_n is not None:
+            msn.sample(sample_n)
+        fits[name] = msn
+        rows[name] = _params_row(msn.dp, msn.cp, len(df))
+
+    table = pd.DataFrame.from_dict(rows, orient="index")
+    table.index.name = by
+    return table, fits
+
 
 # %%
 
 if __name__ == "__main__":
-    from pathlib import Path
-    from soundscapy.utils.parameters import LANGUAGE_ANGLES, PAQ_IDS
+    from scripts import isd_cache
 
+    # Validated, filtered and projected data, memory-mapped from the cache
     isd_file = Path("ISD v1.0 Data.csv")
-    data = pd.read_csv(isd_file, low_memory=False)
-    data, excl_data = sspy.isd.validate(data)
-    data = data.query("Language != 'cmn'")
-
-    excl_id = [652, 706, 548, 550, 551, 553, 569, 580, 609, 618, 623, 636, 643]
-    data.drop(excl_id, inplace=True)
-
-    for i, row in data.iterrows():
-        lang = row["Language"]
-        angles = LANGUAGE_ANGLES[lang]
-        iso_pl, iso_ev = (
-            sspy.surveys.adj_iso_pl(row[PAQ_IDS], angles, scale=4),
-            sspy.surveys.adj_iso_ev(row[PAQ_IDS], angles, scale=4),
-        )
-        data.loc[i, "ISOPleasant"] = iso_pl
-        data.loc[i, "ISOEventful"] = iso_ev
+    data = isd_cache.load(isd_file)
 
     # %%
 
@@ -382,12 +1038,4 @@ if __name__ == "__main__":
 
     # %%
 
-    fits = []
-
-    for loc in data.LocationID.unique():
-        df = data.query(f"LocationID == '{loc}'")[["ISOPleasant", "ISOEventful"]]
-
-        msn = MultiSkewNorm()
-        msn.fit(data=df)
-        msn.sample()
-        fits.append(msn)
+    fit_table, fits = fit_many(data, by="LocationID", sample_n=1000)
@@ -0,0 +1,78 @@
+"""
+Registry of skew-normal backends, loaded lazily on first use.
+
+A backend is a module exposing at least
+`sample_msn(selm_model=None, xi=None, omega=None, alpha=None, n=1000)`. The R
+backend (`scripts.rpyskewnorm`) additionally provides `selm`, `extract_cp`
+and `extract_dp` for fitting.
+
+Backends are registered by import path (or loader function) and only imported
+by `get_backend`, so importing the modelling code never starts R.
+"""
+
+import importlib
+from types import ModuleType
+from typing import Callable
+
+_REGISTRY: dict[str, str | Callable[[], ModuleType]] = {
+    "native": "scripts.msn_native",
+    "r": "scripts.rpyskewnorm",
+}
+_LOADED: dict[str, ModuleType] = {}
+_DEFAULT = "native"
+
+
+def register_backend(name: str, loader: str | Callable[[], ModuleType]):
+    """
+    Register a backend under a name.
+
+    Args:
+        name: Name to select the backend by.
+        loader: Import path of the backend module, or a function returning it.
+    """
+    _REGISTRY[name] = loader
+    _LOADED.pop(name, None)
+
+
+def set_default_backend(name: str):
+    """
+    Set the backend used when none is requested explicitly.
+    """
+    if name not in _REGISTRY:
+        raise ValueError(f"Unknown backend {name!r}, choose from {list(_REGISTRY)}")
+    global _DEFAULT
+    _DEFAULT = name
+
+
+def resolve(name: str = None) -> str:
+    """
+    Name of the backend selected by `name`, falling back to the default.
+    """
+    name = _DEFAULT if name is None else name
+    if name not in _REGISTRY:
+        raise ValueError(f"Unknown backend {name!r}, choose from {list(_REGISTRY)}")
+    return name
+
+
+def get_backend(name: str = None) -> ModuleType:
+    """
+    Load (on first use) and return a backend module.
+
+    Args:
+        name: Registered backend name. Defaults to the default backend.
+
+    Returns:
+        ModuleType: The backend module.
+    """
+    name = resolve(name)
+    if name not in _LOADED:
+        loader = _REGISTRY[name]
+        if isinstance(loader, str):
+            _LOADED[name] = importlib.import_module(loader)
+        else:
+            _LOADED[name] = loader()
+    return _LOADED[name]
+
+
+def available_backends() -> list[str]:
+    return list(_REGISTRY)
@@ -0,0 +1,352 @@
+"""
+Densities on a fixed circumplex grid, and a density-overlap similarity index.
+
+`sspy.density_plot` evaluates a Gaussian KDE at every grid point from every
+sample point, so a figure of many locations (sample, then KDE, per panel)
+takes minutes. Here densities live on a fixed ``bins x bins`` grid over the
+circumplex:
+
+- `kde_grid` linearly bins the points onto the grid and convolves the counts
+  with the Gaussian kernel by FFT, in O(bins^2 log bins) independently of the
+  number of points. The bandwidth follows scipy's `gaussian_kde` (Scott's
+  rule on the full covariance), as used by seaborn.
+- `msn_grid` evaluates the analytic MSN density at the grid centres, so a
+  fitted or defined target needs no sample at all.
+
+Grids are cached by a hash of their inputs, so re-rendering a figure or
+re-scoring a location reuses them. Two grids on the same grid give the
+overlapping coefficient, the integral of min(p, q), which is 1 for identical
+and 0 for disjoint distributions; `overlap_index` scales it to 0-100 like the
+SPI, and `overlap_matrix` scores targets against locations like `spi_matrix`.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from scripts import msn_native
+
+GRID_BINS = 128
+GRID_EXTENT = (-1.0, 1.0)
+# Kernel support, in standard deviations of the kernel
+KERNEL_SIGMAS = 4
+# Grids kept by the in-memory cache
+CACHE_SIZE = 512
+
+_CACHE: dict[str, "DensityGrid"] = {}
+
+
+class DensityGrid:
+    """
+    A 2D density evaluated at the cell centres of a square grid.
+
+    Attributes:
+        density (np.ndarray): (bins, bins) density, indexed [x, y], i.e.
+            [ISOPleasant, ISOEventful].
+        extent (tuple): (lo, hi) of both axes.
+    """
+
+    __slots__ = ("density", "extent")
+
+    def __init__(self, density: np.ndarray, extent: tuple = GRID_EXTENT):
+        self.density = np.asarray(density, dtype=float)
+        self.extent = tuple(float(e) for e in extent)
+        if self.density.ndim != 2 or self.density.shape[0] != self.density.shape[1]:
+            raise ValueError("density must be a square (bins, bins) array")
+
+    def __repr__(self):
+        return f"DensityGrid(bins={self.bins}, extent={self.extent}, mass={self.mass():.3f})"
+
+    @property
+    def bins(self) -> int:
+        return self.density.shape[0]
+
+    @property
+    def width(self) -> float:
+        return (self.extent[1] - self.extent[0]) / self.bins
+
+    @property
+    def centres(self) -> np.ndarray:
+        return grid_centres(self.bins, self.extent)
+
+    def mass(self) -> float:
+        """
+        Probability mass inside the grid.
+        """
+        return float(self.density.sum() * self.width**2)
+
+    def overlap(self, other: "DensityGrid") -> float:
+        """
+        Overlapping coefficient, the integral of min(p, q) over the grid.
+        """
+        if other.density.shape != self.density.shape or other.extent != self.extent:
+            raise ValueError("Density grids must share their bins and extent")
+        return float(np.minimum(self.density, other.density).sum() * self.width**2)
+
+    def plot(
+        self,
+        ax=None,
+        color: str = "blue",
+        title: str = None,
+        levels: int = 10,
+        fill: bool = True,
+        alpha: float = 0.8,
+    ):
+        """
+        Contour plot of the density on circumplex axes.
+
+        Args:
+            ax: Matplotlib axes. Defaults to the current axes.
+            color: Colour of the contours.
+            title: Title of the axes.
+            levels: Number of contour levels.
+            fill: Fill the contours, shaded from transparent to `color`.
+            alpha: Opacity of the most dense level.
+
+        Returns:
+            The matplotlib axes.
+        """
+        import matplotlib.pyplot as plt
+        from matplotlib.colors import LinearSegmentedColormap, to_rgba
+
+        if ax is None:
+            ax = plt.gca()
+        c = self.centres
+        thresholds = np.linspace(0, self.density.max(), levels + 1)[1:]
+        if fill:
+            cmap = LinearSegmentedColormap.from_list(
+                "density", [to_rgba(color, 0.05), to_rgba(color, alpha)]
+            )
+            ax.contourf(
+                c, c, self.density.T, levels=thresholds, cmap=cmap, extend="max"
+            )
+        ax.contour(c, c, self.density.T, levels=thresholds[:1], colors=[color])
+        ax.axhline(0, color="grey", linestyle="--", linewidth=0.5)
+        ax.axvline(0, color="grey", linestyle="--", linewidth=0.5)
+        ax.set_xlim(self.extent)
+        ax.set_ylim(self.extent)
+        ax.set_aspect("equal")
+        ax.set_xlabel("ISOPleasant")
+        ax.set_ylabel("ISOEventful")
+        if title is not None:
+            ax.set_title(title)
+        return ax
+
+
+def grid_centres(bins: int = GRID_BINS, extent: tuple = GRID_EXTENT) -> np.ndarray:
+    lo, hi = extent
+    width = (hi - lo) / bins
+    return lo + width * (np.arange(bins) + 0.5)
+
+
+def _cached(key: str, build) -> DensityGrid:
+    grid = _CACHE.get(key)
+    if grid is None:
+        grid = build()
+        if len(_CACHE) >= CACHE_SIZE:
+            _CACHE.pop(next(iter(_CACHE)))
+        _CACHE[key] = grid
+    return grid
+
+
+def _key(tag: bytes, *arrays, **options) -> str:
+    h = hashlib.sha256(tag)
+    for a in arrays:
+        h.update(np.ascontiguousarray(a, dtype=float).tobytes())
+    h.update(repr(sorted(options.items())).encode())
+    return h.hexdigest()
+
+
+def clear_cache():
+    _CACHE.clear()
+
+
+def _linear_bin(
+    points: np.ndarray, weights: np.ndarray, lo: float, width: float, bins: int
+) -> np.ndarray:
+    # Share each point's weight between the four nearest cell centres
+    g = (points - lo) / width - 0.5
+    i0 = np.floor(g).astype(np.intp)
+    f = g - i0
+    counts = np.zeros(bins * bins)
+    for dx in (0, 1):
+        for dy in (0, 1):
+            ix, iy = i0[:, 0] + dx, i0[:, 1] + dy
+            w = weights * np.abs(1 - dx - f[:, 0]) * np.abs(1 - dy - f[:, 1])
+            inside = (ix >= 0) & (ix < bins) & (iy >= 0) & (iy < bins)
+            counts += np.bincount(
+                ix[inside] * bins + iy[inside], w[inside], minlength=bins * bins
+            )
+    return counts.reshape(bins, bins)
+
+
+def kde_bandwidth(points: np.ndarray, counts: np.ndarray = None) -> np.ndarray:
+    """
+    Kernel covariance of scipy's `gaussian_kde` with Scott's rule, for points
+    repeated `counts` times.
+    """
+    n = len(points) if counts is None else int(np.sum(counts))
+    cov = np.atleast_2d(np.cov(points.T, fweights=counts))
+    return cov * n ** (-2 / (points.shape[1] + 4))
+
+
+def _kde(points, weights, bins, extent, bandwidth) -> DensityGrid:
+    # scipy.signal is slow to import, so only load it once a KDE is needed
+    from scipy.signal import fftconvolve
+
+    lo, hi = extent
+    width = (hi - lo) / bins
+    # Pad the grid by the kernel support, so mass just outside the extent
+    # still spreads into it
+    pad = int(
+        min(
+            np.ceil(KERNEL_SIGMAS * np.sqrt(bandwidth.diagonal().max()) / width),
+            4 * bins,
+        )
+    )
+    counts = _linear_bin(points, weights, lo - pad * width, width, bins + 2 * pad)
+
+    offsets = width * np.arange(-pad, pad + 1)
+    mesh = np.stack(np.meshgrid(offsets, offsets, indexing="ij"), axis=-1)
+    quad = np.einsum("...i,ij,...j->...", mesh, np.linalg.inv(bandwidth), mesh)
+    kernel = np.exp(-0.5 * quad)
+    kernel /= kernel.sum()
+
+    smoothed = fftconvolve(counts, kernel, mode="same")[
+        pad : pad + bins, pad : pad + bins
+    ]
+    density = np.clip(smoothed, 0, None) / (weights.sum() * width**2)
+    return DensityGrid(density, extent)
+
+
+def kde_grid(
+    points: np.ndarray | pd.DataFrame,
+    bins: int = GRID_BINS,
+    extent: tuple = GRID_EXTENT,
+    counts: np.ndarray = None,
+    bw_adjust: float = 1.0,
+    cache: bool = True,
+) -> DensityGrid:
+    """
+    Gaussian KDE of a sample on the circumplex grid, by FFT convolution.
+
+    Args:
+        points: (n, 2) sample, or a DataFrame with ISOPleasant and ISOEventful.
+        bins: Number of cells along each axis.
+        extent: (lo, hi) of both axes.
+        counts: Optional integer multiplicities of the points, e.g. those of
+            a `lattice.WeightedSample`; the KDE is that of the expanded sample.
+        bw_adjust: Factor on the bandwidth, as in seaborn's kdeplot.
+        cache: Reuse the grid of an identical sample.
+
+    Returns:
+        DensityGrid: The density at the grid cell centres.
+    """
+    if isinstance(points, pd.DataFrame):
+        points = points[["ISOPleasant", "ISOEventful"]].values
+    points = np.asarray(points, dtype=float)
+    if counts is not None:
+        counts = np.asarray(counts, dtype=np.int64)
+    weights = np.ones(len(points)) if counts is None else counts.astype(float)
+
+    def build():
+        bandwidth = kde_bandwidth(points, counts) * bw_adjust**2
+        return _kde(points, weights, bins, tuple(extent), bandwidth)
+
+    if not cache:
+        return build()
+    key = _key(
+        b"kde-v1", points, weights, bins=bins, extent=tuple(extent), bw=bw_adjust
+    )
+    return _cached(key, build)
+
+
+def msn_grid(
+    xi: np.ndarray,
+    omega: np.ndarray,
+    alpha: np.ndarray,
+    bins: int = GRID_BINS,
+    extent: tuple = GRID_EXTENT,
+    cache: bool = True,
+) -> DensityGrid:
+    """
+    Analytic MSN density on the circumplex grid, without sampling.
+
+    Args:
+        xi, omega, alpha: Direct parameters of the MSN.
+        bins: Number of cells along each axis.
+        extent: (lo, hi) of both axes.
+        cache: Reuse the grid of identical parameters.
+
+    Returns:
+        DensityGrid: The density at the grid cell centres.
+    """
+
+    def build():
+        c = grid_centres(bins, extent)
+        mesh = np.stack(np.meshgrid(c, c, indexing="ij"), axis=-1)
+        return DensityGrid(msn_native.dmsn(mesh, xi, omega, alpha), extent)
+
+    if not cache:
+        return build()
+    key = _key(b"msn-v1", xi, omega, alpha, bins=bins, extent=tuple(extent))
+    return _cached(key, build)
+
+
+def overlap_index(p: DensityGrid, q: DensityGrid) -> int:
+    """
+    Density-overlap similarity index, 100 times the overlapping coefficient.
+    """
+    return int(p.overlap(q) * 100)
+
+
+def _target_grid(target, bins, extent) -> DensityGrid:
+    if isinstance(target, DensityGrid):
+        return target
+    if getattr(target, "dp", None) is not None:
+        return target.density_grid(bins=bins, extent=extent)
+    return kde_grid(target, bins, extent)
+
+
+def overlap_matrix(
+    targets: list,
+    data: pd.DataFrame,
+    group: str = "LocationID",
+    locations: list = None,
+    bins: int = GRID_BINS,
+    extent: tuple = GRID_EXTENT,
+) -> pd.DataFrame:
+    """
+    Density-overlap index of every target against every location.
+
+    Args:
+        targets (list): MultiSkewNorm targets (scored by their analytic
+            density), (n, 2) target samples (by their KDE) or DensityGrids.
+        data (pd.DataFrame): Data with ISOPleasant, ISOEventful and a group column.
+        group (str, optional): The column to group the data by.
+        locations (list, optional): Groups to score. Defaults to all groups, sorted.
+        bins (int, optional): Number of cells along each axis.
+        extent (tuple, optional): (lo, hi) of both axes.
+
+    Returns:
+        pd.DataFrame: K x L overlap indices, indexed by target position with
+            the locations as columns, as the SPIs of `spi_matrix`.
+    """
+    assert group in data.columns, f"Group column {group} not in data"
+    grouped = {
+        loc: df[["ISOPleasant", "ISOEventful"]].values
+        for loc, df in data.groupby(group, sort=True)
+    }
+    if locations is None:
+        locations = list(grouped)
+    loc_density = np.stack(
+        [kde_grid(grouped[loc], bins, extent).density for loc in locations]
+    )
+    area = ((extent[1] - extent[0]) / bins) ** 2
+
+    overlap = np.empty((len(targets), len(locations)))
+    for i, target in enumerate(targets):
+        tgt = _target_grid(target, bins, extent).density
+        overlap[i] = np.minimum(tgt, loc_density).sum(axis=(1, 2)) * area
+    return pd.DataFrame((overlap * 100).astype(int), columns=locations)
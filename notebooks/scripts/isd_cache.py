@@ -0,0 +1,259 @@
+"""
+On-disk, memory-mapped cache of the preprocessed ISD dataset.
+
+Preprocessing the ISD (load, validate, drop the 'cmn' responses and the
+excluded outliers, project the PAQs into the circumplex with the
+language-specific angles) is repeated by every notebook and script. This
+module runs it once and writes the result as a versioned bundle of `.npy`
+files; later loads memory-map the bundle, so they take milliseconds and pool
+workers that open the same bundle share its pages instead of receiving a
+pickled copy of the data.
+
+Rows are stored grouped by location, so the points of one location are a
+contiguous, zero-copy slice of the memory map.
+
+The bundle is keyed by a hash of the source data and the exclusion list, so
+changing either creates a new bundle rather than returning stale data.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from importlib.metadata import version
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+CACHE_DIR = Path(
+    os.environ.get("ISD_CACHE_DIR", Path.home() / ".cache" / "single-index" / "isd")
+)
+
+# RegentsParkJapan and RegentsParkFields (helicopters) outliers
+EXCL_ID = [652, 706, 548, 550, 551, 553, 569, 580, 609, 618, 623, 636, 643]
+
+_ARRAYS = ("index", "iso", "location_codes", "language_codes", "offsets")
+
+
+def project_iso(data: pd.DataFrame, scale: int = 4) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Project the PAQs into ISOPleasant and ISOEventful with the angles of each row's language.
+
+    Vectorised equivalent of applying `adj_iso_pl` and `adj_iso_ev` row by row:
+    rows are grouped by language and each group is projected with one matrix product.
+
+    Args:
+        data: ISD data with the PAQ columns and a Language column.
+        scale: Range of the PAQ responses (4 for a 5-point Likert scale).
+
+    Returns:
+        tuple: ISOPleasant and ISOEventful arrays aligned with the rows of data.
+    """
+    from soundscapy.surveys.survey_utils import LANGUAGE_ANGLES, PAQ_IDS
+
+    paqs = data[PAQ_IDS].to_numpy(dtype=float)
+    iso_pl = np.empty(len(data))
+    iso_ev = np.empty(len(data))
+    for lang, rows in data.groupby("Language", sort=False).indices.items():
+        angles = np.deg2rad(LANGUAGE_ANGLES[lang])
+        cos, sin = np.cos(angles), np.sin(angles)
+        iso_pl[rows] = paqs[rows] @ cos / (scale / 2 * np.sum(np.abs(cos)))
+        iso_ev[rows] = paqs[rows] @ sin / (scale / 2 * np.sum(np.abs(sin)))
+    return iso_pl, iso_ev
+
+
+def preprocess(data: pd.DataFrame, excl_id: list[int] = EXCL_ID) -> pd.DataFrame:
+    """
+    Validate, filter and project the raw ISD data as done in the notebooks.
+
+    Args:
+        data: Raw ISD data, e.g. from `sspy.isd.load()`.
+        excl_id: Row indices of outliers to drop.
+
+    Returns:
+        pd.DataFrame: The validated data with ISOPleasant and ISOEventful recalculated.
+    """
+    import soundscapy as sspy
+
+    data, excl_data = sspy.isd.validate(data)
+    data = data.query("Language != 'cmn'")
+    data = data.drop(excl_id)
+    iso_pl, iso_ev = project_iso(data)
+    return data.assign(ISOPleasant=iso_pl, ISOEventful=iso_ev)
+
+
+def cache_key(source: str | Path | pd.DataFrame = None, excl_id=EXCL_ID) -> str:
+    """
+    Hash identifying a source dataset and exclusion list.
+
+    Args:
+        source: Path to an ISD csv, the raw data itself, or None for the dataset
+            bundled with the installed soundscapy version.
+        excl_id: Row indices of outliers to drop.
+
+    Returns:
+        str: Hex digest used to name the cache bundle.
+    """
+    h = hashlib.sha256(f"v{CACHE_VERSION}:{sorted(excl_id)}".encode())
+    if source is None:
+        h.update(f"soundscapy=={version('soundscapy')}".encode())
+    elif isinstance(source, pd.DataFrame):
+        h.update(pd.util.hash_pandas_object(source, index=True).values.tobytes())
+    else:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class ISDBundle:
+    """
+    Memory-mapped view of a preprocessed ISD cache bundle.
+
+    Attributes:
+        path (Path): Directory of the bundle.
+        index (np.ndarray): Original row index of each response.
+        iso (np.ndarray): (n, 2) ISOPleasant and ISOEventful coordinates.
+        location_codes, language_codes (np.ndarray): Integer codes into
+            `locations` and `languages`.
+        offsets (np.ndarray): Start of each location's rows, with a final end offset.
+        locations, languages (list[str]): Category names.
+
+    Pickling an ISDBundle only sends its path; the receiving process re-opens
+    the memory map and shares the same pages.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        meta = json.loads((self.path / "meta.json").read_text())
+        if meta["version"] != CACHE_VERSION:
+            raise ValueError(f"Unsupported ISD cache version {meta['version']}")
+        self.locations = meta["locations"]
+        self.languages = meta["languages"]
+        for name in _ARRAYS:
+            setattr(self, name, np.load(self.path / f"{name}.npy", mmap_mode="r"))
+
+    def __reduce__(self):
+        return (ISDBundle, (self.path,))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return f"ISDBundle(path={str(self.path)!r}, n={len(self)})"
+
+    def select(self, location: str) -> np.ndarray:
+        """
+        Zero-copy (n, 2) view of the ISO coordinates of one location.
+        """
+        i = self.locations.index(location)
+        return self.iso[self.offsets[i] : self.offsets[i + 1]]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The cached data as a DataFrame indexed by the original row index.
+        """
+        return pd.DataFrame(
+            {
+                "LocationID": pd.Categorical.from_codes(
+                    self.location_codes, self.locations
+                ),
+                "Language": pd.Categorical.from_codes(
+                    self.language_codes, self.languages
+                ),
+                "ISOPleasant": self.iso[:, 0],
+                "ISOEventful": self.iso[:, 1],
+            },
+            index=pd.Index(self.index),
+        )
+
+
+def write_bundle(data: pd.DataFrame, path: str | Path, key: str, excl_id=EXCL_ID):
+    """
+    Write preprocessed data to a cache bundle.
+
+    The bundle is written to a temporary directory and renamed into place, so
+    concurrent readers never see a partial bundle.
+    """
+    path = Path(path)
+    data = data.sort_values("LocationID", kind="stable")
+    locations = pd.Categorical(data["LocationID"])
+    languages = pd.Categorical(data["Language"])
+    counts = np.bincount(locations.codes, minlength=len(locations.categories))
+    arrays = {
+        "index": data.index.to_numpy(),
+        "iso": np.ascontiguousarray(data[["ISOPleasant", "ISOEventful"]].to_numpy()),
+        "location_codes": locations.codes.astype(np.int16),
+        "language_codes": languages.codes.astype(np.int16),
+        "offsets": np.concatenate([[0], np.cumsum(counts)]),
+    }
+    meta = {
+        "version": CACHE_VERSION,
+        "key": key,
+        "excl_id": list(excl_id),
+        "locations": list(locations.categories),
+        "languages": list(languages.categories),
+    }
+
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    tmp.mkdir(parents=True, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(tmp / f"{name}.npy", arr)
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+    try:
+        tmp.rename(path)
+    except OSError:
+        # Another process finished the same bundle first
+        shutil.rmtree(tmp)
+
+
+def load_bundle(
+    source: str | Path | pd.DataFrame = None,
+    excl_id: list[int] = EXCL_ID,
+    cache_dir: str | Path = CACHE_DIR,
+    refresh: bool = False,
+) -> ISDBundle:
+    """
+    Load the preprocessed ISD from the cache, building the cache on a miss.
+
+    Args:
+        source: Path to an ISD csv, the raw data itself, or None to use
+            `sspy.isd.load()`.
+        excl_id: Row indices of outliers to drop.
+        cache_dir: Directory holding the cache bundles.
+        refresh: Rebuild the bundle even if it already exists.
+
+    Returns:
+        ISDBundle: Memory-mapped view of the preprocessed data.
+    """
+    key = cache_key(source, excl_id)
+    path = Path(cache_dir) / f"isd-v{CACHE_VERSION}-{key[:16]}"
+    if refresh and path.exists():
+        shutil.rmtree(path)
+    if not path.exists():
+        if source is None:
+            import soundscapy as sspy
+
+            raw = sspy.isd.load()
+        elif isinstance(source, pd.DataFrame):
+            raw = source
+        else:
+            raw = pd.read_csv(source, low_memory=False)
+        write_bundle(preprocess(raw, excl_id), path, key, excl_id)
+    return ISDBundle(path)
+
+
+def load(
+    source: str | Path | pd.DataFrame = None,
+    excl_id: list[int] = EXCL_ID,
+    cache_dir: str | Path = CACHE_DIR,
+    refresh: bool = False,
+) -> pd.DataFrame:
+    """
+    Preprocessed ISD data as a DataFrame, from the cache where possible.
+
+    See `load_bundle` for the arguments.
+    """
+    return load_bundle(source, excl_id, cache_dir, refresh).to_frame()
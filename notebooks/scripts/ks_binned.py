@@ -0,0 +1,166 @@
+"""
+Histogram-based approximation of the two-sample, two-dimensional KS statistic.
+
+Both samples are binned on a shared ``bins x bins`` grid covering the
+circumplex, and 2D prefix sums (summed-area tables) of the counts give the
+quadrant fractions at the upper-right corner of every cell in O(bins**2),
+independently of the sample sizes. The quadrants are then only evaluated at
+cells that are occupied by the sample whose points would have been used as
+origins in the exact test.
+
+Error bound
+-----------
+Moving a quadrant origin from a sample point to the corner of its cell can
+only change a quadrant fraction by the mass lying in that cell's row strip
+and column strip. The approximate statistic therefore satisfies
+
+    |D_binned - D_exact| <= max_i (P1x_i + P2x_i) + max_j (P1y_j + P2y_j)
+
+where ``Pkx_i`` (``Pky_j``) is the fraction of sample k in x-bin i (y-bin j).
+For samples from smooth densities with marginal densities bounded by ``g_x``
+and ``g_y`` this is approximately ``2 * (g_x + g_y) * h`` with
+``h = (hi - lo) / bins`` the bin width, i.e. it shrinks linearly with the
+number of bins. The bound is computed from the data and can be returned
+alongside the statistic.
+"""
+
+import numpy as np
+
+DEFAULT_BINS = 512
+# Combined number of points above which `method="auto"` switches to binning
+APPROX_THRESHOLD = 20_000
+KS_METHODS = ("exact", "binned", "auto")
+
+
+def use_binned(method: str, n1: int, n2: int, threshold: int = APPROX_THRESHOLD):
+    """
+    Decide whether a KS comparison should use the binned approximation.
+
+    Args:
+        method: One of "exact", "binned" or "auto".
+        n1: Size of the first sample.
+        n2: Size of the second sample.
+        threshold: Combined sample size above which "auto" selects binning.
+
+    Returns:
+        bool: True if the binned approximation should be used.
+
+    Raises:
+        ValueError: If method is not recognised.
+
+    """
+    if method not in KS_METHODS:
+        raise ValueError(f"method must be one of {KS_METHODS}, got {method!r}")
+    if method == "auto":
+        return n1 + n2 > threshold
+    return method == "binned"
+
+
+def grid_extent(*coords: np.ndarray) -> tuple[float, float]:
+    """
+    Shared grid extent covering the circumplex [-1, 1] and all given coordinates.
+    """
+    lo = min([-1.0] + [float(np.min(c)) for c in coords])
+    hi = max([1.0] + [float(np.max(c)) for c in coords])
+    return lo, hi
+
+
+def _bin_index(v: np.ndarray, lo: float, width: float, bins: int) -> np.ndarray:
+    # Bins are closed on the right, (e_i, e_i+1], so that the prefix sum at
+    # a cell counts every point with coordinate <= the cell's upper edge.
+    idx = np.ceil((v - lo) / width).astype(np.intp) - 1
+    return np.clip(idx, 0, bins - 1)
+
+
+def cell_counts(
+    x: np.ndarray,
+    y: np.ndarray,
+    extent: tuple[float, float],
+    bins: int = DEFAULT_BINS,
+    weights: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Bin a 2D sample onto the shared grid.
+
+    Args:
+        weights: Optional integer multiplicities of the points.
+
+    Returns:
+        np.ndarray: Integer counts of shape (bins, bins), indexed [x-bin, y-bin].
+
+    """
+    lo, hi = extent
+    width = (hi - lo) / bins
+    ix = _bin_index(np.asarray(x), lo, width, bins)
+    iy = _bin_index(np.asarray(y), lo, width, bins)
+    counts = np.bincount(ix * bins + iy, weights=weights, minlength=bins * bins)
+    return counts.astype(np.int64).reshape(bins, bins)
+
+
+def quadrant_fractions(counts: np.ndarray) -> np.ndarray:
+    """
+    Quadrant fractions at every cell corner from a summed-area table.
+
+    Args:
+        counts: Integer cell counts as returned by `cell_counts`.
+
+    Returns:
+        np.ndarray: Array of shape (3, bins, bins) holding the fractions of
+            points with (x <= X, y <= Y), (x <= X, y > Y) and (x > X, y <= Y)
+            for the upper-right corner (X, Y) of each cell. The fourth
+            quadrant is one minus their sum.
+
+    """
+    n = counts.sum()
+    sat = counts.cumsum(axis=0).cumsum(axis=1)
+    lower_left = sat
+    upper_left = sat[:, -1:] - sat
+    lower_right = sat[-1:, :] - sat
+    return np.stack([lower_left, upper_left, lower_right]) / n
+
+
+def strip_bound(counts1: np.ndarray, counts2: np.ndarray) -> float:
+    """
+    Upper bound on |D_binned - D_exact| for the given pair of binned samples.
+    """
+    px = counts1.sum(axis=1) / counts1.sum() + counts2.sum(axis=1) / counts2.sum()
+    py = counts1.sum(axis=0) / counts1.sum() + counts2.sum(axis=0) / counts2.sum()
+    return float(px.max() + py.max())
+
+
+def binned_differences(
+    x1: np.ndarray,
+    y1: np.ndarray,
+    x2: np.ndarray,
+    y2: np.ndarray,
+    bins: int = DEFAULT_BINS,
+    w1: np.ndarray = None,
+    w2: np.ndarray = None,
+):
+    """
+    Quadrant fraction differences between two samples on a shared grid.
+
+    Args:
+        x1, y1: Coordinates of sample 1.
+        x2, y2: Coordinates of sample 2.
+        bins: Number of bins along each axis.
+        w1, w2: Optional integer multiplicities of the points of each sample.
+
+    Returns:
+        tuple: (D1, D2, bound) where D1 and D2 have shape (k, 4) and hold the
+            differences (sample 1 - sample 2) of the four quadrant fractions
+            at the cells occupied by sample 1 and sample 2 respectively, and
+            bound is the error bound from `strip_bound`.
+
+    """
+    extent = grid_extent(x1, y1, x2, y2)
+    counts1 = cell_counts(x1, y1, extent, bins, w1)
+    counts2 = cell_counts(x2, y2, extent, bins, w2)
+
+    diff = quadrant_fractions(counts1) - quadrant_fractions(counts2)
+    # The fourth quadrant difference follows from the fractions summing to one
+    diff = np.concatenate([diff, -diff.sum(axis=0, keepdims=True)])
+
+    D1 = diff[:, counts1 > 0].T
+    D2 = diff[:, counts2 > 0].T
+    return D1, D2, strip_bound(counts1, counts2)
@@ -0,0 +1,331 @@
+"""
+Simulated null distributions of the two-sample 2D KS statistic.
+
+The p-values of `KS2D.ks2d2s` and `msn_utils.ks2d2s` come from the Press et
+al. approximation, which is poor for small samples and for p > ~0.2, while
+the bootstrap (`nboot`) costs hundreds of statistic evaluations per test.
+This module builds, once and offline, a table of quantiles of the null
+distribution of D indexed by (n1, n2, pooled correlation), and turns a D into
+a p-value at runtime by interpolating in that table.
+
+The null is simulated from a bivariate normal with the pooled correlation
+r = sqrt((r1**2 + r2**2) / 2) of the two samples, the same proxy for the
+dependence between the coordinates as the Press et al. formula. D only depends
+on the ranks of each coordinate, so the table holds for any continuous
+marginals. The two KS engines treat ties and quadrant boundaries differently
+(see `msn_utils.maxdist`), so each has its own table ("ks2d" or "msn_utils").
+
+Quantiles are stored for lambda = D * sqrt(n1 n2 / (n1 + n2)), which varies
+slowly with the sample sizes, and looked up with multilinear interpolation in
+(log n1, log n2, r). Sample sizes beyond the grid use its nearest edge.
+
+Build a table with
+
+    python -m scripts.ks_null --statistic ks2d --nsim 20000 --parallel
+
+and opt into it with `ks2d2s(..., null_table="auto")`; the tests keep the
+analytic p-values by default.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from scripts.quadrants import quadrant_counts
+
+TABLE_VERSION = 1
+STATISTICS = ("ks2d", "msn_utils")
+TABLE_DIR = Path(
+    os.environ.get("KS_NULL_DIR", Path.home() / ".cache" / "single-index" / "ks_null")
+)
+
+N_GRID = (8, 12, 16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512, 768, 1024)
+R_GRID = (0.0, 0.2, 0.4, 0.6, 0.8, 0.9, 0.95)
+# Cumulative probabilities of the stored quantiles, denser in the upper tail
+LEVELS = np.concatenate(
+    [np.linspace(0, 0.99, 100), 1 - np.geomspace(1e-2, 1e-4, 9)[1:]]
+)
+
+_tables = {}
+
+
+def pooled_r(r1: float, r2: float) -> float:
+    """
+    Pooled absolute correlation of two samples, as used by the Press et al. formula.
+    """
+    return float(np.sqrt((r1 * r1 + r2 * r2) / 2))
+
+
+def _statistic(name: str):
+    # D for two (n, 2) arrays under the convention of each KS engine
+    if name == "ks2d":
+
+        def dist(a, b):
+            d1 = np.abs(
+                quadrant_counts(a, a) / len(a) - quadrant_counts(a, b) / len(b)
+            ).max()
+            d2 = np.abs(
+                quadrant_counts(b, a) / len(a) - quadrant_counts(b, b) / len(b)
+            ).max()
+            return (d1 + d2) / 2
+
+    elif name == "msn_utils":
+        from scripts.msn_utils import avgmaxdist
+
+        def dist(a, b):
+            return avgmaxdist(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+
+    else:
+        raise ValueError(f"Unknown statistic {name!r}, choose from {STATISTICS}")
+    return dist
+
+
+def simulate_cell(
+    statistic: str, n1: int, n2: int, r: float, nsim: int, seed: int = 0
+) -> np.ndarray:
+    """
+    Quantiles at `LEVELS` of the null distribution of lambda for one table cell.
+
+    The random stream depends only on (seed, n1, n2, r), so cells can be
+    simulated in any order and on any worker.
+    """
+    dist = _statistic(statistic)
+    rng = np.random.default_rng([seed, n1, n2, int(round(r * 1000))])
+    chol = np.linalg.cholesky(np.array([[1.0, r], [r, 1.0]]))
+    scale = np.sqrt(n1 * n2 / (n1 + n2))
+    lam = np.empty(nsim)
+    for i in range(nsim):
+        a = rng.standard_normal((n1, 2)) @ chol.T
+        b = rng.standard_normal((n2, 2)) @ chol.T
+        lam[i] = dist(a, b) * scale
+    return np.quantile(lam, LEVELS)
+
+
+class NullTable:
+    """
+    Quantiles of the scaled null statistic lambda on a (n1, n2, r) grid.
+
+    Attributes:
+        statistic (str): KS engine the table was simulated for.
+        n_grid (np.ndarray): Sample sizes, used for both n1 and n2.
+        r_grid (np.ndarray): Pooled correlations.
+        levels (np.ndarray): Cumulative probabilities of the quantiles.
+        quantiles (np.ndarray): (len(n_grid), len(n_grid), len(r_grid),
+            len(levels)) quantiles of lambda, symmetric in n1 and n2.
+        nsim (int): Simulations per cell.
+    """
+
+    def __init__(self, statistic, n_grid, r_grid, levels, quantiles, nsim, seed=0):
+        self.statistic = statistic
+        self.n_grid = np.asarray(n_grid)
+        self.r_grid = np.asarray(r_grid, dtype=float)
+        self.levels = np.asarray(levels, dtype=float)
+        self.quantiles = np.asarray(quantiles)
+        self.nsim = nsim
+        self.seed = seed
+
+    def __repr__(self):
+        return (
+            f"NullTable(statistic={self.statistic!r}, n={self.n_grid.min()}-"
+            f"{self.n_grid.max()}, r={self.r_grid.min()}-{self.r_grid.max()}, "
+            f"nsim={self.nsim})"
+        )
+
+    @classmethod
+    def load(cls, path: str | Path) -> "NullTable":
+        with np.load(path) as f:
+            meta = json.loads(str(f["meta"]))
+            if meta["version"] != TABLE_VERSION:
+                raise ValueError(f"Unsupported KS null table version {meta['version']}")
+            return cls(
+                meta["statistic"],
+                f["n_grid"],
+                f["r_grid"],
+                f["levels"],
+                f["quantiles"],
+                meta["nsim"],
+                meta["seed"],
+            )
+
+    def save(self, path: str | Path):
+        """
+        Write the table, renaming into place so a partial file is never read.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "version": TABLE_VERSION,
+            "statistic": self.statistic,
+            "nsim": self.nsim,
+            "seed": self.seed,
+        }
+        tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                meta=np.array(json.dumps(meta)),
+                n_grid=self.n_grid,
+                r_grid=self.r_grid,
+                levels=self.levels,
+                quantiles=self.quantiles.astype(np.float32),
+            )
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _bracket(grid, x):
+        # Lower grid index and interpolation weight, clamped to the grid
+        x = np.clip(x, grid[0], grid[-1])
+        i = np.clip(np.searchsorted(grid, x, side="right") - 1, 0, len(grid) - 2)
+        return i, (x - grid[i]) / (grid[i + 1] - grid[i])
+
+    def pvalue(self, d: float, n1: int, n2: int, r: float) -> float:
+        """
+        P(D >= d) under the null for samples of sizes n1, n2 and pooled correlation r.
+
+        The p-value of each of the eight surrounding grid cells is read off its
+        quantile curve and the results interpolated multilinearly. Beyond the
+        largest stored quantile the p-value is bounded by the table's
+        resolution, 1 - levels[-1], and the analytic formula.
+        """
+        scale = np.sqrt(n1 * n2 / (n1 + n2))
+        lam = d * scale
+        log_n = np.log(self.n_grid)
+        i, ti = self._bracket(log_n, np.log(min(n1, n2)))
+        j, tj = self._bracket(log_n, np.log(max(n1, n2)))
+        k, tk = self._bracket(self.r_grid, abs(r))
+
+        p = 0.0
+        tail = 1 - self.levels[-1]
+        for di, wi in ((0, 1 - ti), (1, ti)):
+            for dj, wj in ((0, 1 - tj), (1, tj)):
+                for dk, wk in ((0, 1 - tk), (1, tk)):
+                    w = wi * wj * wk
+                    if w == 0:
+                        continue
+                    q = self.quantiles[i + di, j + dj, k + dk]
+                    p += w * (1 - np.interp(lam, q, self.levels, right=1.0))
+        if p <= 0:
+            from scripts.KS2D import Qks
+
+            rr = np.sqrt(1 - r * r)
+            return min(tail, Qks(float(lam / (1 + rr * (0.25 - 0.75 / scale)))))
+        return float(p)
+
+
+def build_table(
+    statistic: str,
+    n_grid: tuple = N_GRID,
+    r_grid: tuple = R_GRID,
+    nsim: int = 20000,
+    seed: int = 0,
+    parallel: bool = True,
+) -> NullTable:
+    """
+    Simulate the null table of a KS engine.
+
+    Cells with n1 <= n2 are simulated (D is symmetric in the two samples) as
+    independent tasks over a process pool and mirrored.
+
+    Args:
+        statistic: "ks2d" or "msn_utils".
+        n_grid: Sample sizes.
+        r_grid: Pooled correlations, in [0, 1).
+        nsim: Simulations per cell; p-values below about 1 / nsim are not resolved.
+        seed: Base seed.
+        parallel: Whether to simulate the cells over a process pool.
+
+    Returns:
+        NullTable: The table.
+    """
+    _statistic(statistic)
+    n_grid = np.asarray(sorted(n_grid))
+    cells = [
+        (a, b, c)
+        for a in range(len(n_grid))
+        for b in range(a, len(n_grid))
+        for c in range(len(r_grid))
+    ]
+    jobs = [
+        (statistic, int(n_grid[a]), int(n_grid[b]), float(r_grid[c]), nsim, seed)
+        for a, b, c in cells
+    ]
+    if parallel:
+        from tqdm_pathos import tqdm_pathos
+
+        results = tqdm_pathos.starmap(simulate_cell, jobs)
+    else:
+        results = [simulate_cell(*job) for job in jobs]
+
+    quantiles = np.empty((len(n_grid), len(n_grid), len(r_grid), len(LEVELS)))
+    for (a, b, c), q in zip(cells, results):
+        quantiles[a, b, c] = quantiles[b, a, c] = q
+    return NullTable(statistic, n_grid, r_grid, LEVELS, quantiles, nsim, seed)
+
+
+def table_path(statistic: str, table_dir: str | Path = None) -> Path:
+    return Path(table_dir or TABLE_DIR) / f"{statistic}-v{TABLE_VERSION}.npz"
+
+
+def get_table(statistic: str) -> NullTable | None:
+    """
+    The installed null table of a KS engine, loaded once, or None if none was built.
+    """
+    if statistic not in _tables:
+        path = table_path(statistic)
+        _tables[statistic] = NullTable.load(path) if path.exists() else None
+    return _tables[statistic]
+
+
+def resolve_table(null_table, statistic: str) -> NullTable | None:
+    """
+    Resolve the `null_table` argument of the ks2d2s functions.
+
+    Args:
+        null_table: "auto" for the installed table (None if not built), None
+            for no table, a path to a table file, or a NullTable.
+        statistic: KS engine asking for the table.
+    """
+    if null_table is None or isinstance(null_table, NullTable):
+        return null_table
+    if isinstance(null_table, str) and null_table == "auto":
+        return get_table(statistic)
+    return NullTable.load(null_table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a 2D KS null table")
+    parser.add_argument(
+        "--statistic", choices=STATISTICS, default="ks2d", help="KS engine"
+    )
+    parser.add_argument(
+        "--n_grid", type=int, nargs="+", default=list(N_GRID), help="Sample sizes"
+    )
+    parser.add_argument(
+        "--r_grid",
+        type=float,
+        nargs="+",
+        default=list(R_GRID),
+        help="Pooled correlations",
+    )
+    parser.add_argument("--nsim", type=int, default=20000, help="Simulations per cell")
+    parser.add_argument("--seed", type=int, default=0, help="Base seed")
+    parser.add_argument("--parallel", action="store_true", help="Run in parallel")
+    parser.add_argument(
+        "--out", help="Output file. Defaults to the table used by 'auto' lookups"
+    )
+    args = parser.parse_args()
+
+    table = build_table(
+        args.statistic,
+        n_grid=args.n_grid,
+        r_grid=args.r_grid,
+        nsim=args.nsim,
+        seed=args.seed,
+        parallel=args.parallel,
+    )
+    out = Path(args.out) if args.out else table_path(args.statistic)
+    table.save(out)
+    print(f"Wrote {table} to {out}")
@@ -0,0 +1,63 @@
+"""
+Thread-pool evaluation of one large KS comparison.
+
+Process pools (`tqdm_pathos`) parallelise over independent (target, location)
+pairs, but a single comparison of two samples of 10^5+ points runs on one
+core. The exact KS statistics are maxima over quadrant origins, so the origins
+can be split into chunks, each chunk reduced to its own extrema, and the
+extrema combined. The per-chunk work is large NumPy comparisons, reductions
+and BLAS products, which release the GIL, so threads scale across cores
+without spawning processes or pickling the samples. Extrema combine exactly,
+so the statistic does not depend on the number of workers.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import numpy as np
+
+# Chunks per worker, so that uneven chunks still balance across threads
+CHUNKS_PER_WORKER = 4
+
+
+def resolve_workers(workers: int = None) -> int:
+    """
+    Number of threads for `workers`: None means 1, -1 all cores.
+    """
+    if workers is None:
+        return 1
+    if workers == -1:
+        return os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f"workers must be a positive integer or -1, got {workers}")
+    return workers
+
+
+def chunk_slices(n: int, workers: int) -> list[slice]:
+    """
+    Split range(n) into contiguous slices for `workers` threads.
+    """
+    n_chunks = min(max(n, 1), workers * CHUNKS_PER_WORKER if workers > 1 else 1)
+    bounds = np.linspace(0, n, n_chunks + 1).astype(int)
+    return [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def map_chunks(func: Callable[[slice], object], n: int, workers: int = None) -> list:
+    """
+    Apply `func` to the slices of range(n), over a thread pool if workers > 1.
+
+    Args:
+        func: Function of a slice of the query points, returning its partial result.
+        n: Number of query points.
+        workers: Number of threads, see `resolve_workers`.
+
+    Returns:
+        list: The partial results, in order.
+    """
+    workers = resolve_workers(workers)
+    slices = chunk_slices(n, workers)
+    if workers == 1 or len(slices) == 1:
+        return [func(s) for s in slices]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, slices))
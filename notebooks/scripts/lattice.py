@@ -0,0 +1,105 @@
+"""
+Weighted-point representation of samples with many repeated coordinates.
+
+ISD responses are 5-point Likert PAQ ratings, so the ISOPleasant/ISOEventful
+projection of a location's responses falls on a small lattice (one per
+language's angle set) and most responses share their coordinates with others.
+A `WeightedSample` holds the unique coordinates and their integer
+multiplicities. The KS engines (`KS2D.ks2d2s`, `msn_utils.ks2d2s`,
+`spi_matrix`) accept it in place of an (n, 2) array and count quadrants with
+the multiplicities as weights, so each unique point is evaluated once as an
+origin and compared against once as a point. The counts are the same integers
+as with the expanded sample, so D is bit-identical.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class WeightedSample:
+    """
+    Unique 2D points with integer multiplicities.
+
+    Attributes:
+        points (np.ndarray): (u, 2) unique coordinates, sorted lexicographically.
+        weights (np.ndarray): (u,) int64 number of observations at each point.
+    """
+
+    __slots__ = ("points", "weights")
+
+    def __init__(self, points: np.ndarray, weights: np.ndarray):
+        self.points = np.ascontiguousarray(points)
+        self.weights = np.asarray(weights, dtype=np.int64)
+        if self.points.ndim != 2 or self.points.shape[1] != 2:
+            raise TypeError("points must be an (u, 2) array")
+        if len(self.weights) != len(self.points):
+            raise ValueError("points and weights must have the same length")
+
+    @classmethod
+    def from_points(
+        cls, points: np.ndarray | pd.DataFrame, dtype=None
+    ) -> "WeightedSample":
+        """
+        Collapse repeated coordinates of a sample.
+
+        Args:
+            points: (n, 2) array, or a DataFrame with ISOPleasant and ISOEventful.
+            dtype: Floating point type to hold the coordinates in. None keeps
+                the input type. Applied before deduplication, so points equal
+                after rounding to dtype are merged.
+
+        Returns:
+            WeightedSample: The unique points and their multiplicities.
+        """
+        if isinstance(points, pd.DataFrame):
+            points = points[["ISOPleasant", "ISOEventful"]].values
+        points = np.asarray(points, dtype=dtype)
+        unique, counts = np.unique(points, axis=0, return_counts=True)
+        return cls(unique, counts)
+
+    def __len__(self):
+        # Number of observations, as for the expanded sample
+        return int(self.weights.sum())
+
+    def __repr__(self):
+        return f"WeightedSample(n={len(self)}, unique={self.n_unique})"
+
+    @property
+    def n_unique(self) -> int:
+        return len(self.points)
+
+    @property
+    def duplication(self) -> float:
+        """
+        Observations per unique point, the factor saved on this sample's side.
+        """
+        return len(self) / max(self.n_unique, 1)
+
+    def astype(self, dtype) -> "WeightedSample":
+        if dtype is None or self.points.dtype == dtype:
+            return self
+        return WeightedSample(self.points.astype(dtype), self.weights)
+
+    def expand(self) -> np.ndarray:
+        """
+        The (n, 2) sample with every point repeated by its multiplicity.
+        """
+        return np.repeat(self.points, self.weights, axis=0)
+
+    def corr(self) -> float:
+        """
+        Pearson correlation of the coordinates of the expanded sample.
+        """
+        w = self.weights / len(self)
+        centred = self.points - w @ self.points
+        cov = (centred * w[:, None]).T @ centred
+        return float(cov[0, 1] / np.sqrt(cov[0, 0] * cov[1, 1]))
+
+
+def as_weighted(sample, dtype=None) -> WeightedSample:
+    """
+    A WeightedSample from either a WeightedSample or an (n, 2) sample.
+    """
+    if isinstance(sample, WeightedSample):
+        return sample.astype(dtype)
+    return WeightedSample.from_points(sample, dtype)
@@ -0,0 +1,393 @@
+"""
+Native NumPy implementation of the multivariate skew-normal distribution.
+
+Mirrors the parts of the R `sn` package used through `scripts.rpyskewnorm`
+without starting R, so that sampling and density evaluation can run in tight
+loops and in worker processes.
+
+The densities and distribution functions (`dsn`, `psn`, `dmsn`, `pmsn`) follow
+the argument conventions of their `sn` namesakes and evaluate over arrays of
+points.
+"""
+
+import warnings
+
+import numpy as np
+from scipy.special import log_ndtr, ndtr, ndtri, owens_t
+
+# Points per block in pmsn, bounding the (points x nodes) temporaries
+CDF_CHUNK = 2**16
+# Gauss-Legendre nodes of the trivariate normal integral in pmsn
+TVN_NODES = 48
+
+
+def _outer(v: np.ndarray) -> np.ndarray:
+    return v[..., :, None] * v[..., None, :]
+
+
+def delta_from_dp(omega: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """
+    The delta vector of a skew-normal from its scale matrix and shape.
+
+    Vectorised over any leading axes.
+
+    Args:
+        omega: (..., d, d) scale matrices Omega.
+        alpha: (..., d) shape vectors.
+
+    Returns:
+        np.ndarray: delta = Omega_bar alpha / sqrt(1 + alpha' Omega_bar alpha),
+            with Omega_bar the correlation matrix of Omega.
+    """
+    omega = np.asarray(omega, dtype=float)
+    alpha = np.asarray(alpha, dtype=float)
+    scale = np.sqrt(np.diagonal(omega, axis1=-2, axis2=-1))
+    corr_alpha = np.einsum("...ij,...j->...i", omega / _outer(scale), alpha)
+    quad = np.einsum("...i,...i->...", alpha, corr_alpha)
+    return corr_alpha / np.sqrt(1 + quad)[..., None]
+
+
+def dp2cp(xi: np.ndarray, omega: np.ndarray, alpha: np.ndarray) -> tuple:
+    """
+    Convert direct parameters to centred parameters.
+
+    Vectorised over any leading axes, so a batch of N candidates is converted
+    by passing (N, d), (N, d, d) and (N, d) arrays.
+
+    Args:
+        xi: (..., d) locations.
+        omega: (..., d, d) scale matrices.
+        alpha: (..., d) shapes.
+
+    Returns:
+        tuple: (mean, sigma, skew) with shapes (..., d), (..., d, d) and
+            (..., d); sigma is the covariance matrix and skew the marginal
+            skewness, as returned by sn's dp2cp.
+    """
+    omega = np.asarray(omega, dtype=float)
+    scale = np.sqrt(np.diagonal(omega, axis1=-2, axis2=-1))
+    mu_z = np.sqrt(2 / np.pi) * delta_from_dp(omega, alpha)
+    shift = scale * mu_z
+
+    mean = np.asarray(xi, dtype=float) + shift
+    sigma = omega - _outer(shift)
+    skew = (4 - np.pi) / 2 * mu_z**3 / (1 - mu_z**2) ** 1.5
+    return mean, sigma, skew
+
+
+def cp2dp(mean: np.ndarray, sigma: np.ndarray, skew: np.ndarray) -> tuple:
+    """
+    Convert centred parameters to direct parameters.
+
+    Vectorised over any leading axes. Centred parameters with no skew-normal
+    counterpart (marginal skewness beyond about +/-0.995, or a combination
+    implying |delta| >= 1) give NaN shapes rather than raising, so they can be
+    masked out of a batch.
+
+    Args:
+        mean: (..., d) means.
+        sigma: (..., d, d) covariance matrices.
+        skew: (..., d) marginal skewness.
+
+    Returns:
+        tuple: (xi, omega, alpha) with shapes (..., d), (..., d, d) and (..., d).
+    """
+    sigma = np.asarray(sigma, dtype=float)
+    # Invert skew = (4 - pi) / 2 * r**3 with r = mu_z / sqrt(1 - mu_z**2)
+    r = np.cbrt(2 * np.asarray(skew, dtype=float) / (4 - np.pi))
+    mu_z = r / np.sqrt(1 + r**2)
+    scale = np.sqrt(np.diagonal(sigma, axis1=-2, axis2=-1) / (1 - mu_z**2))
+    shift = scale * mu_z
+
+    xi = np.asarray(mean, dtype=float) - shift
+    omega = sigma + _outer(shift)
+
+    delta = mu_z / np.sqrt(2 / np.pi)
+    corr_inv_delta = np.linalg.solve(omega / _outer(scale), delta[..., None])[..., 0]
+    quad = np.einsum("...i,...i->...", delta, corr_inv_delta)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        alpha = corr_inv_delta / np.sqrt(1 - quad)[..., None]
+    alpha[quad >= 1] = np.nan
+    return xi, omega, alpha
+
+
+def sample_msn(
+    selm_model=None,
+    xi: np.ndarray = None,
+    omega: np.ndarray = None,
+    alpha: np.ndarray = None,
+    n: int = 1000,
+    rng: np.random.Generator | int = None,
+    qmc: bool = False,
+) -> np.ndarray:
+    """
+    Sample from a multivariate skew-normal distribution.
+
+    Uses the additive representation used by `sn::rmsn`: (x0, x) is drawn from
+    a normal with correlation [[1, delta'], [delta, Omega_bar]] and x is
+    reflected wherever x0 <= 0, then scaled and shifted.
+
+    With `qmc`, the sample is a low-discrepancy point set instead: scrambled
+    Sobol points u in [0, 1)^(d+1) are mapped to a half-normal |z0| and d
+    normals z, and x = delta |z0| + L z with L L' = Omega_bar - delta delta'.
+    This map is continuous in u (unlike the reflection), so the sample keeps
+    the even coverage of the Sobol points, and statistics of the sample such
+    as the SPI vary much less between seeds than with pseudo-random draws.
+    Sobol points are balanced for n a power of 2, and the first n points of a
+    seeded sequence are a prefix of the first 2n.
+
+    Args:
+        selm_model: Not supported by this backend, fitted models are sampled
+            through their direct parameters.
+        xi: (d,) location vector.
+        omega: (d, d) scale matrix.
+        alpha: (d,) shape vector.
+        n: Number of samples.
+        rng: Random generator or seed. With `qmc`, seeds the scrambling.
+        qmc: Draw a scrambled Sobol (quasi-Monte Carlo) sample.
+
+    Returns:
+        np.ndarray: (n, d) array of samples.
+
+    Raises:
+        ValueError: If xi, omega and alpha are not provided.
+    """
+    if selm_model is not None:
+        raise ValueError(
+            "The native backend samples from xi, omega and alpha, not selm models."
+        )
+    if xi is None or omega is None or alpha is None:
+        raise ValueError("xi, omega, and alpha must be provided.")
+
+    rng = np.random.default_rng(rng)
+    xi = np.ravel(xi)
+    omega = np.asarray(omega, dtype=float)
+    alpha = np.ravel(alpha).astype(float)
+
+    scale = np.sqrt(np.diag(omega))
+    corr = omega / np.outer(scale, scale)
+    delta = delta_from_dp(omega, alpha)
+    if qmc:
+        return xi + _sobol_sn(corr, delta, n, rng) * scale
+
+    aug = np.block([[np.ones((1, 1)), delta[None, :]], [delta[:, None], corr]])
+
+    z = rng.standard_normal((n, len(xi) + 1)) @ np.linalg.cholesky(aug).T
+    x = np.where(z[:, :1] > 0, z[:, 1:], -z[:, 1:])
+    return xi + x * scale
+
+
+def _sobol_sn(corr, delta, n, rng):
+    # Standardised skew-normal sample from scrambled Sobol points, see sample_msn
+    from scipy.stats import qmc as scipy_qmc
+
+    sobol = scipy_qmc.Sobol(len(delta) + 1, scramble=True, seed=rng)
+    with warnings.catch_warnings():
+        # Balance warning for n not a power of 2; prefixes are still low-discrepancy
+        warnings.simplefilter("ignore", UserWarning)
+        u = sobol.random(n)
+    # Keep the inverse CDF finite at the (measure zero) edge u = 0
+    u = np.clip(u, np.finfo(float).tiny, None)
+    half_normal = ndtri((1 + u[:, 0]) / 2)
+    z = ndtri(u[:, 1:])
+    chol = np.linalg.cholesky(corr - np.outer(delta, delta))
+    return half_normal[:, None] * delta + z @ chol.T
+
+
+def dsn(x, xi=0.0, omega=1.0, alpha=0.0, log: bool = False) -> np.ndarray:
+    """
+    Density of the univariate skew-normal, as `sn::dsn`.
+
+    Args:
+        x: Points to evaluate, any shape.
+        xi, omega, alpha: Location, scale and shape, broadcast against x.
+        log: Return the log-density.
+
+    Returns:
+        np.ndarray: 2 / omega * phi(z) * Phi(alpha * z) with z = (x - xi) / omega.
+    """
+    z = (np.asarray(x, dtype=float) - xi) / omega
+    log_norm = np.log(2 / omega) - 0.5 * (z**2 + np.log(2 * np.pi))
+    if log:
+        return log_norm + log_ndtr(alpha * z)
+    return np.exp(log_norm) * ndtr(alpha * z)
+
+
+def psn(x, xi=0.0, omega=1.0, alpha=0.0) -> np.ndarray:
+    """
+    Distribution function of the univariate skew-normal, as `sn::psn`.
+
+    Uses Phi(z) - 2 T(z, alpha), with T Owen's T function.
+
+    Args:
+        x: Points to evaluate, any shape.
+        xi, omega, alpha: Location, scale and shape, broadcast against x.
+
+    Returns:
+        np.ndarray: Probabilities, clipped to [0, 1].
+    """
+    z = (np.asarray(x, dtype=float) - xi) / omega
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float), z.shape)
+    return np.clip(ndtr(z) - 2 * owens_t(z, alpha), 0, 1)
+
+
+def dmsn(x, xi, omega, alpha, log: bool = False) -> np.ndarray:
+    """
+    Density of the multivariate skew-normal, as `sn::dmsn`.
+
+    Args:
+        x: (..., d) points to evaluate.
+        xi: (d,) location vector.
+        omega: (d, d) scale matrix.
+        alpha: (d,) shape vector.
+        log: Return the log-density.
+
+    Returns:
+        np.ndarray: (...) densities,
+            2 phi_d(x - xi; Omega) Phi(alpha' omega^-1 (x - xi)).
+    """
+    omega = np.asarray(omega, dtype=float)
+    y = np.asarray(x, dtype=float) - np.ravel(xi)
+    d = omega.shape[0]
+
+    chol = np.linalg.cholesky(omega)
+    # Mahalanobis distance through the inverse Cholesky factor: |L^-1 y|^2
+    w = y @ np.linalg.inv(chol).T
+    log_det = 2 * np.sum(np.log(np.diag(chol)))
+    log_norm = np.log(2) - 0.5 * (
+        np.sum(w**2, axis=-1) + log_det + d * np.log(2 * np.pi)
+    )
+    skew = y @ (np.ravel(alpha) / np.sqrt(np.diag(omega)))
+    if log:
+        return log_norm + log_ndtr(skew)
+    return np.exp(log_norm) * ndtr(skew)
+
+
+def pbvn(h, k, rho) -> np.ndarray:
+    """
+    Bivariate standard normal distribution function P(X <= h, Y <= k).
+
+    Uses the Owen's T representation, which is exact up to the accuracy of
+    `scipy.special.owens_t`. Vectorised over broadcast h, k and rho.
+
+    Args:
+        h, k: Upper limits.
+        rho: Correlation.
+
+    Returns:
+        np.ndarray: Probabilities.
+    """
+    h, k, rho = np.broadcast_arrays(
+        np.asarray(h, dtype=float),
+        np.asarray(k, dtype=float),
+        np.asarray(rho, dtype=float),
+    )
+    # The formula needs h, k != 0; the limit is approached from either side
+    tiny = np.finfo(float).tiny
+    hh = np.where(h == 0, tiny, h)
+    kk = np.where(k == 0, tiny, k)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        s = np.sqrt((1 - rho) * (1 + rho))
+        ah = (kk - rho * hh) / (hh * s)
+        ak = (hh - rho * kk) / (kk * s)
+        beta = np.where((hh * kk > 0) | ((hh * kk == 0) & (hh + kk >= 0)), 0.0, 0.5)
+        p = 0.5 * (ndtr(h) + ndtr(k)) - owens_t(hh, ah) - owens_t(kk, ak) - beta
+    # Degenerate correlations
+    p = np.where(rho >= 1, ndtr(np.minimum(h, k)), p)
+    p = np.where(rho <= -1, np.maximum(ndtr(h) + ndtr(k) - 1, 0), p)
+    return np.clip(p, 0, 1)
+
+
+def _tvn_term(ba, bb, bc, ra, rb, r, rr):
+    # d/dr of the trivariate normal CDF along the arcsine path, Genz (2004)
+    dt = rr * (rr - (ra - rb) ** 2 - 2 * ra * rb * (1 - r))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bt = (bc * rr + ba * (r * rb - ra) + bb * (r * ra - rb)) / np.sqrt(dt)
+        ft = (ba - r * bb) ** 2 / rr + bb * bb
+        return np.where(dt > 0, np.exp(-ft / 2) * ndtr(bt), 0.0)
+
+
+def _ptvn(h: np.ndarray, corr: np.ndarray, nodes: int = TVN_NODES) -> np.ndarray:
+    """
+    Trivariate standard normal distribution function for (n, 3) limits.
+
+    Genz (2004), Statistics and Computing 14, 251-260: Plackett's identity
+    splits off Phi(h1) * Phi2(h2, h3; r23) for the strongest correlation r23
+    and integrates the remainder along r12(x) = sin(x asin r12),
+    r13(x) = sin(x asin r13) over x in [0, 1]. The integrand is smooth but for
+    near-singular correlation matrices, so a fixed Gauss-Legendre rule with
+    nodes clustered towards x = 1 is used.
+    """
+    h1, h2, h3 = h[:, 0], h[:, 1], h[:, 2]
+    r12, r13, r23 = corr[0, 1], corr[0, 2], corr[1, 2]
+    if abs(r12) > abs(r13):
+        h2, h3, r12, r13 = h3, h2, r13, r12
+    if abs(r13) > abs(r23):
+        h1, h2, r13, r23 = h2, h1, r23, r13
+
+    u, w = np.polynomial.legendre.leggauss(nodes)
+    v = (u + 1) / 2
+    x = 1 - (1 - v) ** 2
+    w = w * (1 - v)
+
+    a12, a13 = np.arcsin(r12), np.arcsin(r13)
+    s12, s13 = np.sin(a12 * x), np.sin(a13 * x)
+    c12, c13 = np.cos(a12 * x) ** 2, np.cos(a13 * x) ** 2
+    h1, h2, h3 = h1[:, None], h2[:, None], h3[:, None]
+    f = a12 * _tvn_term(h1, h2, h3, s13, r23, s12, c12)
+    f = f + a13 * _tvn_term(h1, h3, h2, s12, r23, s13, c13)
+    return ndtr(h1[:, 0]) * pbvn(h2[:, 0], h3[:, 0], r23) + f @ w / (2 * np.pi)
+
+
+def pmsn(x, xi, omega, alpha) -> np.ndarray:
+    """
+    Distribution function of the bivariate skew-normal, as `sn::pmsn`.
+
+    Evaluated as 2 P(Z <= z, X0 <= 0) for the trivariate normal (Z, -X0) of
+    the additive representation, see `_ptvn`. Agrees with an adaptive
+    reference integration to about 1e-13 for shapes up to |alpha| ~ 100;
+    `sn::pmsn` itself is only accurate to its `abseps` (1e-6 by default).
+
+    Coordinates may be infinite; +inf gives the marginal distribution
+    functions.
+
+    Args:
+        x: (..., 2) points to evaluate.
+        xi: (2,) location vector.
+        omega: (2, 2) scale matrix.
+        alpha: (2,) shape vector.
+
+    Returns:
+        np.ndarray: (...) probabilities.
+
+    Raises:
+        ValueError: If the distribution is not bivariate.
+    """
+    omega = np.asarray(omega, dtype=float)
+    if omega.shape != (2, 2):
+        raise ValueError("pmsn is implemented for bivariate distributions only.")
+    x = np.asarray(x, dtype=float)
+    scale = np.sqrt(np.diag(omega))
+    delta = delta_from_dp(omega, np.ravel(alpha))
+    corr = np.eye(3)
+    corr[0, 1] = corr[1, 0] = omega[0, 1] / (scale[0] * scale[1])
+    corr[:2, 2] = corr[2, :2] = -delta
+
+    z = ((x - np.ravel(xi)) / scale).reshape(-1, 2)
+    out = np.zeros(len(z))
+    inf = np.isposinf(z)
+    outside = np.isneginf(z).any(axis=1)
+    both = inf.all(axis=1)
+    out[both] = 1.0
+    # The marginals are univariate skew-normals with delta_i = delta[i]
+    for i in range(2):
+        rows = inf[:, 1 - i] & ~both & ~outside
+        marginal_alpha = delta[i] / np.sqrt(1 - delta[i] ** 2)
+        out[rows] = psn(z[rows, i], alpha=marginal_alpha)
+
+    joint = np.flatnonzero(~inf.any(axis=1) & ~outside)
+    for start in range(0, len(joint), CDF_CHUNK):
+        rows = joint[start : start + CDF_CHUNK]
+        h = np.column_stack([z[rows], np.zeros(len(rows))])
+        out[rows] = 2 * _ptvn(h, corr)
+    return np.clip(out, 0, 1).reshape(x.shape[:-1])
@@ -8,6 +8,9 @@ from scipy.spatial.distance import cdist, pdist
 # Functions to sample distributions from the above means and stds
 from scipy.stats import genextreme, kstwobign, pearsonr, skewnorm, truncnorm
 
+from scripts import ks_binned, ks_null, ks_workers
+from scripts.lattice import WeightedSample
+
 
 def get_truncated_normal(
     mean: float = 0.0, sd: float = 1.0, low: float = 0.0, upp: float = 10.0
@@ -31,6 +34,63 @@ def truncated_skew_normal(mean, var, skew, a, b, num_samples=100000):
     return np.array(samples)
 
 
+def _draw_coords(
+    means: np.ndarray,
+    stds: np.ndarray,
+    a: np.ndarray,
+    n: int,
+    dist_type: str,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    # (k, n) draws of one coordinate for k archetypes in one stacked call
+    means, stds = means[:, None], stds[:, None]
+    size = (len(means), n)
+    if dist_type == "normal":
+        return rng.normal(means, stds, size)
+    if dist_type == "truncnorm":
+        low, upp = (-1 - means) / stds, (1 - means) / stds
+        return truncnorm.rvs(
+            low, upp, loc=means, scale=stds, size=size, random_state=rng
+        )
+    if a is None:
+        raise ValueError(f"dist_type {dist_type!r} needs the shape parameters")
+    a = a[:, None]
+    if dist_type == "skewnorm":
+        return skewnorm.rvs(a=a, loc=means, scale=stds, size=size, random_state=rng)
+    if dist_type == "trunc_skewnorm":
+        # Rejection sampling to [-1, 1] as in `truncated_skew_normal`, in
+        # stacked rounds over the archetypes that still need draws
+        out = np.empty(size)
+        filled = np.zeros(len(means), dtype=int)
+        while (rows := np.flatnonzero(filled < n)).size:
+            need = n - filled[rows]
+            cand = skewnorm.rvs(
+                a=a[rows],
+                loc=means[rows],
+                scale=stds[rows],
+                size=(len(rows), 2 * need.max() + 16),
+                random_state=rng,
+            )
+            ok = (cand >= -1) & (cand <= 1)
+            rank = np.cumsum(ok, axis=1)
+            i, j = np.nonzero(ok & (rank <= need[:, None]))
+            out[rows[i], filled[rows[i]] + rank[i, j] - 1] = cand[i, j]
+            filled[rows] += np.minimum(rank[:, -1], need)
+        return out
+    raise ValueError(f"Unknown dist_type {dist_type!r}")
+
+
+def _archetype_values(values, index: pd.Index) -> np.ndarray | None:
+    # Per-archetype parameters as a float array in the order of index
+    if values is None:
+        return None
+    if np.isscalar(values):
+        return np.full(len(index), float(values))
+    if isinstance(values, (pd.Series, pd.DataFrame)):
+        values = values.loc[index]
+    return np.asarray(values, dtype=float).reshape(len(index))
+
+
 def dist_generation(
     pl_mean: float,
     ev_mean: float,
@@ -40,61 +100,95 @@ def dist_generation(
     ev_a: float = None,
     n: int = 1000,
     dist_type: str = "normal",
+    rng: np.random.Generator | int = None,
 ):
     # Generate a distribution from ISOPl and ISOEv means and stds
-    if dist_type == "normal":
-        pl = np.random.normal(pl_mean, pl_std, n)
-        ev = np.random.normal(ev_mean, ev_std, n)
-    elif dist_type == "truncnorm":
-        pl = get_truncated_normal(mean=pl_mean, sd=pl_std, low=-1, upp=1).rvs(n)
-        ev = get_truncated_normal(mean=ev_mean, sd=ev_std, low=-1, upp=1).rvs(n)
-    elif dist_type == "skewnorm":
-        pl = skewnorm.rvs(a=pl_a, loc=pl_mean, scale=pl_std, size=n)
-        ev = skewnorm.rvs(a=ev_a, loc=ev_mean, scale=ev_std, size=n)
-    elif dist_type == "trunc_skewnorm":
-        pl = truncated_skew_normal(
-            mean=pl_mean, var=pl_std, skew=pl_a, a=-1, b=1, num_samples=n
-        )
-        ev = truncated_skew_normal(
-            mean=ev_mean, var=ev_std, skew=ev_a, a=-1, b=1, num_samples=n
-        )
-
-    return pl, ev
+    rng = np.random.default_rng(rng)
+    pl = _draw_coords(
+        np.array([pl_mean], dtype=float),
+        np.array([pl_std], dtype=float),
+        None if pl_a is None else np.array([pl_a], dtype=float),
+        n,
+        dist_type,
+        rng,
+    )
+    ev = _draw_coords(
+        np.array([ev_mean], dtype=float),
+        np.array([ev_std], dtype=float),
+        None if ev_a is None else np.array([ev_a], dtype=float),
+        n,
+        dist_type,
+        rng,
+    )
+    return pl[0], ev[0]
 
 
 def df_generation(
-    pl_means: pd.DataFrame,
-    ev_means: pd.DataFrame,
-    pl_stds: pd.DataFrame,
-    ev_stds: pd.DataFrame,
-    pl_as: pd.DataFrame = None,
-    ev_as: pd.DataFrame = None,
+    pl_means: pd.Series,
+    ev_means: pd.Series,
+    pl_stds: pd.Series,
+    ev_stds: pd.Series,
+    pl_as: pd.Series = None,
+    ev_as: pd.Series = None,
     n: int = 1000,
     dist_type: str = "normal",
-):
-    # Create a df of values generated from a distribution
-    for type in pl_means.index:
-        pl, ev = dist_generation(
-            pl_means[type],
-            ev_means[type],
-            pl_stds[type],
-            ev_stds[type],
-            pl_as,
-            ev_as,
+    rng: np.random.Generator | int = None,
+) -> pd.DataFrame:
+    """
+    Simulate n responses for each archetype.
+
+    All archetypes' coordinates are drawn in one stacked call per coordinate
+    and written into a single array, so thousands of synthetic locations are
+    generated at the cost of a few vectorised draws.
+
+    Parameters
+    ----------
+    pl_means, ev_means, pl_stds, ev_stds : pd.Series
+        ISOPleasant and ISOEventful means and standard deviations, indexed by archetype.
+    pl_as, ev_as : pd.Series, optional
+        Shape parameters per archetype (or a scalar for all), needed by the
+        skew normal distribution types.
+    n : int
+        Number of responses per archetype.
+    dist_type : str
+        One of "normal", "truncnorm", "skewnorm" and "trunc_skewnorm"; the
+        truncated types are bounded to [-1, 1].
+    rng : np.random.Generator or int, optional
+        Random generator or seed.
+
+    Returns
+    -------
+    pd.DataFrame
+        ISOPleasant, ISOEventful and a categorical ArchiType column, n rows
+        per archetype in the order of pl_means.
+    """
+    index = pl_means.index
+    rng = np.random.default_rng(rng)
+
+    coords = np.empty((2, len(index), n))
+    for out, means, stds, shapes in (
+        (coords[0], pl_means, pl_stds, pl_as),
+        (coords[1], ev_means, ev_stds, ev_as),
+    ):
+        out[:] = _draw_coords(
+            _archetype_values(means, index),
+            _archetype_values(stds, index),
+            _archetype_values(shapes, index),
             n,
             dist_type,
+            rng,
         )
-        if type == pl_means.index[0]:
-            res_df = pd.DataFrame(
-                {"ISOPleasant": pl, "ISOEventful": ev, "ArchiType": type}
-            )
-        else:
-            temp_df = pd.DataFrame(
-                {"ISOPleasant": pl, "ISOEventful": ev, "ArchiType": type}
-            )
-            res_df = pd.concat((res_df, temp_df), axis=0)
-    res_df.reset_index(drop=True, inplace=True)
-    return res_df
+
+    archetypes = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(index)), n), categories=index
+    )
+    return pd.DataFrame(
+        {
+            "ISOPleasant": coords[0].ravel(),
+            "ISOEventful": coords[1].ravel(),
+            "ArchiType": archetypes,
+        }
+    )
 
 
 # Functions for a 2D Kolmogorov-Smirnov test
@@ -102,7 +196,7 @@ def df_generation(
 # from https://github.com/syrte/ndtest
 
 
-__all__ = ["ks2d2s", "estat", "estat2d"]
+__all__ = ["ks2d2s", "binned_avgmaxdist", "estat", "estat2d"]
 
 
 def ks2d2s(
@@ -114,6 +208,12 @@ def ks2d2s(
     y2: np.array = None,
     nboot=None,
     extra=False,
+    method="exact",
+    bins=ks_binned.DEFAULT_BINS,
+    approx_threshold=ks_binned.APPROX_THRESHOLD,
+    dtype=None,
+    null_table=None,
+    workers=None,
 ):
     """Two-dimensional Kolmogorov-Smirnov test on two samples.
 
@@ -124,18 +224,41 @@ def ks2d2s(
 
     Parameters
     ----------
-    test_data, target_data: pd.DataFrame
+    test_data, target_data: pd.DataFrame, ndarray or lattice.WeightedSample
         DataFrames containing the test and target distributions.
-        Can be used instead of x1, y1, x2, y2.
+        Can be used instead of x1, y1, x2, y2. A WeightedSample of unique points
+        and multiplicities gives the same D, counting quadrants once per
+        unique point.
     x1, y1 : ndarray, shape (n1, )
         Data of sample 1.
     x2, y2 : ndarray, shape (n2, )
         Data of sample 2. Size of two samples can be different.
     nboot : None or int
         Number of bootstrap resample to estimate the p-value. A large number is expected.
-        If None, an approximate analytic estimate will be used.
+        If None, the p-value is taken from `null_table` or, without one, from an
+        approximate analytic estimate.
     extra: bool, optional
         If True, KS statistic is also returned. Default is False.
+    method : {"auto", "exact", "binned"}
+        "exact" (default) compares every point, "binned" uses the histogram
+        approximation from `binned_avgmaxdist`, and "auto" switches to the binned
+        approximation when n1 + n2 exceeds `approx_threshold`.
+    bins : int
+        Number of bins along each axis for the binned approximation.
+    approx_threshold : int
+        Combined sample size above which `method="auto"` uses binning.
+    dtype : None or np.dtype
+        Floating point type to hold the coordinates in, e.g. np.float32 to halve
+        the memory traffic of the quadrant counts. None keeps the input type.
+    null_table : "auto", None, str or ks_null.NullTable
+        Simulated null distribution of D (see `ks_null`), accurate also for small
+        samples and large p-values. None (default) uses the analytic estimate,
+        "auto" uses the installed "msn_utils" table when one has been built (and
+        the analytic estimate otherwise), and a path or NullTable uses that table.
+    workers : None or int
+        Threads to split the quadrant origins of the exact method over (-1 for
+        all cores), see `ks_workers`. D does not depend on it. None counts on
+        the calling thread.
 
     Returns
     -------
@@ -169,7 +292,19 @@ def ks2d2s(
     ):
         raise ValueError("Use either test_data and target_data or x1, y1, x2, y2")
 
-    if test_data is not None and target_data is not None:
+    w1 = w2 = None
+    if isinstance(test_data, WeightedSample) or isinstance(target_data, WeightedSample):
+        test, target = (
+            (
+                v
+                if isinstance(v, WeightedSample)
+                else WeightedSample.from_points(np.asarray(v))
+            )
+            for v in (test_data, target_data)
+        )
+        (x1, y1), w1 = test.points.T, test.weights
+        (x2, y2), w2 = target.points.T, target.weights
+    elif test_data is not None and target_data is not None:
         assert test_data.shape[1] == 2 and target_data.shape[1] == 2
         if isinstance(test_data, pd.DataFrame):
             x1 = test_data.iloc[:, 0].values
@@ -184,10 +319,30 @@ def ks2d2s(
             x2, y2 = target_data[:, 0], target_data[:, 1]
 
     assert (len(x1) == len(y1)) and (len(x2) == len(y2))
-    n1, n2 = len(x1), len(x2)
-    D = avgmaxdist(x1, y1, x2, y2)
+    x1, y1, x2, y2 = (np.asarray(v, dtype=dtype) for v in (x1, y1, x2, y2))
+    n1 = len(x1) if w1 is None else int(w1.sum())
+    n2 = len(x2) if w2 is None else int(w2.sum())
+    if ks_binned.use_binned(method, n1, n2, approx_threshold):
+
+        def dist(x1, y1, x2, y2, w1=None, w2=None):
+            return binned_avgmaxdist(x1, y1, x2, y2, bins=bins, w1=w1, w2=w2)
 
-    if nboot is None:
+    else:
+
+        def dist(x1, y1, x2, y2, w1=None, w2=None):
+            return avgmaxdist(x1, y1, x2, y2, w1, w2, workers=workers)
+
+    D = dist(x1, y1, x2, y2, w1, w2)
+    # Correlations and resampling work on the observations
+    x1, y1 = _expand(x1, y1, w1)
+    x2, y2 = _expand(x2, y2, w2)
+
+    table = ks_null.resolve_table(null_table, "msn_utils") if nboot is None else None
+    if table is not None:
+        r1 = pearsonr(x1, y1)[0]
+        r2 = pearsonr(x2, y2)[0]
+        p = table.pvalue(D, n1, n2, ks_null.pooled_r(r1, r2))
+    elif nboot is None:
         sqen = np.sqrt(n1 * n2 / (n1 + n2))
         r1 = pearsonr(x1, y1)[0]
         r2 = pearsonr(x2, y2)[0]
@@ -204,7 +359,7 @@ def ks2d2s(
             ix1, ix2 = idx[:n1], idx[n1:]
             # ix1 = random.choice(n, n1, replace=True)
             # ix2 = random.choice(n, n2, replace=True)
-            d[i] = avgmaxdist(x[ix1], y[ix1], x[ix2], y[ix2])
+            d[i] = dist(x[ix1], y[ix1], x[ix2], y[ix2])
         p = np.sum(d > D).astype("f") / nboot
     if extra:
         return p, D
@@ -212,24 +367,79 @@ def ks2d2s(
         return p
 
 
-def avgmaxdist(x1, y1, x2, y2):
-    D1 = maxdist(x1, y1, x2, y2)
-    D2 = maxdist(x2, y2, x1, y1)
+def avgmaxdist(x1, y1, x2, y2, w1=None, w2=None, workers=None):
+    D1 = maxdist(x1, y1, x2, y2, w1, w2, workers)
+    D2 = maxdist(x2, y2, x1, y1, w2, w1, workers)
     return (D1 + D2) / 2
 
 
-def maxdist(x1, y1, x2, y2):
-    n1 = len(x1)
-    D1 = np.empty((n1, 4))
-    for i in range(n1):
-        a1, b1, c1, d1 = quadct(x1[i], y1[i], x1, y1)
-        a2, b2, c2, d2 = quadct(x1[i], y1[i], x2, y2)
-        D1[i] = [a1 - a2, b1 - b2, c1 - c2, d1 - d2]
+def maxdist(x1, y1, x2, y2, w1=None, w2=None, workers=None):
+    # w1, w2 are optional multiplicities of deduplicated points (see `lattice`);
+    # repeated origins give repeated rows of D1, so D is unchanged.
+    n1 = len(x1) if w1 is None else int(w1.sum())
+    n2 = len(x2) if w2 is None else int(w2.sum())
 
-    # re-assign the point to maximize difference,
-    # the discrepancy is significant for N < ~50
-    D1[:, 0] -= 1 / n1
+    def extrema(s):
+        # Quadrant counts stay integer until they are turned into fractions
+        a1, b1, c1, d1 = _fractions(quadcounts(x1[s], y1[s], x1, y1, w1), n1)
+        a2, b2, c2, d2 = _fractions(quadcounts(x1[s], y1[s], x2, y2, w2), n2)
+        D1 = np.column_stack([a1 - a2, b1 - b2, c1 - c2, d1 - d2])
 
+        # re-assign the point to maximize difference,
+        # the discrepancy is significant for N < ~50
+        D1[:, 0] -= 1 / n1
+        return D1.min(), D1.max()
+
+    # Origins are split over threads by `workers`; extrema combine exactly
+    chunks = ks_workers.map_chunks(extrema, len(x1), workers)
+    dmin = -min(lo for lo, _ in chunks)
+    dmax = max(hi for _, hi in chunks) + 1 / n1
+    return max(dmin, dmax)
+
+
+def binned_avgmaxdist(
+    x1,
+    y1,
+    x2,
+    y2,
+    bins=ks_binned.DEFAULT_BINS,
+    return_bound=False,
+    w1=None,
+    w2=None,
+):
+    """Approximate `avgmaxdist` by binning both samples on a shared grid.
+
+    Quadrant fractions are read from 2D prefix sums at the corner of every
+    occupied cell, so the cost is O(bins**2) regardless of the sample sizes.
+    See `scripts.ks_binned` for the error bound, which shrinks linearly with
+    the bin width.
+
+    Parameters
+    ----------
+    x1, y1, x2, y2 : ndarray
+        Data of the two samples.
+    bins : int
+        Number of bins along each axis.
+    return_bound : bool
+        If True, also return the upper bound on |D_binned - D_exact|.
+    w1, w2 : None or ndarray
+        Multiplicities of the points of each sample, if deduplicated.
+    """
+    D1, D2, bound = ks_binned.binned_differences(
+        x1, y1, x2, y2, bins=bins, w1=w1, w2=w2
+    )
+    n1 = len(x1) if w1 is None else int(w1.sum())
+    n2 = len(x2) if w2 is None else int(w2.sum())
+    D = (_reassigned_max(D1, n1) + _reassigned_max(-D2, n2)) / 2
+    if return_bound:
+        return D, bound
+    return D
+
+
+def _reassigned_max(D1, n1):
+    # Same point re-assignment as `maxdist`
+    D1 = D1.copy()
+    D1[:, 0] -= 1 / n1
     dmin, dmax = -D1.min(), D1.max() + 1 / n1
     return max(dmin, dmax)
 
@@ -244,6 +454,64 @@ def quadct(x, y, xx, yy):
     return a, b, c, d
 
 
+# Upper limit on the number of point comparisons held in memory by `quadcounts`
+QUADCOUNT_CHUNK = 2**20
+
+
+def quadcounts(x, y, xx, yy, weights=None):
+    """Vectorised `quadct` returning integer counts instead of fractions.
+
+    Parameters
+    ----------
+    x, y : ndarray, shape (m, )
+        Quadrant origins.
+    xx, yy : ndarray, shape (n, )
+        Points to count.
+    weights : None or ndarray, shape (n, )
+        Integer multiplicities of the points, counted instead of 1 per point.
+
+    Returns
+    -------
+    counts : ndarray, shape (m, 3)
+        int32 counts of points with (xx <= x, yy <= y), (xx <= x, yy > y) and
+        (xx > x, yy <= y). The fourth quadrant is n minus their sum.
+    """
+    counts = np.empty((len(x), 3), dtype=np.int32)
+    if weights is not None:
+        # Integer sums are exact in float64
+        weights = np.asarray(weights, dtype=np.float64)
+    chunk = max(1, QUADCOUNT_CHUNK // max(len(xx), 1))
+    for start in range(0, len(x), chunk):
+        stop = start + chunk
+        ix1 = xx[None, :] <= x[start:stop, None]
+        ix2 = yy[None, :] <= y[start:stop, None]
+        if weights is None:
+            a = np.count_nonzero(ix1 & ix2, axis=1)
+            b = np.count_nonzero(ix1, axis=1) - a
+            c = np.count_nonzero(ix2, axis=1) - a
+        else:
+            a = np.rint((ix1 & ix2) @ weights)
+            b = np.rint(ix1 @ weights) - a
+            c = np.rint(ix2 @ weights) - a
+        counts[start:stop, 0] = a
+        counts[start:stop, 1] = b
+        counts[start:stop, 2] = c
+    return counts
+
+
+def _expand(x, y, weights):
+    # Repeat deduplicated points by their multiplicities
+    if weights is None:
+        return x, y
+    return np.repeat(x, weights), np.repeat(y, weights)
+
+
+def _fractions(counts, n):
+    # Same operations as `quadct`, so results are bit-identical to it
+    a, b, c = counts[:, 0] / n, counts[:, 1] / n, counts[:, 2] / n
+    return a, b, c, 1 - a - b - c
+
+
 def estat2d(x1, y1, x2, y2, **kwds):
     return estat(np.c_[x1, y1], np.c_[x2, y2], **kwds)
 
@@ -0,0 +1,257 @@
+"""
+Lightweight NSGA-II history recording and background video rendering.
+
+`minimize(..., save_history=True)` deep-copies the whole algorithm every
+generation, which for 100 generations of 150 individuals takes gigabytes,
+although the plots only need each generation's decision variables X and
+objectives F. `HistoryCallback` stores just those, in arrays preallocated for
+the maximum number of generations, optionally memory-mapped to .npy files so
+another process (or a later session) can read them while the run continues.
+
+Frames are rendered by `VideoRenderer`, a background process that receives
+(generation, X, F) over a queue, draws each frame and streams it to a
+pyrecorder video, so the optimisation does not wait on matplotlib:
+
+    with VideoRenderer("figures/park_nsga2.mp4") as video:
+        history = HistoryCallback(n_gen=100, path="results/park", renderer=video)
+        res = minimize(problem, algorithm, termination, callback=history)
+
+A recorded history can be rendered again afterwards, e.g. with the final
+front's ideal and nadir points:
+
+    history = HistoryCallback.load("results/park")
+    with VideoRenderer("figures/park_nsga2.mp4", draw=draw) as video:
+        history.render(video)
+"""
+
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+from pathos.helpers import mp
+from pymoo.core.callback import Callback
+
+
+def draw_front(X: np.ndarray, F: np.ndarray, gen: int):
+    """
+    Default frame: the generation's objectives, with the best balanced
+    (ASF, equal weights) solution in red.
+    """
+    import matplotlib.pyplot as plt
+    from pymoo.decomposition.asf import ASF
+
+    ideal, nadir = F.min(axis=0), F.max(axis=0)
+    scale = np.where(nadir > ideal, nadir - ideal, 1)
+    best = ASF()((F - ideal) / scale, np.array([0.5, 0.5])).argmin()
+
+    fig, ax = plt.subplots(figsize=(6, 5))
+    ax.scatter(F[:, 0], F[:, 1], s=20, facecolors="none", edgecolors="blue")
+    ax.scatter(F[best, 0], F[best, 1], s=30, color="red")
+    ax.set_title(f"Generation: {gen}")
+    return fig
+
+
+def _render_loop(queue, fname: str, draw: Callable, fps: int, dpi: int):
+    # Runs in the renderer process: draw and write frames until the sentinel
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from pyrecorder.converters.matplotlib import Matplotlib
+    from pyrecorder.recorder import Recorder
+    from pyrecorder.writers.video import Video
+
+    with Recorder(Video(fname, fps=fps), converter=Matplotlib(dpi=dpi)) as rec:
+        while (item := queue.get()) is not None:
+            gen, X, F = item
+            draw(X, F, gen)
+            rec.record()
+
+
+class VideoRenderer:
+    """
+    Background process streaming frames of an optimisation to a video.
+
+    Attributes:
+        fname (str): Path of the video.
+        draw (Callable): Function of (X, F, generation) drawing one frame on
+            the current matplotlib figure. Runs in the renderer process, so it
+            may be slow without slowing the optimisation.
+        fps (int): Frames per second of the video.
+        dpi (int): Resolution of the frames.
+    """
+
+    def __init__(
+        self, fname: str, draw: Callable = draw_front, fps: int = 1, dpi: int = 100
+    ):
+        self.fname = str(fname)
+        self.draw = draw
+        self.fps = fps
+        self.dpi = dpi
+        self._queue = None
+        self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __deepcopy__(self, memo):
+        # pymoo copies the algorithm and its callback; all copies render here
+        return self
+
+    def start(self):
+        Path(self.fname).parent.mkdir(parents=True, exist_ok=True)
+        self._queue = mp.Queue()
+        self._process = mp.Process(
+            target=_render_loop,
+            args=(self._queue, self.fname, self.draw, self.fps, self.dpi),
+            daemon=True,
+        )
+        self._process.start()
+
+    def submit(self, gen: int, X: np.ndarray, F: np.ndarray):
+        """
+        Queue a frame without waiting for it to be drawn.
+        """
+        if self._process is None:
+            raise RuntimeError("The renderer has not been started")
+        self._queue.put((gen, np.array(X), np.array(F)))
+
+    def close(self):
+        """
+        Wait for the queued frames to be written and close the video.
+        """
+        if self._process is None:
+            return
+        self._queue.put(None)
+        self._process.join()
+        if self._process.exitcode != 0:
+            raise RuntimeError(
+                f"Rendering {self.fname} failed (exit code {self._process.exitcode})"
+            )
+        self._process = None
+
+
+class HistoryCallback(Callback):
+    """
+    pymoo callback storing only each generation's population X and F.
+
+    The arrays are allocated on the first generation with room for `n_gen`
+    generations, and memory-mapped to path/X.npy and path/F.npy if a path is
+    given. Generations with fewer individuals than the first are padded with
+    NaN; `sizes` holds the number of individuals of each generation.
+
+    Attributes:
+        n_gen (int): Maximum number of generations, e.g. the n_max_gen of the
+            termination.
+        path (Path): Directory of the memory-mapped arrays, or None to keep
+            them in memory.
+        renderer (VideoRenderer): Renderer sent every generation, or None.
+        n_recorded (int): Number of generations recorded so far.
+    """
+
+    def __init__(
+        self, n_gen: int, path: str | Path = None, renderer: VideoRenderer = None
+    ):
+        super().__init__()
+        self.n_gen = n_gen
+        self.path = None if path is None else Path(path)
+        self.renderer = renderer
+        self.n_recorded = 0
+        self._X = self._F = self._sizes = None
+
+    def __deepcopy__(self, memo):
+        # minimize() copies the algorithm (and save_history copies it every
+        # generation); the recorded history is shared, never copied
+        return self
+
+    def _allocate(self, pop_size: int, n_var: int, n_obj: int):
+        shapes = {
+            "X": (self.n_gen, pop_size, n_var),
+            "F": (self.n_gen, pop_size, n_obj),
+        }
+        if self.path is None:
+            arrays = {k: np.full(shape, np.nan) for k, shape in shapes.items()}
+        else:
+            self.path.mkdir(parents=True, exist_ok=True)
+            arrays = {}
+            for k, shape in shapes.items():
+                arrays[k] = np.lib.format.open_memmap(
+                    self.path / f"{k}.npy", mode="w+", dtype=np.float64, shape=shape
+                )
+                arrays[k][:] = np.nan
+        self._X, self._F = arrays["X"], arrays["F"]
+        self._sizes = np.zeros(self.n_gen, dtype=np.int64)
+
+    def notify(self, algorithm):
+        X, F = algorithm.pop.get("X"), algorithm.pop.get("F")
+        if self._X is None:
+            self._allocate(len(X), X.shape[1], F.shape[1])
+        gen = self.n_recorded
+        if gen >= self.n_gen:
+            raise ValueError(
+                f"HistoryCallback was allocated for {self.n_gen} generations"
+            )
+        if len(X) > self._X.shape[1]:
+            raise ValueError(
+                f"Generation {gen + 1} has {len(X)} individuals, "
+                f"more than the {self._X.shape[1]} of the first"
+            )
+        self._X[gen, : len(X)] = X
+        self._F[gen, : len(F)] = F
+        self._sizes[gen] = len(X)
+        self.n_recorded += 1
+        if self.path is not None:
+            np.save(self.path / "sizes.npy", self._sizes[: self.n_recorded])
+        if self.renderer is not None:
+            self.renderer.submit(algorithm.n_gen, X, F)
+
+    @property
+    def X(self) -> np.ndarray:
+        """
+        (generations, pop_size, n_var) decision variables recorded so far.
+        """
+        return None if self._X is None else self._X[: self.n_recorded]
+
+    @property
+    def F(self) -> np.ndarray:
+        """
+        (generations, pop_size, n_obj) objectives recorded so far.
+        """
+        return None if self._F is None else self._F[: self.n_recorded]
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return None if self._sizes is None else self._sizes[: self.n_recorded]
+
+    def generation(self, gen: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        X and F of one recorded generation (0-based), without padding.
+        """
+        size = self.sizes[gen]
+        return self.X[gen, :size], self.F[gen, :size]
+
+    def render(self, renderer: VideoRenderer):
+        """
+        Send every recorded generation to a renderer.
+        """
+        for gen in range(self.n_recorded):
+            renderer.submit(gen + 1, *self.generation(gen))
+
+    @classmethod
+    def load(cls, path: str | Path) -> "HistoryCallback":
+        """
+        Open a memory-mapped history read-only, e.g. from another process.
+
+        Only generations completed when `load` is called are visible.
+        """
+        path = Path(path)
+        history = cls(0, path)
+        history._X = np.load(path / "X.npy", mmap_mode="r")
+        history._F = np.load(path / "F.npy", mmap_mode="r")
+        history._sizes = np.load(path / "sizes.npy")
+        history.n_gen = len(history._X)
+        history.n_recorded = len(history._sizes)
+        return history
@@ -1,13 +1,24 @@
 import argparse
+import json
+import os
 from itertools import product
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
+from pymoo.core.problem import ElementwiseProblem
 from scipy.stats import spearmanr
 from sklearn.model_selection import ParameterGrid
 from tqdm_pathos import tqdm_pathos
 
-from scripts.MultiSkewNorm import MultiSkewNorm
+from scripts import isd_cache, smooth_spi
+from scripts.MultiSkewNorm import DirectParamsBatch, MultiSkewNorm
+from scripts.spi_matrix import matrix_success, spi_matrix
+
+SHARD_VERSION = 1
+# Smallest target sample of a successive-halving round. KS against fewer
+# points is too noisy to prune candidates on.
+MIN_HALVING_SAMPLE_N = 32
 
 
 def target_success(
@@ -24,7 +35,7 @@ def target_success(
     target : MultiSkewNorm
         Target function to evaluate
     ranking : pd.Series
-        Ranking of groups
+        Ranking of groups, indexed by group, in any order
     data : pd.DataFrame
         Data to evaluate the target function on
     group : str
@@ -53,46 +64,131 @@ def target_success(
         test_spi = target.spi(test_data[["ISOPleasant", "ISOEventful"]])
         spis[group] = test_spi
 
+    # Tied SPIs are ranked in location order, as in `spi_matrix.matrix_success`
     spi_ranks = pd.DataFrame.from_dict(spis, orient="index", columns=["SPI"])
-    spi_ranks.sort_values(by="SPI", ascending=False, inplace=True)
+    spi_ranks = spi_ranks.sort_index().sort_values(
+        by="SPI", ascending=False, kind="stable"
+    )
     spi_ranks["Rank"] = range(1, len(spi_ranks) + 1)
     ranks = spi_ranks.sort_index()["Rank"]
 
-    spearman = spearmanr(ranking, ranks)
+    # Pair the ranking with the SPI ranks by location, whatever its order
+    spearman = spearmanr(ranking.reindex(ranks.index), ranks)
     weighted_spi = sum([(1 / rank) * spi for rank, spi in zip(ranks, spi_ranks["SPI"])])
 
     return spearman, weighted_spi, spi_ranks, target
 
 
 def run_grid(
-    targets: list[MultiSkewNorm],
-    ranking: pd.DataFrame,
+    targets: ParameterGrid | list[MultiSkewNorm],
+    ranking: pd.Series,
     data: pd.DataFrame,
-    groups: str = "LocationID",
+    *,
+    sample_n: int = 100,
+    seed: int = 0,
     parallel: bool = True,
-) -> tuple:
+    qmc: bool = False,
+) -> pd.DataFrame:
     """
-    Runs a grid search optimization for a list of targets.
+    Runs a grid search optimization and returns a compact table of the results.
+
+    Given a parameter grid, every valid candidate is sampled with the seed
+    sequence (seed, grid index) and scored in chunks (see `evaluate_indices`),
+    so neither samples nor target objects are held or sent back from the pool.
+    A candidate's full target is rebuilt on demand with `row_target`.
+
+    The signature changed with the table output: the unused `groups` argument
+    was removed (locations are always grouped by LocationID), and the
+    arguments after `data` are keyword-only, so an old positional call fails
+    instead of passing the group column as `sample_n`.
 
     Args:
-        targets (list[MultiSkewNorm]): A list of target objects to optimize.
-        ranking (pd.DataFrame): A DataFrame containing the ranking information.
-        data (pd.DataFrame): A DataFrame containing the data for optimization.
-        groups (str, optional): The column name to group the data by. Defaults to "LocationID".
+        targets (ParameterGrid | list[MultiSkewNorm]): The parameter grid (see
+            `construct_param_grid`), or already sampled targets. Targets are
+            indexed by position and cannot be rebuilt from the table.
+        ranking (pd.Series): Ranking of the locations, indexed by location. A
+            one-column DataFrame is taken as that column.
+        data (pd.DataFrame): Projected data of the ranked locations.
+        sample_n (int, optional): Number of samples per target of a grid. Defaults to 100.
+        seed (int, optional): Base seed of the target samples of a grid. Defaults to 0.
+        parallel (bool, optional): Whether to use parallel processing. Defaults to True.
+        qmc (bool, optional): Sample the targets of a grid with scrambled Sobol points.
 
     Returns:
-        tuple: A tuple containing the optimization results for r_res, wspi_res, and targets.
+        pd.DataFrame: One row per candidate, see `results_table`: the direct
+            parameters, Spearman r and its p-value, WSPI and the SPI of every location.
+
+    Raises:
+        ValueError: If ranking is a DataFrame with more than one column.
     """
-    if parallel:
-        results = tqdm_pathos.map(target_success, targets, ranking, data)
-    else:
-        results = [target_success(target, ranking, data) for target in targets]
+    if isinstance(ranking, pd.DataFrame):
+        if ranking.shape[1] != 1:
+            raise ValueError(
+                f"ranking must be a Series or a one-column DataFrame, "
+                f"got columns {list(ranking.columns)}"
+            )
+        ranking = ranking.iloc[:, 0]
+    if isinstance(targets, ParameterGrid):
+        valid = DirectParamsBatch.from_params(targets).valid
+        result = evaluate_indices(
+            targets,
+            np.flatnonzero(valid),
+            ranking,
+            data,
+            sample_n=sample_n,
+            seed=seed,
+            parallel=parallel,
+            qmc=qmc,
+        )
+        return results_table(result)
+
+    locations = list(ranking.sort_index().index)
+    spi, _ = spi_matrix(targets, data, locations=locations, parallel=parallel)
+    success = matrix_success(spi, ranking)
+    return results_table(
+        {
+            "index": np.arange(len(targets)),
+            "xi": np.array([t.dp.xi for t in targets]),
+            "omega": np.array([t.dp.omega for t in targets]),
+            "alpha": np.array([t.dp.alpha for t in targets]),
+            "r": success["r"].to_numpy(),
+            "p": success["p"].to_numpy(),
+            "wspi": success["wspi"].to_numpy(),
+            "spi": spi.to_numpy(dtype=np.int8),
+            "locations": np.array(locations, dtype=str),
+        }
+    )
+
 
-    r_res = [res[0][0] for res in results]
-    wspi_res = [res[1] for res in results]
-    targets = [res[3] for res in results]
+def row_target(
+    row: pd.Series, sample_n: int = 100, seed: int = 0, qmc: bool = False
+) -> MultiSkewNorm:
+    """
+    Rebuild the target of a results table row (see `results_table`).
+
+    The target is sampled with the seed sequence (seed, grid index), the row's
+    name, so it reproduces the sample it was scored with by `run_grid` or a
+    shard run with the same sample_n, seed and qmc.
 
-    return r_res, wspi_res, targets
+    Args:
+        row (pd.Series): A row of a results table, named by its grid index.
+        sample_n (int): Number of samples of the target.
+        seed (int): Base seed of the search.
+        qmc (bool): Whether the search sampled with scrambled Sobol points.
+
+    Returns:
+        MultiSkewNorm: The sampled target.
+    """
+    tgt = MultiSkewNorm()
+    tgt.define_dp(
+        np.array([row["xi_x"], row["xi_y"]]),
+        np.array(
+            [[row["omega_xx"], row["omega_xy"]], [row["omega_xy"], row["omega_yy"]]]
+        ),
+        np.array([row["alpha_x"], row["alpha_y"]]),
+    )
+    tgt.sample(n=sample_n, rng=np.random.default_rng((seed, int(row.name))), qmc=qmc)
+    return tgt
 
 
 def construct_omega_grid(
@@ -130,7 +226,7 @@ def construct_omega_grid(
     return omega_grid
 
 
-def construct_target(params, n=100):
+def construct_target(params, n=100, seed=None, qmc=False):
     """
     Construct a target using the given parameters.
 
@@ -142,6 +238,9 @@ def construct_target(params, n=100):
             - "alpha_x" (float): The x-coordinate of the shape parameter.
             - "alpha_y" (float): The y-coordinate of the shape parameter.
         n (int, optional): The number of samples to generate. Defaults to 100.
+        seed (optional): Seed (or sequence of seeds) for the target's sample.
+        qmc (bool, optional): Draw a scrambled Sobol sample, whose SPIs vary less
+            between seeds than those of a pseudo-random sample of the same size.
 
     Returns:
         MultiSkewNorm: The constructed target.
@@ -162,10 +261,42 @@ def construct_target(params, n=100):
     except AssertionError:
         return None
 
-    tgt.sample(n=n)
+    tgt.sample(n=n, rng=None if seed is None else np.random.default_rng(seed), qmc=qmc)
     return tgt
 
 
+def _target_sample(params, n=100, seed=None, qmc=False) -> np.ndarray:
+    # Sample of construct_target as an array, which pickles as its values,
+    # whereas a sampled target is shipped back by seed and redrawn
+    return construct_target(params, n, seed, qmc).sample_data
+
+
+def construct_param_grid(
+    omega_grid: list[np.ndarray],
+    xi_range: tuple = (0, 1),
+    xi_n: int = 10,
+    alpha_range: tuple = (0, 1),
+    alpha_n: int = 10,
+) -> ParameterGrid:
+    """
+    The grid of MSN parameter combinations searched by `construct_target_grid`.
+
+    ParameterGrid indexes its combinations deterministically, so the same
+    arguments give the same index space on every machine.
+
+    Returns:
+        ParameterGrid: Combinations of xi_x, xi_y, omega, alpha_x and alpha_y.
+    """
+    param_grid = {
+        "xi_x": np.linspace(xi_range[0], xi_range[1], xi_n),
+        "xi_y": np.linspace(xi_range[0], xi_range[1], xi_n),
+        "omega": omega_grid,
+        "alpha_x": np.linspace(alpha_range[0], alpha_range[1], alpha_n),
+        "alpha_y": np.linspace(alpha_range[0], alpha_range[1], alpha_n),
+    }
+    return ParameterGrid(param_grid)
+
+
 def construct_target_grid(
     omega_grid: list[np.ndarray],
     xi_range: tuple = (0, 1),
@@ -189,15 +320,12 @@ def construct_target_grid(
 
     Returns:
     - targets (list[MultiSkewNorm]): A list of MSN targets generated based on the given parameters.
+      Parameter combinations without a valid omega are dropped before sampling.
     """
-    param_grid = {
-        "xi_x": np.linspace(xi_range[0], xi_range[1], xi_n),
-        "xi_y": np.linspace(xi_range[0], xi_range[1], xi_n),
-        "omega": omega_grid,
-        "alpha_x": np.linspace(alpha_range[0], alpha_range[1], alpha_n),
-        "alpha_y": np.linspace(alpha_range[0], alpha_range[1], alpha_n),
-    }
-    grid = ParameterGrid(param_grid)
+    grid = construct_param_grid(omega_grid, xi_range, xi_n, alpha_range, alpha_n)
+    # Drop invalid combinations up front instead of raising per candidate
+    valid = DirectParamsBatch.from_params(grid).valid
+    grid = [grid[i] for i in np.flatnonzero(valid)]
 
     if parallel:
         targets = tqdm_pathos.map(construct_target, grid, n=sample_n)
@@ -207,75 +335,837 @@ def construct_target_grid(
     return targets
 
 
+# Box of the unconstrained NSGA-II search over (xi_x, xi_y, log sigma_x,
+# log sigma_y, atanh rho, alpha_x, alpha_y). Every point decodes to a valid
+# target; the box matches the raw bounds of the original problem (variances up
+# to 0.5, alpha within +/-50) with |rho| <= tanh(3) ~ 0.995.
+UNCONSTRAINED_XL = np.array([-1, -1, np.log(0.02), np.log(0.02), -3, -50, -50])
+UNCONSTRAINED_XU = np.array(
+    [1, 1, np.log(np.sqrt(0.5)), np.log(np.sqrt(0.5)), 3, 50, 50]
+)
+
+
+def encode_dp(xi: np.ndarray, omega: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """
+    Map direct parameters to the unconstrained search space.
+
+    Vectorised over any leading axes.
+
+    Args:
+        xi: (..., 2) locations.
+        omega: (..., 2, 2) positive definite scale matrices.
+        alpha: (..., 2) shapes.
+
+    Returns:
+        np.ndarray: (..., 7) variables (xi_x, xi_y, log sigma_x, log sigma_y,
+            atanh rho, alpha_x, alpha_y), with sigma the marginal scales and
+            rho the correlation of omega.
+    """
+    omega = np.asarray(omega, dtype=float)
+    scale = np.sqrt(np.diagonal(omega, axis1=-2, axis2=-1))
+    rho = omega[..., 0, 1] / (scale[..., 0] * scale[..., 1])
+    return np.concatenate(
+        [
+            np.asarray(xi, dtype=float),
+            np.log(scale),
+            np.arctanh(rho)[..., None],
+            np.asarray(alpha, dtype=float),
+        ],
+        axis=-1,
+    )
+
+
+def decode_dp(x: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Map unconstrained variables to direct parameters, the inverse of `encode_dp`.
+
+    Any finite x gives a positive definite omega, since the scales are
+    exponentials and |tanh| < 1. Vectorised over any leading axes.
+
+    Returns:
+        tuple: (xi, omega, alpha) with shapes (..., 2), (..., 2, 2) and (..., 2).
+    """
+    x = np.asarray(x, dtype=float)
+    scale = np.exp(x[..., 2:4])
+    cov = np.tanh(x[..., 4]) * scale[..., 0] * scale[..., 1]
+    omega = np.stack(
+        [
+            np.stack([scale[..., 0] ** 2, cov], axis=-1),
+            np.stack([cov, scale[..., 1] ** 2], axis=-1),
+        ],
+        axis=-2,
+    )
+    return x[..., 0:2].copy(), omega, x[..., 5:7].copy()
+
+
+def decode_target(x: np.ndarray) -> MultiSkewNorm:
+    """
+    The (unsampled) target of a point of the unconstrained search space.
+    """
+    tgt = MultiSkewNorm()
+    tgt.define_dp(*decode_dp(x))
+    return tgt
+
+
+class TargetProblem(ElementwiseProblem):
+    """
+    NSGA-II target optimisation over an unconstrained parameterisation.
+
+    Searches (xi, log marginal scales, atanh correlation, alpha) within a box,
+    see `encode_dp`. Every candidate decodes to a valid target, so the problem
+    has no constraints and no evaluation is spent on non-positive-definite
+    scale matrices. The objectives are -r and -WSPI / 100 of `target_success`.
+
+    Example:
+        problem = TargetProblem(data, ranking, elementwise_runner=runner)
+        res = pymoo.optimize.minimize(problem, NSGA2(pop_size=150), ...)
+        target = decode_target(res.X[i])
+
+    Attributes:
+        data (pd.DataFrame): Projected data of the ranked locations.
+        ranking (pd.Series): Ranking of the locations, indexed by location.
+        sample_n (int): Target sample size per evaluation.
+        qmc (bool): Sample the targets with scrambled Sobol points.
+    """
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        ranking: pd.Series,
+        sample_n: int = 1000,
+        qmc: bool = False,
+        xl: np.ndarray = UNCONSTRAINED_XL,
+        xu: np.ndarray = UNCONSTRAINED_XU,
+        **kwargs,
+    ):
+        super().__init__(n_var=7, n_obj=2, xl=xl, xu=xu, **kwargs)
+        self.data = data
+        self.ranking = ranking
+        self.sample_n = sample_n
+        self.qmc = qmc
+
+    def _evaluate(self, x, out, *args, **kwargs):
+        tgt = decode_target(x)
+        tgt.sample(n=self.sample_n, qmc=self.qmc)
+        r, wspi, _, _ = target_success(tgt, self.ranking, self.data)
+        out["F"] = np.array([-r[0], -wspi / 100])
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """
+    Parse a shard specification "i/N" into (i, N), with 0 <= i < N.
+    """
+    try:
+        i, n = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must be given as i/N, got {shard!r}")
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"Shard index must be in [0, {n}), got {i}")
+    return i, n
+
+
+def shard_indices(grid_size: int, shard: int, n_shards: int) -> np.ndarray:
+    """
+    Grid indices evaluated by one shard.
+
+    Shards take every `n_shards`-th index, so the partition only depends on
+    the grid and the shard count, and each shard gets a similar mix of
+    parameter values.
+    """
+    return np.arange(shard, grid_size, n_shards)
+
+
+def load_data(path: str | Path, raw_isd: bool = False) -> pd.DataFrame:
+    """
+    Load projected survey data with LocationID, ISOPleasant and ISOEventful columns.
+
+    Args:
+        path: A csv or parquet file of projected data, or with `raw_isd` a raw
+            ISD csv, which is projected through the `isd_cache`.
+        raw_isd: Whether path is a raw ISD csv.
+
+    Returns:
+        pd.DataFrame: The data.
+    """
+    if raw_isd:
+        return isd_cache.load(path)
+    path = Path(path)
+    if path.suffix == ".parquet":
+        data = pd.read_parquet(path)
+    else:
+        data = pd.read_csv(path)
+    missing = {"LocationID", "ISOPleasant", "ISOEventful"} - set(data.columns)
+    if missing:
+        raise ValueError(f"Data file {path} is missing columns {sorted(missing)}")
+    return data
+
+
+def load_ranking(path: str | Path) -> pd.Series:
+    """
+    Load an a priori ranking from a csv of (LocationID, rank) rows.
+    """
+    return pd.read_csv(path, index_col=0).iloc[:, 0]
+
+
+def evaluate_indices(
+    grid: ParameterGrid,
+    indices: np.ndarray,
+    ranking: pd.Series,
+    data: pd.DataFrame,
+    sample_n: int = 100,
+    seed: int = 0,
+    chunk_size: int = 4096,
+    parallel: bool = True,
+    qmc: bool = False,
+) -> dict:
+    """
+    Sample and score the targets at the given grid indices.
+
+    Each target is sampled with the seed sequence (seed, grid index), so a
+    candidate's result does not depend on which other candidates are
+    evaluated with it, and its samples at a larger sample_n extend those at
+    a smaller one.
+
+    Args:
+        grid (ParameterGrid): The full parameter grid, see `construct_param_grid`.
+        indices (np.ndarray): Grid indices of valid candidates.
+        ranking (pd.Series): Ranking of the locations, indexed by location.
+        data (pd.DataFrame): Projected data of the ranked locations.
+        sample_n (int): Number of samples per target.
+        seed (int): Base seed of the target samples.
+        chunk_size (int): Targets held in memory at once.
+        parallel (bool): Whether to sample and score over a process pool.
+        qmc (bool): Sample the targets with scrambled Sobol points.
+
+    Returns:
+        dict: Compact arrays of the candidates: grid `index`, `xi`, `omega`,
+            `alpha`, `r`, `p`, `wspi` and the K x L `spi` matrix, plus the
+            `locations` order of its columns.
+    """
+    indices = np.asarray(indices, dtype=int)
+    params = DirectParamsBatch.from_params([grid[i] for i in indices])
+    locations = list(ranking.sort_index().index)
+
+    r, p, wspi, spi = [], [], [], []
+    for start in range(0, len(indices), chunk_size):
+        chunk = indices[start : start + chunk_size]
+        jobs = [(grid[i], sample_n, (seed, int(i)), qmc) for i in chunk]
+        if parallel:
+            samples = tqdm_pathos.starmap(_target_sample, jobs)
+        else:
+            samples = [_target_sample(*job) for job in jobs]
+        # Stacked samples are prepared together, see `PreparedSample.stack`
+        chunk_spi, _ = spi_matrix(
+            np.stack(samples), data, locations=locations, parallel=parallel
+        )
+        success = matrix_success(chunk_spi, ranking)
+        r.append(success["r"].to_numpy())
+        p.append(success["p"].to_numpy())
+        wspi.append(success["wspi"].to_numpy())
+        spi.append(chunk_spi.to_numpy(dtype=np.int8))
+
+    def _stack(arrays, dtype, width=()):
+        return np.concatenate(arrays) if arrays else np.empty((0, *width), dtype)
+
+    return {
+        "index": indices,
+        "xi": params.xi,
+        "omega": params.omega,
+        "alpha": params.alpha,
+        "r": _stack(r, float),
+        "p": _stack(p, float),
+        "wspi": _stack(wspi, float),
+        "spi": _stack(spi, np.int8, (len(locations),)),
+        "locations": np.array(locations, dtype=str),
+    }
+
+
+def halving_schedule(sample_n: int, min_sample_n: int, eta: int) -> list[int]:
+    """
+    Target sample sizes of successive-halving rounds, growing by eta up to sample_n.
+
+    No round uses fewer than `MIN_HALVING_SAMPLE_N` points, whatever
+    min_sample_n is, so a small sample_n gives fewer rounds (or only the
+    full-fidelity one).
+    """
+    schedule = [sample_n]
+    while schedule[0] // eta >= max(min_sample_n, MIN_HALVING_SAMPLE_N):
+        schedule.insert(0, schedule[0] // eta)
+    return schedule
+
+
+def successive_halving(
+    grid: ParameterGrid,
+    indices: np.ndarray,
+    ranking: pd.Series,
+    data: pd.DataFrame,
+    sample_n: int = 100,
+    min_sample_n: int = None,
+    eta: int = 3,
+    seed: int = 0,
+    chunk_size: int = 4096,
+    parallel: bool = True,
+    qmc: bool = False,
+) -> tuple[dict, pd.DataFrame]:
+    """
+    Multi-fidelity search: score all candidates on small target samples and
+    only resample the best at larger ones.
+
+    Every round keeps the best 1/eta of its candidates by Spearman r (then
+    WSPI) and multiplies the target sample size by eta, so the final round
+    scores the survivors at the full `sample_n`. Target samples are seeded per
+    grid index, so the final scores equal those of a full grid at `sample_n`.
+
+    Args:
+        grid (ParameterGrid): The full parameter grid.
+        indices (np.ndarray): Grid indices of valid candidates.
+        ranking (pd.Series): Ranking of the locations, indexed by location.
+        data (pd.DataFrame): Projected data of the ranked locations.
+        sample_n (int): Target sample size of the final round.
+        min_sample_n (int): Target sample size of the first round. Defaults to
+            sample_n / eta**3, i.e. four rounds. Rounds never use fewer than
+            `MIN_HALVING_SAMPLE_N` points.
+        eta (int): Reduction factor per round.
+        seed (int): Base seed of the target samples.
+        chunk_size (int): Targets held in memory at once.
+        parallel (bool): Whether to sample and score over a process pool.
+        qmc (bool): Sample the targets with scrambled Sobol points.
+
+    Returns:
+        tuple: The final round's results (see `evaluate_indices`) and a table
+            of the rounds with their sample_n and number of candidates.
+    """
+    if min_sample_n is None:
+        min_sample_n = sample_n // eta**3
+    schedule = halving_schedule(sample_n, min_sample_n, eta)
+
+    indices = np.asarray(indices, dtype=int)
+    rounds = []
+    for k, n in enumerate(schedule):
+        result = evaluate_indices(
+            grid, indices, ranking, data, n, seed, chunk_size, parallel, qmc
+        )
+        rounds.append({"sample_n": n, "candidates": len(indices)})
+        if k < len(schedule) - 1:
+            keep = -(-len(indices) // eta)
+            best = np.lexsort((-result["wspi"], -result["r"]))[:keep]
+            indices = indices[np.sort(best)]
+    return result, pd.DataFrame(rounds)
+
+
+def halving_summary(rounds: pd.DataFrame, sample_n: int) -> dict:
+    """
+    Cost of a (successive-halving) search compared with scoring every
+    candidate at full fidelity.
+
+    Args:
+        rounds (pd.DataFrame): Rounds with their sample_n and candidates.
+        sample_n (int): Full-fidelity target sample size.
+
+    Returns:
+        dict: Target evaluations over all rounds, their cost in
+            full-fidelity evaluations (target samples drawn / sample_n), the
+            evaluations of the full grid and the fraction saved.
+    """
+    full = int(rounds["candidates"].iloc[0])
+    samples = int((rounds["sample_n"] * rounds["candidates"]).sum())
+    return {
+        "evaluations": int(rounds["candidates"].sum()),
+        "equivalent_evaluations": samples / sample_n,
+        "full_evaluations": full,
+        "target_samples": samples,
+        "full_target_samples": full * sample_n,
+        "saved": 1 - samples / max(full * sample_n, 1),
+    }
+
+
+def run_shard(
+    grid: ParameterGrid,
+    ranking: pd.Series,
+    data: pd.DataFrame,
+    shard: int = 0,
+    n_shards: int = 1,
+    sample_n: int = 100,
+    seed: int = 0,
+    chunk_size: int = 4096,
+    parallel: bool = True,
+    eta: int = None,
+    min_sample_n: int = None,
+    qmc: bool = False,
+) -> tuple[dict, pd.DataFrame]:
+    """
+    Evaluate one shard of the grid.
+
+    Args:
+        grid (ParameterGrid): The full parameter grid, see `construct_param_grid`.
+        ranking (pd.Series): Ranking of the locations, indexed by location.
+        data (pd.DataFrame): Projected data of the ranked locations.
+        shard (int): Index of this shard.
+        n_shards (int): Total number of shards.
+        sample_n (int): Number of samples per target.
+        seed (int): Base seed of the target samples.
+        chunk_size (int): Targets held in memory at once.
+        parallel (bool): Whether to sample and score over a process pool.
+        eta (int, optional): Evaluate the shard by successive halving with
+            this reduction factor instead of scoring every candidate at
+            sample_n, see `successive_halving`.
+        min_sample_n (int, optional): First-round sample size of successive halving.
+        qmc (bool): Sample the targets with scrambled Sobol points.
+
+    Returns:
+        tuple: The shard's results (see `evaluate_indices`), with only the
+            final-round survivors under successive halving, and the table of
+            evaluation rounds.
+    """
+    indices = shard_indices(len(grid), shard, n_shards)
+    valid = DirectParamsBatch.from_params([grid[i] for i in indices]).valid
+    indices = indices[valid]
+    if eta is None:
+        result = evaluate_indices(
+            grid, indices, ranking, data, sample_n, seed, chunk_size, parallel, qmc
+        )
+        return result, pd.DataFrame(
+            [{"sample_n": sample_n, "candidates": len(indices)}]
+        )
+    return successive_halving(
+        grid,
+        indices,
+        ranking,
+        data,
+        sample_n,
+        min_sample_n,
+        eta,
+        seed,
+        chunk_size,
+        parallel,
+        qmc,
+    )
+
+
+def shard_path(out_dir: str | Path, shard: int, n_shards: int) -> Path:
+    return Path(out_dir) / f"shard-{shard:05d}-of-{n_shards:05d}.npz"
+
+
+def save_shard(path: str | Path, result: dict, meta: dict):
+    """
+    Write a shard's results, renaming into place so a partial file is never read.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    meta = {"version": SHARD_VERSION, **meta}
+    with open(tmp, "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **result)
+    os.replace(tmp, path)
+
+
+def load_shards(paths: list[str | Path]) -> tuple[dict, dict]:
+    """
+    Load and concatenate the shard files of one grid search.
+
+    Returns:
+        tuple: (result, meta) with the arrays of all shards ordered by grid
+            index, and the metadata common to the shards.
+
+    Raises:
+        ValueError: If the files belong to different searches or shards are missing.
+    """
+    results, metas = [], []
+    for path in paths:
+        with np.load(path) as f:
+            metas.append(json.loads(str(f["meta"])))
+            results.append({k: f[k] for k in f.files if k != "meta"})
+    if not metas:
+        raise ValueError("No shard files to merge.")
+
+    def _common(meta):
+        return {k: v for k, v in meta.items() if k not in ("shard", "rounds")}
+
+    meta = _common(metas[0])
+    if meta["version"] != SHARD_VERSION:
+        raise ValueError(f"Unsupported shard version {meta['version']}")
+    if any(_common(m) != meta for m in metas):
+        raise ValueError("Shard files come from different grid searches.")
+    found = sorted(m["shard"] for m in metas)
+    if found != list(range(meta["n_shards"])):
+        missing = sorted(set(range(meta["n_shards"])) - set(found))
+        raise ValueError(f"Missing or duplicated shards: missing {missing}")
+
+    merged = {
+        k: np.concatenate([res[k] for res in results])
+        for k in results[0]
+        if k != "locations"
+    }
+    order = np.argsort(merged["index"], kind="stable")
+    merged = {k: v[order] for k, v in merged.items()}
+    merged["locations"] = results[0]["locations"]
+    # Total cost over the shards, round by round
+    rounds = pd.concat([pd.DataFrame(m["rounds"]) for m in metas])
+    rounds = rounds.groupby("sample_n", sort=True)["candidates"].sum()
+    meta["rounds"] = json.loads(rounds.reset_index().to_json(orient="records"))
+    return merged, meta
+
+
+def pareto_mask(*objectives: np.ndarray) -> np.ndarray:
+    """
+    Mask of the non-dominated points when maximising two objectives.
+
+    Args:
+        objectives: Two arrays of objective values, e.g. Spearman r and WSPI.
+
+    Returns:
+        np.ndarray: Boolean mask of the Pareto set. Identical points are all kept.
+    """
+    a, b = (np.asarray(o, dtype=float) for o in objectives)
+    if len(a) == 0:
+        return np.zeros(0, dtype=bool)
+    # Sweep groups of equal a from best to worst; a point survives if it is
+    # the best b of its group and beats every b of the groups before it.
+    order = np.lexsort((-b, -a))
+    a_sorted, b_sorted = a[order], b[order]
+    starts = np.flatnonzero(np.r_[True, a_sorted[1:] != a_sorted[:-1]])
+    group_best = b_sorted[starts]
+    prev_best = np.r_[-np.inf, np.maximum.accumulate(group_best)[:-1]]
+    sizes = np.diff(np.r_[starts, len(a)])
+    keep = (b_sorted == np.repeat(group_best, sizes)) & (
+        b_sorted > np.repeat(prev_best, sizes)
+    )
+    mask = np.zeros(len(a), dtype=bool)
+    mask[order[keep]] = True
+    return mask
+
+
+def results_table(result: dict) -> pd.DataFrame:
+    """
+    Merged shard results as a table indexed by grid index.
+    """
+    xi, omega, alpha = result["xi"], result["omega"], result["alpha"]
+    table = pd.DataFrame(
+        {
+            "xi_x": xi[:, 0],
+            "xi_y": xi[:, 1],
+            "omega_xx": omega[:, 0, 0],
+            "omega_xy": omega[:, 0, 1],
+            "omega_yy": omega[:, 1, 1],
+            "alpha_x": alpha[:, 0],
+            "alpha_y": alpha[:, 1],
+            "r": result["r"],
+            "p": result["p"],
+            "wspi": result["wspi"],
+        },
+        index=pd.Index(result["index"], name="grid_index"),
+    )
+    spi = pd.DataFrame(
+        result["spi"],
+        index=table.index,
+        columns=[f"SPI_{loc}" for loc in result["locations"]],
+    )
+    return pd.concat([table, spi], axis=1)
+
+
+def merge_shards(paths: list[str | Path], out_dir: str | Path) -> dict:
+    """
+    Assemble the global Spearman and WSPI tables and the Pareto set of a sharded search.
+
+    Writes spearman.csv and wspi.csv (all candidates, best first) and
+    pareto.csv (the candidates not dominated in both r and WSPI) to out_dir.
+
+    Returns:
+        dict: The three tables by name.
+    """
+    result, meta = load_shards(paths)
+    table = results_table(result)
+    tables = {
+        "spearman": table.sort_values(["r", "wspi"], ascending=False),
+        "wspi": table.sort_values(["wspi", "r"], ascending=False),
+        "pareto": table[pareto_mask(table["r"], table["wspi"])].sort_values(
+            "r", ascending=False
+        ),
+    }
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, tbl in tables.items():
+        tbl.to_csv(out_dir / f"{name}.csv")
+    meta["cost"] = halving_summary(pd.DataFrame(meta["rounds"]), meta["sample_n"])
+    (out_dir / "meta.json").write_text(json.dumps(meta, indent=2))
+    return tables
+
+
+def refine_results(
+    table: pd.DataFrame,
+    ranking: pd.Series,
+    data: pd.DataFrame,
+    top: int = 5,
+    sample_n: int = 100,
+    seed: int = 0,
+    maxiter: int = 50,
+    smooth_n: int = 500,
+) -> pd.DataFrame:
+    """
+    Polish the best candidates of a search with gradient-based refinement.
+
+    Each of the first `top` rows of a merged results table (see
+    `results_table`) is refined with `smooth_spi.refine`, and both the start
+    and the refined target are scored on the exact objective with samples
+    seeded by (seed, grid index).
+
+    Args:
+        table (pd.DataFrame): Results indexed by grid index, best first.
+        ranking (pd.Series): Ranking of the locations, indexed by location.
+        data (pd.DataFrame): Projected data of the ranked locations.
+        top (int): Number of rows to refine.
+        sample_n (int): Target sample size of the exact scoring.
+        seed (int): Base seed of the samples.
+        maxiter (int): Maximum quasi-Newton iterations per candidate.
+        smooth_n (int): Size of the reparameterised sample of the relaxed objective.
+
+    Returns:
+        pd.DataFrame: Refined parameters with the exact r and WSPI before and
+            after refinement, indexed by grid index.
+    """
+    rows, starts, refined = [], [], []
+    for idx, row in table.head(top).iterrows():
+        start = row_target(row, sample_n, seed)
+        tgt, res = smooth_spi.refine(
+            start, data, ranking, n=smooth_n, maxiter=maxiter, rng=(seed, int(idx))
+        )
+        tgt.sample(n=sample_n, rng=np.random.default_rng((seed, int(idx))))
+        starts.append(start)
+        refined.append(tgt)
+        rows.append(
+            {
+                "grid_index": idx,
+                "xi_x": tgt.dp.xi[0],
+                "xi_y": tgt.dp.xi[1],
+                "omega_xx": tgt.dp.omega[0, 0],
+                "omega_xy": tgt.dp.omega[0, 1],
+                "omega_yy": tgt.dp.omega[1, 1],
+                "alpha_x": tgt.dp.alpha[0],
+                "alpha_y": tgt.dp.alpha[1],
+                "iterations": res.nit,
+                "smooth_objective": res.fun,
+            }
+        )
+
+    locations = list(ranking.sort_index().index)
+    before = matrix_success(spi_matrix(starts, data, locations=locations)[0], ranking)
+    after = matrix_success(spi_matrix(refined, data, locations=locations)[0], ranking)
+    out = pd.DataFrame(rows).set_index("grid_index")
+    out["r_start"], out["wspi_start"] = before["r"].values, before["wspi"].values
+    out["r"], out["wspi"] = after["r"].values, after["wspi"].values
+    return out
+
+
 if __name__ == "__main__":
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="Grid Search CLI")
-    parser.add_argument(
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Evaluate the grid, or one shard of it, and save the results"
+    )
+    run_parser.add_argument(
+        "--data", required=True, help="Projected data file (csv or parquet)"
+    )
+    run_parser.add_argument(
+        "--raw_isd",
+        action="store_true",
+        help="Treat --data as a raw ISD csv and project it through the ISD cache",
+    )
+    run_parser.add_argument(
+        "--ranking", required=True, help="csv of LocationID, rank rows"
+    )
+    run_parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=(0, 1),
+        help="Evaluate shard i of N of the grid, given as i/N",
+    )
+    run_parser.add_argument(
+        "--out", default="grid_results", help="Directory for the shard results"
+    )
+    run_parser.add_argument(
+        "--seed", type=int, default=0, help="Base seed of the target samples"
+    )
+    run_parser.add_argument(
         "--variance_range",
         type=float,
         nargs=2,
         default=[0, 1],
         help="Range of variances",
     )
-    parser.add_argument(
+    run_parser.add_argument(
         "--variance_n", type=int, default=10, help="Number of variance values"
     )
-    parser.add_argument(
+    run_parser.add_argument(
         "--covariance_range",
         type=float,
         nargs=2,
         default=[-1, 1],
         help="Range of covariances",
     )
-    parser.add_argument(
+    run_parser.add_argument(
         "--covariance_n", type=int, default=10, help="Number of covariance values"
     )
-    parser.add_argument(
+    run_parser.add_argument(
         "--xi_range", type=float, nargs=2, default=[0, 1], help="Range of xi values"
     )
-    parser.add_argument("--xi_n", type=int, default=10, help="Number of xi values")
-    parser.add_argument(
+    run_parser.add_argument("--xi_n", type=int, default=10, help="Number of xi values")
+    run_parser.add_argument(
         "--alpha_range",
         type=float,
         nargs=2,
         default=[0, 1],
         help="Range of alpha values",
     )
-    parser.add_argument(
+    run_parser.add_argument(
         "--alpha_n", type=int, default=10, help="Number of alpha values"
     )
-    parser.add_argument("--sample_n", type=int, default=100, help="Number of samples")
-    parser.add_argument("--parallel", action="store_true", help="Run in parallel")
-    args = parser.parse_args()
+    run_parser.add_argument(
+        "--sample_n", type=int, default=100, help="Number of samples"
+    )
+    run_parser.add_argument("--parallel", action="store_true", help="Run in parallel")
+    run_parser.add_argument(
+        "--qmc",
+        action="store_true",
+        help="Sample targets with scrambled Sobol points (lower SPI variance)",
+    )
+    run_parser.add_argument(
+        "--halving",
+        type=int,
+        metavar="ETA",
+        help="Search by successive halving, keeping 1/ETA of candidates per round",
+    )
+    run_parser.add_argument(
+        "--min_sample_n",
+        type=int,
+        help="Samples per target in the first successive-halving round "
+        f"(at least {MIN_HALVING_SAMPLE_N})",
+    )
 
-    # Construct omega grid
-    omega_grid = construct_omega_grid(
-        variance_range=args.variance_range,
-        variance_n=args.variance_n,
-        covariance_range=args.covariance_range,
-        covariance_n=args.covariance_n,
+    merge_parser = subparsers.add_parser(
+        "merge", help="Merge shard results into global tables and the Pareto set"
+    )
+    merge_parser.add_argument("shards", nargs="+", help="Shard result files")
+    merge_parser.add_argument(
+        "--out", default="grid_results", help="Directory for the merged tables"
     )
 
-    # Construct target grid
-    targets = construct_target_grid(
-        omega_grid=omega_grid,
-        xi_range=args.xi_range,
-        xi_n=args.xi_n,
-        alpha_range=args.alpha_range,
-        alpha_n=args.alpha_n,
-        sample_n=args.sample_n,
-        parallel=args.parallel,
+    refine_parser = subparsers.add_parser(
+        "refine", help="Polish the best merged results by gradient-based refinement"
+    )
+    refine_parser.add_argument(
+        "results", help="Merged results table, e.g. pareto.csv or spearman.csv"
+    )
+    refine_parser.add_argument(
+        "--data", required=True, help="Projected data file (csv or parquet)"
+    )
+    refine_parser.add_argument(
+        "--raw_isd",
+        action="store_true",
+        help="Treat --data as a raw ISD csv and project it through the ISD cache",
+    )
+    refine_parser.add_argument(
+        "--ranking", required=True, help="csv of LocationID, rank rows"
     )
+    refine_parser.add_argument(
+        "--top", type=int, default=5, help="Number of rows to refine"
+    )
+    refine_parser.add_argument(
+        "--maxiter", type=int, default=50, help="Quasi-Newton iterations per row"
+    )
+    refine_parser.add_argument(
+        "--sample_n", type=int, default=100, help="Samples per target when scoring"
+    )
+    refine_parser.add_argument("--seed", type=int, default=0, help="Base seed")
+    refine_parser.add_argument(
+        "--out", default="refined.csv", help="File for the refined parameters"
+    )
+    args = parser.parse_args()
 
-    # Define ranking and data
-    ranking = pd.Series([1, 2, 3, 4, 5])
-    data = pd.DataFrame(
-        {
-            "LocationID": [1, 2, 3, 4, 5],
-            "ISOPleasant": [0.1, 0.2, 0.3, 0.4, 0.5],
-            "ISOEventful": [0.5, 0.4, 0.3, 0.2, 0.1],
+    if args.command == "merge":
+        tables = merge_shards(args.shards, args.out)
+        print(tables["pareto"])
+    elif args.command == "refine":
+        ranking = load_ranking(args.ranking)
+        data = load_data(args.data, raw_isd=args.raw_isd)
+        data = data[data["LocationID"].isin(ranking.index)]
+        table = pd.read_csv(args.results, index_col=0)
+        refined = refine_results(
+            table,
+            ranking,
+            data,
+            top=args.top,
+            sample_n=args.sample_n,
+            seed=args.seed,
+            maxiter=args.maxiter,
+        )
+        refined.to_csv(args.out)
+        print(refined)
+    else:
+        grid_spec = {
+            "variance_range": args.variance_range,
+            "variance_n": args.variance_n,
+            "covariance_range": args.covariance_range,
+            "covariance_n": args.covariance_n,
+            "xi_range": args.xi_range,
+            "xi_n": args.xi_n,
+            "alpha_range": args.alpha_range,
+            "alpha_n": args.alpha_n,
         }
-    )
 
-    # Run grid search
-    r_res, wspi_res, targets = run_grid(targets, ranking, data)
+        # Construct omega and parameter grids
+        omega_grid = construct_omega_grid(
+            variance_range=args.variance_range,
+            variance_n=args.variance_n,
+            covariance_range=args.covariance_range,
+            covariance_n=args.covariance_n,
+        )
+        grid = construct_param_grid(
+            omega_grid,
+            xi_range=args.xi_range,
+            xi_n=args.xi_n,
+            alpha_range=args.alpha_range,
+            alpha_n=args.alpha_n,
+        )
+
+        # Define ranking and data
+        ranking = load_ranking(args.ranking)
+        data = load_data(args.data, raw_isd=args.raw_isd)
+        data = data[data["LocationID"].isin(ranking.index)]
+
+        # Run this shard of the grid search
+        shard, n_shards = args.shard
+        result, rounds = run_shard(
+            grid,
+            ranking,
+            data,
+            shard=shard,
+            n_shards=n_shards,
+            sample_n=args.sample_n,
+            seed=args.seed,
+            parallel=args.parallel,
+            eta=args.halving,
+            min_sample_n=args.min_sample_n,
+            qmc=args.qmc,
+        )
+        cost = halving_summary(rounds, args.sample_n)
+        print(rounds.to_string(index=False))
+        print(
+            f"Cost {cost['equivalent_evaluations']:.0f} full-fidelity evaluations "
+            f"instead of {cost['full_evaluations']} ({cost['saved']:.0%} saved)"
+        )
+        meta = {
+            "shard": shard,
+            "n_shards": n_shards,
+            "grid_size": len(grid),
+            "grid": grid_spec,
+            "sample_n": args.sample_n,
+            "seed": args.seed,
+            "qmc": args.qmc,
+            "data": Path(args.data).name,
+            "ranking": json.loads(ranking.to_json()),
+            "halving": {"eta": args.halving, "min_sample_n": args.min_sample_n},
+            "rounds": json.loads(rounds.to_json(orient="records")),
+        }
+        save_shard(shard_path(args.out, shard, n_shards), result, meta)
@@ -0,0 +1,117 @@
+"""
+Quadrant counts of 2D samples around query points.
+
+These are the building block of the exact two-sample 2D KS statistic of
+`KS2D.ks2d2s`: quadrants use strict inequalities, so points tied with an
+origin fall in no quadrant. They are shared by `KS2D`, `spi_matrix` and
+`ks_null`, and only depend on numpy.
+"""
+
+import numpy as np
+
+# Upper limit on the number of query x sample comparisons held in memory
+CHUNK_ELEMENTS = 2**20
+
+
+def quadrant_counts(
+    query: np.ndarray, points: np.ndarray, weights: np.ndarray = None
+) -> np.ndarray:
+    """
+    Count the points of a sample in the four quadrants around each query point.
+
+    Queries are processed in chunks so that at most `CHUNK_ELEMENTS`
+    comparisons are held in memory at once.
+
+    Args:
+        query: (m, 2) array of quadrant origins.
+        points: (n, 2) array of sample points.
+        weights: Optional (n,) integer multiplicities of the points, e.g.
+            `lattice.WeightedSample.weights`. The counts are then the number
+            of observations in each quadrant.
+
+    Returns:
+        np.ndarray: (m, 4) int32 counts in the order (pp, np, pn, nn) used by
+            `KS2D.CountQuads`, where p/n stand for strictly greater/smaller in
+            x then y. Points tied with the origin fall in no quadrant.
+
+    """
+    x, y = points[None, :, 0], points[None, :, 1]
+    if weights is not None:
+        # Integer sums are exact in float64, and go through BLAS
+        weights = np.asarray(weights, dtype=np.float64)
+    chunk = max(1, CHUNK_ELEMENTS // max(len(points), 1))
+    counts = np.empty((len(query), 4), dtype=np.int32)
+    for start in range(0, len(query), chunk):
+        q = query[start : start + chunk]
+        x_gt, x_lt = x > q[:, 0:1], x < q[:, 0:1]
+        y_gt, y_lt = y > q[:, 1:2], y < q[:, 1:2]
+        masks = (x_gt & y_gt, x_lt & y_gt, x_gt & y_lt, x_lt & y_lt)
+        if weights is None:
+            counts[start : start + chunk] = np.column_stack(
+                [m.sum(axis=1) for m in masks]
+            )
+        else:
+            counts[start : start + chunk] = np.rint(
+                np.column_stack([m @ weights for m in masks])
+            )
+    return counts
+
+
+def self_quadrant_counts(samples: np.ndarray) -> np.ndarray:
+    """
+    Quadrant counts of each sample around its own points, for stacked samples.
+
+    Equals `quadrant_counts(s, s)` for every sample s, in O(n log^2 n) per
+    sample instead of O(n^2): with rx, ry the ranks of a point's coordinates
+    and nn the number of points below and left of it, the four counts are
+    (n - 1 - rx - ry + nn, rx - nn, ry - nn, nn) when no coordinates are tied.
+    nn is counted by a bottom-up merge over the points sorted by x, where each
+    point of a right block counts the smaller y ranks in its left block with
+    one `searchsorted` per level for all samples at once. Samples with tied
+    coordinates are counted directly.
+
+    Args:
+        samples: (k, n, 2) stacked samples.
+
+    Returns:
+        np.ndarray: (k, n, 4) int32 counts in the order of `quadrant_counts`.
+    """
+    k, n, _ = samples.shape
+    order_x = np.argsort(samples[..., 0], axis=1, kind="stable")
+    order_y = np.argsort(samples[..., 1], axis=1, kind="stable")
+    rank_x, rank_y = np.empty((k, n), np.int64), np.empty((k, n), np.int64)
+    np.put_along_axis(rank_x, order_x, np.arange(n)[None, :], axis=1)
+    np.put_along_axis(rank_y, order_y, np.arange(n)[None, :], axis=1)
+
+    # y ranks in x order, padded to a power of two with ranks above all others
+    size = 1 << max(n - 1, 0).bit_length()
+    ys = np.full((k, size), n, np.int64)
+    ys[:, :n] = np.take_along_axis(rank_y, order_x, axis=1)
+    below = np.zeros((k, size), np.int64)
+    width = 1
+    while width < size:
+        m = size // (2 * width)
+        pairs = ys.reshape(k, m, 2, width)
+        # Offsets keep the blocks of every sample apart in one sorted array
+        offsets = (np.arange(k * m).reshape(k, m, 1)) * (n + 1)
+        left = (np.sort(pairs[:, :, 0, :], axis=-1) + offsets).ravel()
+        right = (pairs[:, :, 1, :] + offsets).ravel()
+        starts = (np.arange(k * m) * width).repeat(width)
+        counts = np.searchsorted(left, right, side="left") - starts
+        below.reshape(k, m, 2, width)[:, :, 1, :] += counts.reshape(k, m, width)
+        width *= 2
+
+    nn = np.empty((k, n), np.int64)
+    np.put_along_axis(nn, order_x, below[:, :n], axis=1)
+    out = np.stack(
+        [n - 1 - rank_x - rank_y + nn, rank_x - nn, rank_y - nn, nn], axis=-1
+    ).astype(np.int32)
+
+    sorted_x = np.take_along_axis(samples[..., 0], order_x, axis=1)
+    sorted_y = np.take_along_axis(samples[..., 1], order_y, axis=1)
+    tied = (np.diff(sorted_x, axis=1) == 0).any(axis=1) | (
+        np.diff(sorted_y, axis=1) == 0
+    ).any(axis=1)
+    for i in np.flatnonzero(tied):
+        out[i] = quadrant_counts(samples[i], samples[i])
+    return out
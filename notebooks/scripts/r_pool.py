@@ -0,0 +1,110 @@
+"""
+Persistent pool of R-backed worker processes for batched sn calls.
+
+Each worker starts R and loads the `sn` package once, when the pool is
+created, and then serves batches of parameter sets (or datasets) with a
+single vectorised R call per batch. This amortises the R start-up and rpy2
+bridge cost over hundreds of targets, where calling `rpyskewnorm.sample_msn`
+per target pays it every time.
+
+Example:
+    with RWorkerPool(processes=8) as pool:
+        samples = pool.sample_msn(xi, omega, alpha, n=1000)
+"""
+
+import numpy as np
+from pathos.helpers import mp
+
+
+def _init_worker():
+    # Runs once per worker: start R, load sn and parse the batch helpers
+    import scripts.rpyskewnorm as rsn
+
+    rsn._r_function("rmsn_batch")
+    rsn._r_function("selm_batch")
+
+
+def _sample_batch(xi, omega, alpha, n):
+    import scripts.rpyskewnorm as rsn
+
+    return rsn.sample_msn_batch(xi, omega, alpha, n)
+
+
+def _fit_batch(datasets):
+    import scripts.rpyskewnorm as rsn
+
+    return rsn.selm_batch(datasets)
+
+
+def _batches(k: int, batch_size: int) -> list[slice]:
+    return [slice(i, i + batch_size) for i in range(0, k, batch_size)]
+
+
+class RWorkerPool:
+    """
+    A pool of worker processes, each with R and `sn` loaded once at start.
+
+    Attributes:
+        processes (int): Number of worker processes.
+        batch_size (int): Default number of parameter sets per R call.
+    """
+
+    def __init__(self, processes: int = None, batch_size: int = 100):
+        self.processes = processes or mp.cpu_count()
+        self.batch_size = batch_size
+        self.pool = mp.Pool(self.processes, initializer=_init_worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def sample_msn(
+        self,
+        xi: np.ndarray,
+        omega: np.ndarray,
+        alpha: np.ndarray,
+        n: int = 1000,
+        batch_size: int = None,
+    ) -> np.ndarray:
+        """
+        Sample from k multivariate skew-normals with sn::rmsn.
+
+        Args:
+            xi: (k, d) stacked locations.
+            omega: (k, d, d) stacked scale matrices.
+            alpha: (k, d) stacked shapes.
+            n: Number of samples per parameter set.
+            batch_size: Parameter sets per R call. Defaults to `self.batch_size`.
+
+        Returns:
+            np.ndarray: (k, n, d) samples.
+        """
+        xi, omega, alpha = np.asarray(xi), np.asarray(omega), np.asarray(alpha)
+        batches = _batches(len(xi), batch_size or self.batch_size)
+        results = self.pool.starmap(
+            _sample_batch, [(xi[b], omega[b], alpha[b], n) for b in batches]
+        )
+        return np.concatenate(results)
+
+    def fit_selm(
+        self, datasets: list[np.ndarray], batch_size: int = None
+    ) -> list[tuple[tuple, tuple]]:
+        """
+        Fit a multivariate SN to each dataset with sn::selm.fit.
+
+        Args:
+            datasets: List of (n_i, d) arrays.
+            batch_size: Datasets per R call. Defaults to `self.batch_size`.
+
+        Returns:
+            list: (dp, cp) tuples per dataset, see `rpyskewnorm.selm_batch`.
+        """
+        batches = _batches(len(datasets), batch_size or self.batch_size)
+        results = self.pool.map(_fit_batch, [datasets[b] for b in batches])
+        return [fit for batch in results for fit in batch]
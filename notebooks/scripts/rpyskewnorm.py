@@ -3,31 +3,92 @@ import pandas as pd
 from rpy2.robjects import numpy2ri, pandas2ri
 import rpy2.robjects as robjects
 import rpy2.robjects.packages as rpackages
+from rpy2.robjects.conversion import localconverter
 from rpy2.robjects.vectors import StrVector
 import numpy as np
 
 packageNames = ["sn", "tmvtnorm"]
-utils = rpackages.importr("utils")
-utils.chooseCRANmirror(ind=1)
 
-packnames_to_install = [x for x in packageNames if not rpackages.isinstalled(x)]
+# Conversion rules are applied locally to each call rather than activated
+# globally, so importing this module does not change rpy2 for other code.
+converter = robjects.default_converter + numpy2ri.converter + pandas2ri.converter
 
-# Running R in Python example installing packages:
-if len(packnames_to_install) > 0:
-    utils.install_packages(StrVector(packnames_to_install))
+_packages = {}
 
-sn = rpackages.importr("sn")
-tmvtnorm = rpackages.importr("tmvtnorm")
 
-numpy2ri.activate()
-pandas2ri.activate()
+def install_packages(packages: list[str] = packageNames):
+    """
+    Install any missing R packages from CRAN.
+
+    Installation needs network access and is never triggered implicitly.
+    """
+    utils = rpackages.importr("utils")
+    utils.chooseCRANmirror(ind=1)
+
+    packnames_to_install = [x for x in packages if not rpackages.isinstalled(x)]
+    if len(packnames_to_install) > 0:
+        utils.install_packages(StrVector(packnames_to_install))
+
+
+def _package(name: str):
+    # Import the R package on first use
+    if name not in _packages:
+        if not rpackages.isinstalled(name):
+            raise ImportError(
+                f"R package '{name}' is not installed. "
+                "Install it with scripts.rpyskewnorm.install_packages()."
+            )
+        _packages[name] = rpackages.importr(name)
+    return _packages[name]
+
+
+_R_BATCH_CODE = {
+    # One rmsn call per dp set, returned as a single (n, d, k) array
+    "rmsn_batch": """
+        function(xi, Omega, alpha, n) {
+            k <- nrow(xi)
+            d <- ncol(xi)
+            res <- vapply(seq_len(k), function(i) {
+                sn::rmsn(n, xi = xi[i, ], Omega = Omega[, , i], alpha = alpha[i, ])
+            }, numeric(n * d))
+            array(res, dim = c(n, d, k))
+        }
+    """,
+    # One intercept-only SN fit per dataset, keeping only the parameters
+    "selm_batch": """
+        function(ys) {
+            lapply(ys, function(y) {
+                fit <- sn::selm.fit(x = matrix(1, nrow(y), 1), y = y, family = "SN")
+                list(dp = fit$param$dp, cp = fit$param$cp)
+            })
+        }
+    """,
+}
+_r_functions = {}
+
+
+def _r_function(name: str):
+    # Parse the batch helpers once per R session
+    if name not in _r_functions:
+        _package("sn")
+        _r_functions[name] = robjects.r(_R_BATCH_CODE[name])
+    return _r_functions[name]
+
+
+def __getattr__(name: str):
+    # Keep `rsn.sn` and `rsn.tmvtnorm` available, loaded lazily
+    if name in packageNames:
+        return _package(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # %%
 
 
 def selm(x: str, y: str, data: pd.DataFrame):
     formula = f"cbind({x}, {y}) ~ 1"
-    return sn.selm(formula, data=data, family="SN")
+    with localconverter(converter):
+        return _package("sn").selm(formula, data=data, family="SN")
 
 
 def calc_cp(x: str, y: str, data: pd.DataFrame):
@@ -41,31 +102,92 @@ def calc_dp(x: str, y: str, data: pd.DataFrame):
 
 
 def extract_cp(selm_model):
-    return tuple(selm_model.slots["param"][1])
+    with localconverter(converter):
+        return tuple(selm_model.slots["param"][1])
 
 
 def extract_dp(selm_model):
-    return tuple(selm_model.slots["param"][0])
+    with localconverter(converter):
+        return tuple(selm_model.slots["param"][0])
 
 
 def sample_msn(selm_model=None, xi=None, omega=None, alpha=None, n=1000):
-    if selm_model is not None:
-        return sn.rmsn(n, dp=selm_model.slots["param"][0])
-    elif xi is not None and omega is not None and alpha is not None:
-        xi = robjects.FloatVector(xi.T)  # Transpose to make it a column vector
-        omega = robjects.r.matrix(
-            robjects.FloatVector(omega.flatten()),
-            nrow=omega.shape[0],
-            ncol=omega.shape[1],
-        )
-        alpha = robjects.FloatVector(alpha)  # Transpose to make it a column vector
-        return sn.rmsn(n, xi=xi, Omega=omega, alpha=alpha)
-    else:
-        raise ValueError("Either selm_model or xi, omega, and alpha must be provided.")
+    sn = _package("sn")
+    with localconverter(converter):
+        if selm_model is not None:
+            return sn.rmsn(n, dp=selm_model.slots["param"][0])
+        elif xi is not None and omega is not None and alpha is not None:
+            xi = robjects.FloatVector(xi.T)  # Transpose to make it a column vector
+            omega = robjects.r.matrix(
+                robjects.FloatVector(omega.flatten()),
+                nrow=omega.shape[0],
+                ncol=omega.shape[1],
+            )
+            alpha = robjects.FloatVector(alpha)  # Transpose to make it a column vector
+            return sn.rmsn(n, xi=xi, Omega=omega, alpha=alpha)
+        else:
+            raise ValueError(
+                "Either selm_model or xi, omega, and alpha must be provided."
+            )
+
+
+def sample_msn_batch(xi: np.ndarray, omega: np.ndarray, alpha: np.ndarray, n=1000):
+    """
+    Sample from k multivariate skew-normals in a single R call.
+
+    The parameter sets are converted to R once for the whole batch and
+    sampled with one vectorised call, so the rpy2 round trip is paid once
+    per batch rather than once per target.
+
+    Args:
+        xi: (k, d) stacked locations.
+        omega: (k, d, d) stacked scale matrices.
+        alpha: (k, d) stacked shapes.
+        n: Number of samples per parameter set.
+
+    Returns:
+        np.ndarray: (k, n, d) samples.
+    """
+    xi = np.ascontiguousarray(xi, dtype=float)
+    alpha = np.ascontiguousarray(alpha, dtype=float)
+    # R holds the scale matrices as a (d, d, k) array
+    omega = np.ascontiguousarray(np.moveaxis(omega, 0, -1), dtype=float)
+    with localconverter(converter):
+        res = _r_function("rmsn_batch")(xi, omega, alpha, n)
+    return np.moveaxis(np.asarray(res), -1, 0)
+
+
+def selm_batch(datasets: list[np.ndarray]) -> list[tuple[tuple, tuple]]:
+    """
+    Fit an intercept-only multivariate SN to each dataset in a single R call.
+
+    Args:
+        datasets: List of (n_i, d) arrays.
+
+    Returns:
+        list: (dp, cp) per dataset, each a tuple of numpy arrays in the same
+            order as `extract_dp` and `extract_cp`.
+    """
+    ys = robjects.ListVector(
+        {
+            str(i): numpy2ri.py2rpy(np.ascontiguousarray(y, dtype=float))
+            for i, y in enumerate(datasets)
+        }
+    )
+    with localconverter(converter):
+        res = _r_function("selm_batch")(ys)
+        return [
+            (
+                tuple(np.asarray(v) for v in fit.rx2("dp")),
+                tuple(np.asarray(v) for v in fit.rx2("cp")),
+            )
+            for fit in res
+        ]
 
 
 def sample_sn(selm_model, n=1000):
-    return sn.rsn(n, dp=selm_model.slots["param"][0])
+    with localconverter(converter):
+        return _package("sn").rsn(n, dp=selm_model.slots["param"][0])
 
 
 def sample_mtsn(selm_model=None, xi=None, omega=None, alpha=None, a=-1, b=1, n=1000):
@@ -0,0 +1,146 @@
+"""
+Benchmark of SPI precision against target sample size, for pseudo-random and
+quasi-Monte Carlo (scrambled Sobol) target samples.
+
+The SPI of a fixed target against a location is a random quantity through the
+target sample. For each sample size, the target is resampled with `reps`
+seeds and the spread of its (untruncated) SPI, 100 * (1 - D), is reported for
+both samplers. The variance of the pseudo-random SPI falls roughly as
+1 / sample_n, so `efficiency`, the variance ratio random / QMC, is about the
+factor by which QMC reduces the sample size needed for the same precision.
+The mean SPI is reported too: small target samples bias D upwards, and the
+more even Sobol samples converge faster to the large-sample SPI.
+
+    python -m scripts.sampling_benchmark --data data.csv --location CamdenTown
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from scripts.MultiSkewNorm import DirectParams, MultiSkewNorm
+from scripts.spi_matrix import spi_matrix
+
+SAMPLE_NS = (64, 128, 256, 512, 1024, 2048)
+
+
+def spi_spread(
+    dp: DirectParams,
+    test: pd.DataFrame,
+    sample_n: int,
+    reps: int = 50,
+    qmc: bool = False,
+    seed: int = 0,
+    parallel: bool = False,
+) -> np.ndarray:
+    """
+    Untruncated SPIs of one target against a test sample over `reps` resamplings.
+
+    Args:
+        dp: Direct parameters of the target.
+        test: Test data with ISOPleasant and ISOEventful.
+        sample_n: Target sample size.
+        reps: Number of target samples, seeded (seed, rep).
+        qmc: Sample with scrambled Sobol points instead of pseudo-random draws.
+        seed: Base seed.
+        parallel: Whether to score over a process pool.
+
+    Returns:
+        np.ndarray: (reps,) SPIs, 100 * (1 - D).
+    """
+    samples = []
+    for rep in range(reps):
+        tgt = MultiSkewNorm()
+        tgt.define_dp(dp.xi, dp.omega, dp.alpha)
+        samples.append(
+            tgt.sample(
+                sample_n,
+                return_sample=True,
+                rng=np.random.default_rng((seed, rep)),
+                qmc=qmc,
+            )
+        )
+    test = test.assign(LocationID=0)
+    _, D = spi_matrix(samples, test, parallel=parallel)
+    return 100 * (1 - D[0].to_numpy())
+
+
+def compare_samplers(
+    dp: DirectParams,
+    test: pd.DataFrame,
+    sample_ns: tuple = SAMPLE_NS,
+    reps: int = 50,
+    seed: int = 0,
+    parallel: bool = False,
+) -> pd.DataFrame:
+    """
+    SPI mean and standard deviation per sample size for both samplers.
+
+    Returns:
+        pd.DataFrame: Indexed by sample_n, with the mean and std of the SPI for
+            pseudo-random ("random") and Sobol ("qmc") target samples, and the
+            variance ratio `efficiency` = var(random) / var(qmc).
+    """
+    rows = []
+    for n in sample_ns:
+        row = {"sample_n": n}
+        for name, qmc in (("random", False), ("qmc", True)):
+            spi = spi_spread(dp, test, n, reps, qmc, seed, parallel)
+            row[f"mean_{name}"] = spi.mean()
+            row[f"std_{name}"] = spi.std(ddof=1)
+        row["efficiency"] = (row["std_random"] / row["std_qmc"]) ** 2
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("sample_n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="SPI variance versus target sample size, random vs Sobol"
+    )
+    parser.add_argument(
+        "--data", help="Projected data csv; defaults to a simulated test sample"
+    )
+    parser.add_argument("--location", help="LocationID to use as the test sample")
+    parser.add_argument(
+        "--xi", type=float, nargs=2, default=[0.5, 0.7], help="Target location"
+    )
+    parser.add_argument(
+        "--omega",
+        type=float,
+        nargs=4,
+        default=[0.1, 0.05, 0.05, 0.1],
+        help="Target scale matrix, row-major",
+    )
+    parser.add_argument(
+        "--alpha", type=float, nargs=2, default=[0, -5], help="Target shape"
+    )
+    parser.add_argument(
+        "--sample_n", type=int, nargs="+", default=list(SAMPLE_NS), help="Sizes"
+    )
+    parser.add_argument("--reps", type=int, default=50, help="Resamplings per size")
+    parser.add_argument("--seed", type=int, default=0, help="Base seed")
+    parser.add_argument("--parallel", action="store_true", help="Run in parallel")
+    args = parser.parse_args()
+
+    dp = DirectParams(
+        np.array(args.xi), np.array(args.omega).reshape(2, 2), np.array(args.alpha)
+    )
+    if args.data:
+        test = pd.read_csv(args.data)
+        if args.location:
+            test = test[test["LocationID"] == args.location]
+        test = test[["ISOPleasant", "ISOEventful"]]
+    else:
+        # Responses rounded to a lattice, like projected Likert ratings
+        simulated = MultiSkewNorm()
+        simulated.define_dp(np.array([0.3, 0.2]), np.eye(2) * 0.15, np.array([1, 2]))
+        points = simulated.sample(300, return_sample=True, rng=args.seed)
+        test = pd.DataFrame(
+            np.round(points * 8) / 8, columns=["ISOPleasant", "ISOEventful"]
+        )
+
+    table = compare_samplers(
+        dp, test, args.sample_n, args.reps, args.seed, args.parallel
+    )
+    print(table.round(3).to_string())
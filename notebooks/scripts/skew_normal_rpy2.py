@@ -24,27 +24,36 @@ Calling routines in R package sn through rpy2
 -   pdf_skewnormal: returns values for the pdf of a skew normal distribution
 -   cdf_skewnormal: returns values for the cdf of a skew normal distribution
 -   skew_max: returns the maximum skewness of a sn distribution
+
+pdf_skewnormal and cdf_skewnormal are evaluated natively (scripts.msn_native),
+R is only started for the random values.
 """
 
 from math import pi, sqrt, copysign
 
-from rpy2.robjects.packages import importr
-from rpy2.robjects import numpy2ri
 import numpy as np
 
-# from rpy2.robjects.numpy2ri import ri2numpy, numpy2ri
+from scripts import msn_native
+
+_sn = None
 
-numpy2ri.activate()
 
-sn = importr("sn")
+def _sn_package():
+    # Start R and load sn on first use
+    global _sn
+    if _sn is None:
+        from rpy2.robjects.packages import importr
+
+        _sn = importr("sn")
+    return _sn
 
 
 def pdf_skewnormal(x, location=0.0, scale=1.0, shape=0.0):
-    return sn.dsn(numpy2ri(x), location, scale, shape)
+    return msn_native.dsn(x, location, scale, shape)
 
 
 def cdf_skewnormal(x, location=0.0, scale=1.0, shape=0.0):
-    return sn.psn(numpy2ri(x), location, scale, shape)
+    return msn_native.psn(x, location, scale, shape)
 
 
 def rnd_skewnormal(location=0.0, scale=1.0, shape=0.0, size=1):
@@ -59,8 +68,13 @@ def rnd_skewnormal(location=0.0, scale=1.0, shape=0.0, size=1):
 
     http://azzalini.stat.unipd.it/SN/
     """
+    from rpy2 import robjects
+    from rpy2.robjects import numpy2ri
+    from rpy2.robjects.conversion import localconverter
+
     dp = np.array([location, scale, shape])
-    rdata = sn.rsn(n=size, dp=dp)
+    with localconverter(robjects.default_converter + numpy2ri.converter):
+        rdata = _sn_package().rsn(n=size, dp=dp)
     return rdata
 
 
@@ -0,0 +1,287 @@
+"""
+Smooth relaxation of the SPI objective for gradient-based refinement of targets.
+
+`optimize_target.target_success` scores a target through hard quadrant counts
+(`KS2D.ks2d2s`), maxima over quadrants and the ranks of the resulting SPIs, so
+it is piecewise constant in the target parameters and can only be searched
+derivative-free (NSGA-II, grids). Here each non-smooth step is relaxed with a
+temperature:
+
+- quadrant indicators 1[x > o] become sigmoids sigma((x - o) / tau),
+- maxima over origins and quadrants become log-sum-exps with `tau_max`,
+- SPI ranks become soft ranks 1/2 + sum_j sigma((spi_j - spi_i) / tau_rank),
+
+and the target sample is a smooth function of the parameters and fixed base
+noise (`reparam_sample`). As the temperatures go to zero the relaxed SPI tends
+to the KS2D-based SPI (before its truncation to an integer).
+
+Gradients with respect to theta = (xi, Cholesky factor of Omega, alpha) are
+computed by complex-step differentiation: the seven partial derivatives come
+from one vectorised evaluation at complex-perturbed parameters and are exact to
+machine precision, without an autodiff dependency. Every operation on the
+parameters is therefore kept analytic (no abs, max or comparisons on them).
+
+`refine` polishes a target, e.g. from NSGA-II or the grid search, with a
+quasi-Newton method (L-BFGS-B) on the relaxed objective.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import OptimizeResult, minimize
+from scipy.stats import rankdata
+
+from scripts.MultiSkewNorm import DirectParams, MultiSkewNorm
+
+THETA_NAMES = ("xi_x", "xi_y", "L_xx", "L_yx", "L_yy", "alpha_x", "alpha_y")
+# Complex-step size; the derivative has no subtractive cancellation, so it can
+# be far below the square root of machine precision.
+STEP = 1e-20
+# Lower bound on the Cholesky diagonal during refinement
+MIN_SCALE = 1e-3
+
+
+def theta_from_dp(xi: np.ndarray, omega: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """
+    Pack direct parameters into theta = (xi_x, xi_y, L_xx, L_yx, L_yy, alpha_x, alpha_y).
+
+    L is the lower Cholesky factor of omega.
+    """
+    chol = np.linalg.cholesky(np.asarray(omega, dtype=float))
+    return np.concatenate(
+        [np.ravel(xi), [chol[0, 0], chol[1, 0], chol[1, 1]], np.ravel(alpha)]
+    ).astype(float)
+
+
+def dp_from_theta(theta: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Unpack theta into (xi, omega, alpha).
+    """
+    theta = np.asarray(theta, dtype=float)
+    chol = np.array([[theta[2], 0.0], [theta[3], theta[4]]])
+    return theta[0:2].copy(), chol @ chol.T, theta[5:7].copy()
+
+
+def reparam_sample(theta: np.ndarray, noise: np.ndarray) -> np.ndarray:
+    """
+    Skew-normal sample as a smooth function of the parameters.
+
+    With Omega = L L', beta = omega^-1 alpha and u = L' beta,
+
+        X = xi + eta |e0| + L (e - c u u'e),
+
+    where eta = L u / sqrt(1 + u'u) and c = 1 / (s (s + 1)), s = sqrt(1 + u'u).
+    This is the additive representation of `msn_native.sample_msn`, with the
+    covariance Omega - eta eta' of the normal part factorised in closed form.
+
+    Args:
+        theta: (..., 7) parameters, real or complex.
+        noise: (n, 3) fixed standard normal draws (e0, e).
+
+    Returns:
+        np.ndarray: (..., n, 2) sample.
+    """
+    theta = np.asarray(theta)[..., None]
+    l00, l10, l11 = theta[..., 2, :], theta[..., 3, :], theta[..., 4, :]
+    b0 = theta[..., 5, :] / l00
+    b1 = theta[..., 6, :] / np.sqrt(l10**2 + l11**2)
+    u0, u1 = l00 * b0 + l10 * b1, l11 * b1
+    s = np.sqrt(1 + u0**2 + u1**2)
+    c = 1 / (s * (s + 1))
+
+    e0, e1, e2 = np.abs(noise[:, 0]), noise[:, 1], noise[:, 2]
+    proj = c * (u0 * e1 + u1 * e2)
+    v0, v1 = e1 - proj * u0, e2 - proj * u1
+    x = theta[..., 0, :] + l00 * (u0 / s * e0 + v0)
+    y = theta[..., 1, :] + (l10 * u0 + l11 * u1) / s * e0 + l10 * v0 + l11 * v1
+    return np.stack([x, y], axis=-1)
+
+
+def _sigmoid(z):
+    # Evaluated on whichever side keeps exp from overflowing; the branch only
+    # looks at the real part, so it is constant along a complex step.
+    neg = z.real < 0
+    e = np.exp(np.where(neg, z, -z))
+    return np.where(neg, e / (1 + e), 1 / (1 + e))
+
+
+def _soft_max(x, tau: float, axis=None):
+    # tau * log(sum(exp(x / tau))), an upper bound on the maximum within
+    # tau * log(len(x)); shifted by the (real, hence constant) maximum.
+    m = np.max(x.real, axis=axis, keepdims=True)
+    out = m + tau * np.log(np.sum(np.exp((x - m) / tau), axis=axis, keepdims=True))
+    return np.squeeze(out, axis=axis)
+
+
+def smooth_fractions(origins: np.ndarray, points: np.ndarray, tau: float) -> np.ndarray:
+    """
+    Sigmoid-smoothed quadrant fractions of points around each origin.
+
+    Args:
+        origins: (..., m, 2) quadrant origins.
+        points: (..., n, 2) sample points.
+        tau: Temperature of the indicators, in the units of the coordinates.
+
+    Returns:
+        np.ndarray: (..., m, 4) fractions in the order (pp, np, pn, nn) of
+            `KS2D.CountQuads`.
+    """
+    sx = _sigmoid((points[..., None, :, 0] - origins[..., :, None, 0]) / tau)
+    sy = _sigmoid((points[..., None, :, 1] - origins[..., :, None, 1]) / tau)
+    px, py, pp = sx.mean(axis=-1), sy.mean(axis=-1), (sx * sy).mean(axis=-1)
+    return np.stack([pp, py - pp, px - pp, 1 - px - py + pp], axis=-1)
+
+
+class SmoothSPIObjective:
+    """
+    Relaxed `target_success` objective of a target against ranked locations.
+
+    The objective is w_r * (-r) + w_wspi * (-WSPI / 100), the weighted sum of
+    the two NSGA-II objectives of the target optimisation, with a soft
+    Spearman r and a soft WSPI (each SPI weighted by its own soft rank).
+
+    Attributes:
+        noise (np.ndarray): (n, 3) base noise of the reparameterised target sample.
+        tests (list[np.ndarray]): Sample of each location, in ranking index order.
+        ranks (np.ndarray): Ranks of the a priori ranking.
+        weights (tuple): Weights of -r and -WSPI / 100.
+        tau, tau_max, tau_rank (float): Temperatures of the quadrant
+            indicators, of the maxima in D and of the SPI ranks.
+    """
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        ranking: pd.Series,
+        n: int = 500,
+        weights: tuple = (0.5, 0.5),
+        tau: float = 0.05,
+        tau_max: float = 0.01,
+        tau_rank: float = 1.0,
+        group: str = "LocationID",
+        rng: np.random.Generator | int = None,
+    ):
+        ranking = ranking.sort_index()
+        self.noise = np.random.default_rng(rng).standard_normal((n, 3))
+        self.tests = [
+            data.loc[data[group] == loc, ["ISOPleasant", "ISOEventful"]].to_numpy(float)
+            for loc in ranking.index
+        ]
+        self.ranks = rankdata(ranking.to_numpy())
+        self.weights = weights
+        self.tau, self.tau_max, self.tau_rank = tau, tau_max, tau_rank
+        # Fractions of each location around its own points do not depend on theta
+        self._test_self = [smooth_fractions(t, t, tau) for t in self.tests]
+
+    def spi(self, theta: np.ndarray) -> np.ndarray:
+        """
+        Relaxed SPI of the target against every location.
+
+        Args:
+            theta: (..., 7) parameters, real or complex.
+
+        Returns:
+            np.ndarray: (..., L) SPIs on the 0-100 scale.
+        """
+        target = reparam_sample(theta, self.noise)
+        tgt_self = smooth_fractions(target, target, self.tau)
+        spis = []
+        for test, test_self in zip(self.tests, self._test_self):
+            tgt_diff = tgt_self - smooth_fractions(target, test, self.tau)
+            test_diff = smooth_fractions(test, target, self.tau) - test_self
+            d1 = _soft_max(self._signed(tgt_diff), self.tau_max, axis=-1)
+            d2 = _soft_max(self._signed(test_diff), self.tau_max, axis=-1)
+            spis.append(100 * (1 - (d1 + d2) / 2))
+        return np.stack(spis, axis=-1)
+
+    @staticmethod
+    def _signed(diff):
+        # max |d| as the maximum over +d and -d, flattened over points and quadrants
+        flat = diff.reshape(*diff.shape[:-2], -1)
+        return np.concatenate([flat, -flat], axis=-1)
+
+    def success(self, theta: np.ndarray) -> tuple:
+        """
+        Soft Spearman r and soft WSPI of the target.
+
+        Returns:
+            tuple: (r, wspi), each of shape theta.shape[:-1].
+        """
+        spi = self.spi(theta)
+        diff = (spi[..., None, :] - spi[..., :, None]) / self.tau_rank
+        # 1 + number of higher SPIs, with the self comparison sigma(0) = 1/2
+        soft_rank = 0.5 + _sigmoid(diff).sum(axis=-1)
+
+        a = self.ranks - self.ranks.mean()
+        b = soft_rank - soft_rank.mean(axis=-1, keepdims=True)
+        r = (b @ a) / np.sqrt((b * b).sum(axis=-1) * (a @ a))
+        wspi = (spi / soft_rank).sum(axis=-1)
+        return r, wspi
+
+    def __call__(self, theta: np.ndarray) -> np.ndarray:
+        r, wspi = self.success(theta)
+        return -self.weights[0] * r - self.weights[1] * wspi / 100
+
+    def value_and_grad(self, theta: np.ndarray) -> tuple[float, np.ndarray]:
+        """
+        Objective and its gradient with respect to theta, by complex step.
+
+        Args:
+            theta: (7,) parameters.
+
+        Returns:
+            tuple: (value, (7,) gradient).
+        """
+        theta = np.asarray(theta, dtype=float)
+        perturbed = theta + 1j * STEP * np.eye(len(theta))
+        f = self(perturbed)
+        return float(f[0].real), f.imag / STEP
+
+
+def refine(
+    target: MultiSkewNorm | DirectParams,
+    data: pd.DataFrame,
+    ranking: pd.Series,
+    n: int = 500,
+    weights: tuple = (0.5, 0.5),
+    tau: float = 0.05,
+    tau_max: float = 0.01,
+    tau_rank: float = 1.0,
+    maxiter: int = 50,
+    rng: np.random.Generator | int = None,
+) -> tuple[MultiSkewNorm, OptimizeResult]:
+    """
+    Polish a target with L-BFGS-B on the relaxed SPI objective.
+
+    Args:
+        target: Starting target (with direct parameters) or its DirectParams,
+            e.g. the solution selected from an NSGA-II front or a grid search.
+        data: Projected data of the ranked locations.
+        ranking: A priori ranking, indexed by location.
+        n: Size of the reparameterised target sample.
+        weights: Weights of -r and -WSPI / 100 in the objective.
+        tau, tau_max, tau_rank: Temperatures, see `SmoothSPIObjective`.
+        maxiter: Maximum number of quasi-Newton iterations.
+        rng: Random generator or seed of the base noise.
+
+    Returns:
+        tuple: The refined target (parameters defined, not sampled) and the
+            scipy OptimizeResult. Score the refined target with
+            `optimize_target.target_success` to compare on the exact objective.
+    """
+    dp = target.dp if isinstance(target, MultiSkewNorm) else target
+    objective = SmoothSPIObjective(
+        data, ranking, n, weights, tau, tau_max, tau_rank, rng=rng
+    )
+    bounds = [(None, None)] * 2 + [(MIN_SCALE, None), (None, None), (MIN_SCALE, None)]
+    bounds += [(None, None)] * 2
+    res = minimize(
+        objective.value_and_grad,
+        theta_from_dp(dp.xi, dp.omega, dp.alpha),
+        jac=True,
+        method="L-BFGS-B",
+        bounds=bounds,
+        options={"maxiter": maxiter},
+    )
+    refined = MultiSkewNorm()
+    refined.define_dp(*dp_from_theta(res.x))
+    return refined, res
@@ -0,0 +1,226 @@
+"""
+Targets x locations SPI matrices with shared precomputation on both sides.
+
+Scoring K candidate targets against L locations with `MultiSkewNorm.spi`
+repeats, for every pair, the quadrant counts of each sample against itself.
+Those only depend on one side of the comparison, so here every target and
+every location is prepared once (`PreparedSample`) and only the cross terms
+are evaluated per pair, in blocks of targets over a worker pool.
+
+The statistic follows `KS2D.ks2d2s` exactly (strict quadrant inequalities,
+D averaged over both samples), so `spi_matrix` reproduces `MultiSkewNorm.spi`
+for the same target samples.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata, t as t_dist
+from tqdm_pathos import tqdm_pathos
+
+from scripts.lattice import WeightedSample, as_weighted
+from scripts.quadrants import quadrant_counts, self_quadrant_counts
+
+
+class PreparedSample:
+    """
+    A 2D sample with the structures reused across every comparison it is part of.
+
+    Attributes:
+        points (np.ndarray): Contiguous (u, 2) array of coordinates, the unique
+            ones if the sample was deduplicated.
+        weights (np.ndarray): (u,) multiplicities of the points, or None if
+            every point counts once.
+        self_counts (np.ndarray): (u, 4) int32 quadrant counts of the sample
+            around each of its own points.
+        r (float): Pearson correlation of the coordinates, used by the
+            analytic p-value.
+
+    """
+
+    __slots__ = ("points", "weights", "n", "self_counts", "r")
+
+    def __init__(
+        self,
+        points: np.ndarray | pd.DataFrame | WeightedSample,
+        dtype=np.float64,
+        dedupe: bool = False,
+        self_counts: np.ndarray = None,
+    ):
+        if dedupe or isinstance(points, WeightedSample):
+            sample = as_weighted(points, dtype)
+            self.points, self.weights = sample.points, sample.weights
+            self.n = len(sample)
+            self.r = sample.corr()
+        else:
+            if isinstance(points, pd.DataFrame):
+                points = points[["ISOPleasant", "ISOEventful"]].values
+            self.points = np.ascontiguousarray(points, dtype=dtype)
+            self.weights = None
+            self.n = len(self.points)
+            self.r = np.corrcoef(self.points[:, 0], self.points[:, 1])[0, 1]
+        if self_counts is None:
+            self_counts = quadrant_counts(self.points, self.points, self.weights)
+        self.self_counts = self_counts
+
+    @classmethod
+    def stack(cls, samples: np.ndarray, dtype=np.float64) -> list["PreparedSample"]:
+        """
+        Prepare (k, n, 2) stacked samples, counting all self quadrants at once.
+        """
+        samples = np.asarray(samples, dtype=dtype)
+        counts = self_quadrant_counts(samples)
+        return [cls(s, dtype, self_counts=c) for s, c in zip(samples, counts)]
+
+    def __len__(self):
+        # Number of observations, which the quadrant fractions are relative to
+        return self.n
+
+    @property
+    def self_fractions(self) -> np.ndarray:
+        # count * (1.0 / n), as `KS2D.CountQuads`, so D matches bit for bit
+        return self.self_counts * (1.0 / len(self))
+
+    def fractions_at(self, query: np.ndarray) -> np.ndarray:
+        """
+        Quadrant fractions of this sample around each query point.
+        """
+        return quadrant_counts(query, self.points, self.weights) * (1.0 / len(self))
+
+
+def _target_points(target) -> np.ndarray:
+    if isinstance(target, np.ndarray):
+        return target
+    if target.sample_data is None:
+        target.sample()
+    return target.sample_data
+
+
+def _segment_max(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    return np.maximum.reduceat(values, offsets[:-1])
+
+
+def _score_block(
+    targets: list[PreparedSample], locations: list[PreparedSample]
+) -> np.ndarray:
+    """
+    D statistics for a block of prepared targets against all prepared locations.
+    """
+    # Offsets of each sample's (unique) points in the concatenated arrays
+    loc_offsets = np.cumsum([0] + [len(loc.points) for loc in locations])
+    loc_points = np.concatenate([loc.points for loc in locations])
+    loc_self = np.concatenate([loc.self_fractions for loc in locations])
+
+    tgt_offsets = np.cumsum([0] + [len(tgt.points) for tgt in targets])
+    tgt_points = np.concatenate([tgt.points for tgt in targets])
+    tgt_self = np.concatenate([tgt.self_fractions for tgt in targets])
+
+    # Target-side maxima: each location evaluated at every target point at once
+    d1 = np.empty((len(targets), len(locations)))
+    for j, loc in enumerate(locations):
+        diff = np.abs(tgt_self - loc.fractions_at(tgt_points)).max(axis=1)
+        d1[:, j] = _segment_max(diff, tgt_offsets)
+
+    # Location-side maxima: each target evaluated at every location point at once
+    d2 = np.empty((len(targets), len(locations)))
+    for i, tgt in enumerate(targets):
+        diff = np.abs(tgt.fractions_at(loc_points) - loc_self).max(axis=1)
+        d2[i, :] = _segment_max(diff, loc_offsets)
+
+    return (d1 + d2) / 2.0
+
+
+def spi_matrix(
+    targets: list,
+    data: pd.DataFrame,
+    group: str = "LocationID",
+    locations: list = None,
+    block_size: int = 16,
+    parallel: bool = True,
+    dtype=np.float64,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Computes the SPI of every target against every location.
+
+    Args:
+        targets (list): MultiSkewNorm targets (sampled if needed) or (n, 2)
+            arrays of target samples, or a (K, n, 2) array of stacked target
+            samples, whose self quadrant counts are computed together.
+        data (pd.DataFrame): Data with ISOPleasant, ISOEventful and a group column.
+        group (str, optional): The column to group the data by. Defaults to "LocationID".
+        locations (list, optional): Groups to score, e.g. the index of a ranking.
+            Defaults to all groups, sorted.
+        block_size (int, optional): Number of targets scored together per task.
+        parallel (bool, optional): Whether to score blocks over a process pool.
+        dtype (optional): Floating point type to hold the coordinates in.
+            np.float32 halves the footprint of the prepared samples.
+
+    Returns:
+        tuple: (spi, D) DataFrames of shape K x L, indexed by target position
+            with the locations as columns.
+    """
+    assert group in data.columns, f"Group column {group} not in data"
+    grouped = {
+        loc: df[["ISOPleasant", "ISOEventful"]].values
+        for loc, df in data.groupby(group, sort=True)
+    }
+    if locations is None:
+        locations = list(grouped)
+    # Location responses lie on a lattice, so each unique point is scored once
+    prepared_locs = [
+        PreparedSample(grouped[loc], dtype, dedupe=True) for loc in locations
+    ]
+
+    if isinstance(targets, np.ndarray) and targets.ndim == 3:
+        prepared_tgts = PreparedSample.stack(targets, dtype)
+    else:
+        prepared_tgts = [PreparedSample(_target_points(tgt), dtype) for tgt in targets]
+    blocks = [
+        prepared_tgts[i : i + block_size]
+        for i in range(0, len(prepared_tgts), block_size)
+    ]
+
+    if parallel:
+        results = tqdm_pathos.map(_score_block, blocks, prepared_locs)
+    else:
+        results = [_score_block(block, prepared_locs) for block in blocks]
+
+    D = pd.DataFrame(np.concatenate(results), columns=locations)
+    spi = ((1 - D) * 100).astype(int)
+    return spi, D
+
+
+def matrix_success(spi: pd.DataFrame, ranking: pd.Series) -> pd.DataFrame:
+    """
+    Vectorised `optimize_target.target_success` over the rows of an SPI matrix.
+
+    Both pair the ranking with the SPI ranks by location, and rank tied SPIs
+    in location order, so they give the same r, p and WSPI for any ranking.
+
+    Args:
+        spi (pd.DataFrame): K x L SPI matrix from `spi_matrix`.
+        ranking (pd.Series): Ranking of the locations, indexed by location,
+            in any order.
+
+    Returns:
+        pd.DataFrame: Spearman r, its p-value and the weighted SPI per target.
+    """
+    ranking = ranking.sort_index()
+    values = spi[ranking.index].to_numpy()
+    n = values.shape[1]
+
+    # Rank 1 is the highest SPI, and tied SPIs are ranked in location order
+    spi_rank = rankdata(-values, method="ordinal", axis=1)
+    a = rankdata(ranking.to_numpy())
+    a = (a - a.mean()) / np.sqrt(((a - a.mean()) ** 2).sum())
+    b = spi_rank - spi_rank.mean(axis=1, keepdims=True)
+    b = b / np.sqrt((b**2).sum(axis=1, keepdims=True))
+    r = np.clip(b @ a, -1.0, 1.0)
+
+    with np.errstate(divide="ignore"):
+        t_stat = r * np.sqrt((n - 2) / ((1.0 - r) * (1.0 + r)))
+    p = 2 * t_dist.sf(np.abs(t_stat), n - 2)
+
+    # Same pairing of location-ordered ranks and descending SPIs as target_success
+    wspi = (-np.sort(-values, axis=1) / spi_rank).sum(axis=1)
+
+    return pd.DataFrame({"r": r, "p": p, "wspi": wspi}, index=spi.index)
@@ -0,0 +1,285 @@
+"""
+Asynchronous SPI scoring service with micro-batching.
+
+Dashboards score many sites against a handful of published targets. Here each
+target is sampled and prepared once (`spi_matrix.PreparedSample`, holding its
+self quadrant counts) in every worker, and concurrent requests are queued,
+coalesced per target into micro-batches and scored together on a thread or
+process pool, so the per-request cost is only the cross terms of the KS
+statistic. Results are returned as awaitables.
+
+    service = SPIService({"park": park_target}, processes=8)
+    async with service:
+        spi = await service.score("park", test_points)
+
+A minimal HTTP/1.1 front end (`serve`) exposes the service on localhost:
+
+    python -m scripts.spi_service targets.json --port 8765 --processes 8
+
+    POST /spi      {"target": "park", "points": [[x, y], ...]}  ->  {"spi": 72}
+    GET  /targets                                               ->  ["park"]
+"""
+
+import argparse
+import asyncio
+import json
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import pandas as pd
+from pathos.helpers import mp
+
+from scripts.MultiSkewNorm import MultiSkewNorm
+from scripts.spi_matrix import PreparedSample, _score_block
+
+# Prepared targets of this process, filled by `_init_worker`
+_TARGETS: dict[str, PreparedSample] = {}
+
+
+def _init_worker(samples: dict[str, np.ndarray]):
+    # Runs once per worker: prepare every target's sample
+    _TARGETS.update({name: PreparedSample(s) for name, s in samples.items()})
+
+
+def _score_batch(name: str, tests: list[np.ndarray]) -> np.ndarray:
+    # SPIs of one target against a batch of test samples
+    locations = [PreparedSample(t, dedupe=True) for t in tests]
+    D = _score_block([_TARGETS[name]], locations)[0]
+    return ((1 - D) * 100).astype(int)
+
+
+def _test_points(test: pd.DataFrame | np.ndarray) -> np.ndarray:
+    if isinstance(test, pd.DataFrame):
+        test = test[["ISOPleasant", "ISOEventful"]].values
+    test = np.asarray(test, dtype=float)
+    if test.ndim != 2 or test.shape[1] != 2 or len(test) == 0:
+        raise ValueError("Test data must be a non-empty (n, 2) array of points")
+    return test
+
+
+class SPIService:
+    """
+    Micro-batching SPI scorer for a fixed set of targets.
+
+    Requests wait at most `max_delay` seconds for other requests against the
+    same target, and are scored in batches of at most `max_batch` test samples.
+
+    Attributes:
+        samples (dict): Sample of each target, by name.
+        processes (int): Number of pool workers.
+        threads (bool): Use a thread pool instead of a process pool. Threads
+            avoid pickling the tests, processes scale better with many cores.
+        max_batch (int): Maximum test samples per batch.
+        max_delay (float): Maximum seconds a request waits to be batched.
+    """
+
+    def __init__(
+        self,
+        targets: dict[str, MultiSkewNorm],
+        processes: int = None,
+        threads: bool = False,
+        max_batch: int = 64,
+        max_delay: float = 0.005,
+    ):
+        self.samples = {}
+        for name, target in targets.items():
+            if target.sample_data is None:
+                target.sample()
+            self.samples[name] = np.asarray(target.sample_data, dtype=float)
+        self.processes = processes or mp.cpu_count()
+        self.threads = threads
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pool = None
+        self._queue = None
+        self._batcher = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        if self.threads:
+            # Threads share this process's prepared targets
+            _init_worker(self.samples)
+            self.pool = ThreadPool(self.processes)
+        else:
+            self.pool = mp.Pool(
+                self.processes, initializer=_init_worker, initargs=(self.samples,)
+            )
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    @property
+    def targets(self) -> list[str]:
+        return list(self.samples)
+
+    def score(self, target: str, test: pd.DataFrame | np.ndarray) -> asyncio.Future:
+        """
+        Queue an SPI request.
+
+        Args:
+            target: Name of the target.
+            test: Test data as a DataFrame with ISOPleasant and ISOEventful, or
+                an (n, 2) array.
+
+        Returns:
+            asyncio.Future: Resolves to the SPI of the test data against the target.
+
+        Raises:
+            KeyError: If the target is unknown.
+            ValueError: If the test data is not an (n, 2) array of points.
+        """
+        if target not in self.samples:
+            raise KeyError(f"Unknown target {target!r}")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((target, _test_points(test), future))
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(pending) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batches = {}
+            for target, test, future in pending:
+                batches.setdefault(target, []).append((test, future))
+            for target, items in batches.items():
+                for start in range(0, len(items), self.max_batch):
+                    self._submit(loop, target, items[start : start + self.max_batch])
+
+    def _submit(self, loop, target, items):
+        futures = [future for _, future in items]
+
+        def resolve(spis):
+            for future, spi in zip(futures, spis):
+                if not future.done():
+                    future.set_result(int(spi))
+
+        def fail(error):
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+
+        self.pool.apply_async(
+            _score_batch,
+            (target, [test for test, _ in items]),
+            callback=lambda spis: loop.call_soon_threadsafe(resolve, spis),
+            error_callback=lambda error: loop.call_soon_threadsafe(fail, error),
+        )
+
+
+def _response(status: str, body) -> bytes:
+    payload = json.dumps(body).encode()
+    head = (
+        f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n"
+    )
+    return head.encode() + payload
+
+
+async def _handle(service: SPIService, reader, writer):
+    try:
+        request = await reader.readline()
+        method, path, _ = request.decode("latin-1").split(" ", 2)
+        length = 0
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        body = await reader.readexactly(length) if length else b""
+
+        if method == "GET" and path == "/targets":
+            response = _response("200 OK", service.targets)
+        elif method == "POST" and path == "/spi":
+            request = json.loads(body)
+            spi = await service.score(request["target"], request["points"])
+            response = _response("200 OK", {"spi": spi})
+        else:
+            response = _response("404 Not Found", {"error": f"{method} {path}"})
+    except (KeyError, ValueError, TypeError) as error:
+        response = _response("400 Bad Request", {"error": str(error)})
+    writer.write(response)
+    await writer.drain()
+    writer.close()
+
+
+async def serve(service: SPIService, host: str = "127.0.0.1", port: int = 8765):
+    """
+    Serve the SPI service over HTTP until cancelled.
+
+    Args:
+        service: The service, started by this coroutine.
+        host: Interface to bind, localhost by default.
+        port: Port to listen on; 0 picks a free port.
+    """
+    async with service:
+        server = await asyncio.start_server(
+            lambda r, w: _handle(service, r, w), host, port
+        )
+        async with server:
+            await server.serve_forever()
+
+
+def load_targets(path: str, n: int = 1000, seed: int = 0) -> dict[str, MultiSkewNorm]:
+    """
+    Targets from a JSON file of {name: {"xi": [...], "omega": [[...]], "alpha": [...]}}.
+
+    Each target is sampled with n points, seeded by (seed, position in the file).
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    targets = {}
+    for i, (name, dp) in enumerate(spec.items()):
+        tgt = MultiSkewNorm()
+        tgt.define_dp(np.array(dp["xi"]), np.array(dp["omega"]), np.array(dp["alpha"]))
+        tgt.sample(n, rng=np.random.default_rng((seed, i)))
+        targets[name] = tgt
+    return targets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve SPI scores over HTTP")
+    parser.add_argument("targets", help="JSON file of target direct parameters")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--processes", type=int, help="Pool workers")
+    parser.add_argument(
+        "--threads", action="store_true", help="Use a thread pool instead of processes"
+    )
+    parser.add_argument("--sample_n", type=int, default=1000, help="Target sample size")
+    parser.add_argument("--seed", type=int, default=0, help="Base seed of the targets")
+    args = parser.parse_args()
+
+    service = SPIService(
+        load_targets(args.targets, args.sample_n, args.seed),
+        processes=args.processes,
+        threads=args.threads,
+    )
+    print(f"Serving {service.targets} on http://{args.host}:{args.port}")
+    asyncio.run(serve(service, args.host, args.port))
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The analysis code is imported as `scripts.*` from the notebooks directory
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
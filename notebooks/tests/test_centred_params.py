@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from scripts import msn_native
+from scripts.MultiSkewNorm import CentredParams, DirectParams, DirectParamsBatch
+from scripts.skew_normal_rpy2 import skewnormal_stats
+
+
+def random_dp(rng, k):
+    # Positive definite scales from random factors, moderate shapes
+    factors = rng.normal(0, 0.4, (k, 2, 2))
+    omega = factors @ factors.transpose(0, 2, 1) + 0.05 * np.eye(2)
+    return rng.uniform(-0.5, 0.5, (k, 2)), omega, rng.uniform(-5, 5, (k, 2))
+
+
+def test_dp_cp_round_trip():
+    xi, omega, alpha = random_dp(np.random.default_rng(0), 1000)
+    back = msn_native.cp2dp(*msn_native.dp2cp(xi, omega, alpha))
+    for expected, actual in zip((xi, omega, alpha), back):
+        np.testing.assert_allclose(actual, expected, rtol=1e-8, atol=1e-10)
+
+
+def test_univariate_dp2cp_matches_skewnormal_stats():
+    for xi, omega, alpha in [(0.0, 1.0, 0.0), (0.3, 0.5, 4.0), (-1.0, 2.0, -1.5)]:
+        mean, sigma, skew = msn_native.dp2cp(
+            np.array([xi]), np.array([[omega**2]]), np.array([alpha])
+        )
+        expected = skewnormal_stats(xi, omega, alpha)
+        assert mean[0] == pytest.approx(expected[0], abs=1e-12)
+        assert np.sqrt(sigma[0, 0]) == pytest.approx(expected[1], abs=1e-12)
+        assert skew[0] == pytest.approx(expected[2], abs=1e-12)
+
+
+def test_centred_params_from_dp_matches_batch():
+    xi, omega, alpha = random_dp(np.random.default_rng(1), 5)
+    batch = DirectParamsBatch(xi, omega, alpha).to_cp()
+    for i in range(5):
+        cp = CentredParams.from_dp(DirectParams(xi[i], omega[i], alpha[i]))
+        np.testing.assert_allclose(cp.mean, batch[0][i], rtol=1e-14)
+        np.testing.assert_allclose(cp.sigma, batch[1][i], rtol=1e-14)
+        np.testing.assert_allclose(cp.skew, batch[2][i], rtol=1e-14)
+
+
+def test_cp2dp_flags_unreachable_skewness():
+    _, _, alpha = msn_native.cp2dp(
+        np.zeros((1, 2)), np.eye(2)[None], np.array([[0.999, 0.0]])
+    )
+    assert np.isnan(alpha).all()
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from scripts import KS2D, msn_utils
+from scripts.lattice import WeightedSample
+
+
+def lattice_points(rng, n):
+    # Likert projections repeat a few coordinates many times
+    return np.round(rng.normal(0.1, 0.4, (n, 2)) * 4) / 4
+
+
+def test_from_points_keeps_every_observation():
+    points = lattice_points(np.random.default_rng(0), 500)
+    sample = WeightedSample.from_points(points)
+    assert len(sample) == 500
+    assert sample.n_unique < 100
+    expanded = sample.expand()
+    np.testing.assert_array_equal(
+        expanded[np.lexsort(expanded.T[::-1])], points[np.lexsort(points.T[::-1])]
+    )
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_weighted_ks2d2s_is_bit_identical(seed):
+    rng = np.random.default_rng(seed)
+    test = lattice_points(rng, 300)
+    target = rng.normal(0, 0.4, (200, 2))
+    weighted = WeightedSample.from_points(test)
+
+    assert KS2D.ks2d2s(weighted, target)[0] == KS2D.ks2d2s(test, target)[0]
+    assert KS2D.ks2d2s(target, weighted)[0] == KS2D.ks2d2s(target, test)[0]
+    assert (
+        msn_utils.ks2d2s(weighted, target, extra=True)[1]
+        == msn_utils.ks2d2s(test, target, extra=True)[1]
+    )
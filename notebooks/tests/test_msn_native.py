@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from scipy import integrate
+from scipy.stats import multivariate_normal
+
+from scripts import msn_native
+
+XI = np.array([0.1, -0.2])
+OMEGA = np.array([[0.3, 0.12], [0.12, 0.2]])
+POINTS = np.array([[0.0, 0.0], [0.4, -0.3], [-0.5, 0.2], [1.0, 0.8]])
+
+
+def reference_pmsn(x, xi, omega, alpha):
+    # Adaptive integration of the density over (-inf, x]
+    def density(y, x0):
+        return msn_native.dmsn(np.array([x0, y]), xi, omega, alpha)
+
+    value, _ = integrate.dblquad(
+        density, -np.inf, x[0], -np.inf, x[1], epsabs=1e-11, epsrel=1e-10
+    )
+    return value
+
+
+@pytest.mark.parametrize("alpha", [[2.0, -1.0], [-8.0, 15.0]])
+def test_pmsn_matches_integrated_density(alpha):
+    alpha = np.array(alpha)
+    points = POINTS[1:3]
+    expected = [reference_pmsn(x, XI, OMEGA, alpha) for x in points]
+    np.testing.assert_allclose(
+        msn_native.pmsn(points, XI, OMEGA, alpha), expected, rtol=0, atol=1e-8
+    )
+
+
+def test_pmsn_without_skew_is_the_bivariate_normal():
+    scale = np.sqrt(np.diag(OMEGA))
+    rho = OMEGA[0, 1] / (scale[0] * scale[1])
+    z = (POINTS - XI) / scale
+    np.testing.assert_allclose(
+        msn_native.pmsn(POINTS, XI, OMEGA, np.zeros(2)),
+        msn_native.pbvn(z[:, 0], z[:, 1], rho),
+        rtol=0,
+        atol=1e-13,
+    )
+
+
+def test_pbvn_matches_scipy():
+    h, k = POINTS[:, 0], POINTS[:, 1]
+    expected = [
+        multivariate_normal([0, 0], [[1, -0.6], [-0.6, 1]]).cdf([a, b])
+        for a, b in POINTS
+    ]
+    np.testing.assert_allclose(msn_native.pbvn(h, k, -0.6), expected, atol=1e-7)
+
+
+def test_psn_matches_integrated_dsn():
+    for x in (-1.0, 0.0, 0.7):
+        expected, _ = integrate.quad(
+            msn_native.dsn, -np.inf, x, args=(0.2, 0.5, 4.0), epsabs=1e-13
+        )
+        assert msn_native.psn(x, 0.2, 0.5, 4.0) == pytest.approx(expected, abs=1e-12)
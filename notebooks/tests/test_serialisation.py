@@ -0,0 +1,90 @@
+import copy
+import pickle
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import backends
+from scripts.MultiSkewNorm import MultiSkewNorm
+
+
+def make_target():
+    tgt = MultiSkewNorm()
+    tgt.define_dp(
+        np.array([0.2, -0.1]),
+        np.array([[0.2, 0.05], [0.05, 0.15]]),
+        np.array([2.0, -1.0]),
+    )
+    return tgt
+
+
+def assert_same_target(a, b):
+    np.testing.assert_array_equal(a.dp.xi, b.dp.xi)
+    np.testing.assert_array_equal(a.dp.omega, b.dp.omega)
+    np.testing.assert_array_equal(a.dp.alpha, b.dp.alpha)
+    np.testing.assert_array_equal(a.cp.mean, b.cp.mean)
+    np.testing.assert_array_equal(a.cp.sigma, b.cp.sigma)
+    np.testing.assert_array_equal(a.cp.skew, b.cp.skew)
+    np.testing.assert_array_equal(a.sample_data, b.sample_data)
+    assert a.sample_data.dtype == b.sample_data.dtype
+
+
+@pytest.mark.parametrize("qmc", [False, True])
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_seeded_sample_ships_as_its_seed(qmc, dtype):
+    tgt = make_target()
+    tgt.sample(1000, dtype=dtype, rng=np.random.default_rng((3, 7)), qmc=qmc)
+    buffer = tgt.to_bytes()
+    assert len(buffer) < 300
+    assert_same_target(MultiSkewNorm.from_bytes(buffer), tgt)
+    assert_same_target(pickle.loads(pickle.dumps(tgt)), tgt)
+
+
+def test_unseeded_samples_are_stored():
+    tgt = make_target()
+    tgt.sample_data = np.arange(20).reshape(10, 2)
+    restored = MultiSkewNorm.from_bytes(tgt.to_bytes())
+    np.testing.assert_array_equal(restored.sample_data, tgt.sample_data)
+    assert restored.sample_data.dtype == np.float64
+
+    tgt.sample_data = np.array([["a", "b"]])
+    with pytest.raises(ValueError):
+        tgt.to_bytes()
+
+
+def test_fitted_target_pickles_without_its_model(monkeypatch):
+    fits = []
+
+    class Model:
+        def __reduce__(self):
+            raise TypeError("R objects do not pickle")
+
+    def selm(x, y, data):
+        fits.append(len(data))
+        return Model()
+
+    fake_r = types.SimpleNamespace(
+        selm=selm,
+        extract_dp=lambda m: (np.zeros(2), 0.1 * np.eye(2), np.ones(2)),
+        extract_cp=lambda m: (np.zeros(2), 0.1 * np.eye(2), np.zeros(2)),
+    )
+    monkeypatch.setitem(backends._REGISTRY, "r", lambda: fake_r)
+    monkeypatch.delitem(backends._LOADED, "r", raising=False)
+
+    tgt = MultiSkewNorm()
+    tgt.fit(data=pd.DataFrame(np.random.default_rng(0).normal(size=(200, 2))))
+    tgt.sample(100, rng=1)
+
+    restored = pickle.loads(pickle.dumps(tgt))
+    assert_same_target(restored, tgt)
+    pd.testing.assert_frame_equal(restored.data, tgt.data)
+    assert fits == [200]
+    # The model is refitted from the data on first use only
+    assert isinstance(restored.selm_model, Model)
+    assert fits == [200, 200]
+
+    deep = copy.deepcopy(tgt)
+    assert deep.selm_model is tgt.selm_model
+    assert deep.data is not tgt.data
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import KS2D
+from scripts.MultiSkewNorm import MultiSkewNorm
+from scripts.optimize_target import target_success
+from scripts.spi_matrix import matrix_success, spi_matrix
+
+
+def lattice_data(rng, n_locations=6, n=80):
+    # Projected Likert responses share coordinates on a small lattice
+    frames = []
+    for i in range(n_locations):
+        points = np.round(rng.normal([0.2 * i - 0.5, 0.1 * i], 0.4, (n, 2)) * 4) / 4
+        frame = pd.DataFrame(points, columns=["ISOPleasant", "ISOEventful"])
+        frames.append(frame.assign(LocationID=f"L{i}"))
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_spi_matrix_matches_ks2d_on_lattice_data():
+    mismatches = 0
+    for seed in range(20):
+        rng = np.random.default_rng(seed)
+        data = lattice_data(rng)
+        targets = []
+        for _ in range(3):
+            tgt = MultiSkewNorm()
+            tgt.define_dp(
+                rng.uniform(-0.5, 0.5, 2),
+                np.array([[0.1, 0.03], [0.03, 0.1]]),
+                rng.uniform(-3, 3, 2),
+            )
+            tgt.sample(300, rng=rng)
+            targets.append(tgt)
+
+        spi, D = spi_matrix(targets, data, parallel=False)
+        for i, tgt in enumerate(targets):
+            for loc, group in data.groupby("LocationID"):
+                test = group[["ISOPleasant", "ISOEventful"]].values
+                d = KS2D.ks2d2s(tgt.sample_data, test)[0]
+                assert D.loc[i, loc] == d
+                mismatches += int((1 - d) * 100) != spi.loc[i, loc]
+    assert mismatches == 0
+
+
+def test_matrix_success_matches_target_success():
+    rng = np.random.default_rng(0)
+    data = lattice_data(rng)
+    # Copies of locations tie their SPIs under every target
+    copies = data[data["LocationID"].isin(["L1", "L4"])]
+    data = pd.concat([data, copies.assign(LocationID=copies["LocationID"] + "b")])
+    locations = list(rng.permutation(sorted(data["LocationID"].unique())))
+    ranking = pd.Series(rng.permutation(len(locations)) + 1, index=locations)
+
+    targets = []
+    for _ in range(10):
+        tgt = MultiSkewNorm()
+        tgt.define_dp(
+            rng.uniform(-0.5, 0.5, 2),
+            np.array([[0.1, 0.03], [0.03, 0.1]]),
+            rng.uniform(-3, 3, 2),
+        )
+        tgt.sample(300, rng=rng)
+        targets.append(tgt)
+
+    spi, _ = spi_matrix(targets, data, parallel=False)
+    success = matrix_success(spi, ranking)
+    for i, tgt in enumerate(targets):
+        spearman, wspi, _, _ = target_success(tgt, ranking, data)
+        assert success.loc[i, "r"] == pytest.approx(spearman[0])
+        assert success.loc[i, "p"] == pytest.approx(spearman[1])
+        assert success.loc[i, "wspi"] == pytest.approx(wspi)